@@ -20,28 +20,32 @@ import sys
 import yaml
 
 from charmhelpers.core.host import service_pause, service_resume
-from charmhelpers.core.hookenv import action_fail
+from charmhelpers.core.hookenv import action_fail, action_get, action_set
 from charmhelpers.core.unitdata import HookData, kv
-from charmhelpers.contrib.openstack.utils import (
-    get_os_codename_package,
-    set_os_workload_status,
-)
+from lib.misc_utils import LazyConfigs
 from lib.swift_storage_utils import (
-    assess_status,
-    REQUIRED_INTERFACES,
-    SWIFT_SVCS,
+    EXPORTER_SERVICE,
+    get_swift_services,
+    register_configs,
+    set_workload_status,
 )
-from hooks.swift_storage_hooks import (
-    CONFIGS,
+from lib.hook_tools import config
+from lib.profile_utils import PROFILE_KEY, get_profile_report
+from lib.unitdata_utils import install as install_unit_state
+from lib.swift_storage_tuning import (
+    get_node_profile,
+    get_recommendations,
+    is_explicit,
 )
 
+CONFIGS = LazyConfigs(register_configs)
+
 
 def _get_services():
     """Return a list of services that need to be (un)paused."""
-    services = SWIFT_SVCS[:]
-    # Before Icehouse there was no swift-container-sync
-    if get_os_codename_package("swift-container") < "icehouse":
-        services.remove("swift-container-sync")
+    services = get_swift_services()
+    if config('prometheus-exporter'):
+        services.append(EXPORTER_SERVICE)
     return services
 
 
@@ -67,8 +71,7 @@ def pause(args):
             raise Exception("{} didn't stop cleanly.".format(service))
     with HookData()():
         kv().set('unit-paused', True)
-    set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
-                           charm_func=assess_status)
+    set_workload_status(CONFIGS)
 
 
 def resume(args):
@@ -82,13 +85,41 @@ def resume(args):
             raise Exception("{} didn't start cleanly.".format(service))
     with HookData()():
         kv().set('unit-paused', False)
-    set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
-                           charm_func=assess_status)
+    set_workload_status(CONFIGS)
+
+
+def show_tuning(args):
+    """Report the node profile and the auto-tune recommendations."""
+    profile = get_node_profile()
+    results = {}
+    for key, value in profile.items():
+        if isinstance(value, list):
+            value = ' '.join(value)
+        results['profile.{}'.format(key)] = value
+
+    for option, (value, derivation) in get_recommendations(profile).items():
+        applied = config('auto-tune') and not is_explicit(option)
+        results['tuning.{}.recommended'.format(option)] = value
+        results['tuning.{}.derivation'.format(option)] = derivation
+        results['tuning.{}.configured'.format(option)] = config(option)
+        results['tuning.{}.applied'.format(option)] = bool(applied)
+    action_set(results)
+
+
+def hook_profile(args):
+    """Report the slowest phases and commands of recent hooks."""
+    history = kv().get(PROFILE_KEY)
+    if not history:
+        action_fail("No hook profiles recorded, enable hook-profiling")
+        return
+    action_set(get_profile_report(history, hooks=action_get('hooks'),
+                                  top=action_get('top')))
 
 
 # A dictionary of all the defined actions to callables (which take
 # parsed arguments).
-ACTIONS = {"pause": pause, "resume": resume}
+ACTIONS = {"pause": pause, "resume": resume, "show-tuning": show_tuning,
+           "hook-profile": hook_profile}
 
 
 def main(argv):
@@ -96,6 +127,7 @@ def main(argv):
     actions_yaml_path = _get_actions_yaml_path()
     parser = get_action_parser(actions_yaml_path, action_name)
     args = parser.parse_args(argv)
+    install_unit_state()
     try:
         action = ACTIONS[action_name]
     except KeyError:
@@ -24,6 +24,8 @@ from charmhelpers.contrib.openstack.utils import (
 
 from swift_storage_hooks import (
     config_changed,
+    mark_dirty,
+    CONFIG_STEPS,
     CONFIGS,
 )
 
@@ -43,6 +45,9 @@ def openstack_upgrade():
     if (do_action_openstack_upgrade('swift',
                                     do_openstack_upgrade,
                                     CONFIGS)):
+        # No option changes during the action, so every step of
+        # config-changed is flagged to run against the upgraded packages.
+        mark_dirty(*[name for name, _ in CONFIG_STEPS])
         config_changed()
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the swift-storage background daemon tuning tools."""
+
+import contextlib
+import fcntl
+import os
+import re
+import subprocess
+import tempfile
+
+SECTION_RE = re.compile(r'^\[(?P<section>[^\]]+)\]\s*$')
+OPTION_RE = re.compile(r'^(?P<key>[^#;=\s][^=]*?)\s*=')
+# Present when the host runs systemd, as checked by charmhelpers.
+SYSTEMD_SYSTEM = '/run/systemd/system'
+# Lock file, next to the server configs, held while one of them is updated.
+LOCK_NAME = '.swift-background.lock'
+
+
+def update_sections(lines, sections):
+    """Set the given options in the given sections of an ini file.
+
+    Options with a value of None are removed, and sections missing from the
+    file are appended if they have any options to set. Returns the new list
+    of lines and the set of sections that changed.
+    """
+    out = []
+    changed = set()
+    pending = {}
+    seen = set()
+    current = None
+
+    def flush():
+        # Append options that were not already present in the section,
+        # ahead of any blank lines trailing it.
+        if current in pending:
+            blanks = []
+            while out and not out[-1].strip():
+                blanks.append(out.pop())
+            for key, value in sorted(pending.pop(current).items()):
+                if value is not None:
+                    out.append('%s = %s\n' % (key, value))
+                    changed.add(current)
+            out.extend(blanks)
+
+    for line in lines:
+        match = SECTION_RE.match(line)
+        if match:
+            flush()
+            current = match.group('section')
+            if current in sections and current not in seen:
+                pending[current] = dict(sections[current])
+            seen.add(current)
+            out.append(line)
+            continue
+
+        match = OPTION_RE.match(line)
+        if match and current in pending:
+            key = match.group('key').strip()
+            if key in pending[current]:
+                value = pending[current].pop(key)
+                if value is None:
+                    changed.add(current)
+                    continue
+                new = '%s = %s\n' % (key, value)
+                if new != line:
+                    changed.add(current)
+                line = new
+        out.append(line)
+
+    flush()
+    for section in sorted(set(sections) - seen):
+        options = [(option, setting)
+                   for option, setting in sorted(sections[section].items())
+                   if setting is not None]
+        if not options:
+            continue
+        if out and not out[-1].endswith('\n'):
+            out[-1] += '\n'
+        if out and out[-1].strip():
+            out.append('\n')
+        out.append('[%s]\n' % section)
+        out.extend('%s = %s\n' % option for option in options)
+        changed.add(section)
+    return out, changed
+
+
+def reload_daemon(daemon):
+    """Reload daemon if it is running; stopped (eg. paused) ones are left.
+
+    With systemd this goes through the daemon's unit, so that the new
+    processes are started in the unit's cgroup with its resource controls
+    and CPU affinity rather than inheriting those of cron.
+    """
+    if os.path.isdir(SYSTEMD_SYSTEM):
+        unit = 'swift-%s' % daemon
+        status = ['systemctl', 'is-active', '--quiet', unit]
+        reload = ['systemctl', 'reload-or-restart', unit]
+    else:
+        status = ['swift-init', daemon, 'status']
+        reload = ['swift-init', daemon, 'reload']
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(status, stdout=devnull, stderr=devnull):
+            return False
+        subprocess.call(reload, stdout=devnull, stderr=devnull)
+    return True
+
+
+@contextlib.contextmanager
+def config_lock(conf):
+    """Hold the lock serialising updates of the configs beside conf.
+
+    The profile and controller cron jobs both rewrite the server configs,
+    so each read, update and rename is done under this lock.
+    """
+    with open(os.path.join(os.path.dirname(conf), LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def write_settings(conf, sections, lock=True):
+    """Apply update_sections() to conf, returning the changed sections.
+
+    Pass lock=False if the caller already holds config_lock(conf).
+    """
+    if lock:
+        with config_lock(conf):
+            return write_settings(conf, sections, lock=False)
+
+    with open(conf) as f:
+        lines = f.readlines()
+    lines, changed = update_sections(lines, sections)
+    if not changed:
+        return changed
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(conf) or '.',
+                               prefix='.%s.' % os.path.basename(conf))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+        st = os.stat(conf)
+        os.chown(tmp, st.st_uid, st.st_gid)
+        os.chmod(tmp, st.st_mode)
+        os.rename(tmp, conf)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return changed
+
+
+def read_setting(conf, section, key):
+    """Return the value of key in section of conf, or None if unset."""
+    current = None
+    with open(conf) as f:
+        for line in f:
+            match = SECTION_RE.match(line)
+            if match:
+                current = match.group('section')
+                continue
+            match = OPTION_RE.match(line)
+            if match and current == section and \
+                    match.group('key').strip() == key:
+                return line.split('=', 1)[1].strip()
+    return None
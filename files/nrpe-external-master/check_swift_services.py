@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Check the state of all swift daemons in a single pass.
+
+The pid files under /var/run/swift and the process table are read once and
+every daemon's state and worker count is reported in one result, instead
+of running swift-init status once per service.
+"""
+
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+STATUS_OK = 0
+STATUS_WARN = 1
+STATUS_CRIT = 2
+STATUS_UNKNOWN = 3
+
+RUN_DIR = '/var/run/swift'
+PROC_DIR = '/proc'
+
+
+def server_name(service):
+    """Map a service name (eg. swift-object) to its swift-init server."""
+    server = service[len('swift-'):]
+    if '-' not in server:
+        server += '-server'
+    return server
+
+
+def read_processes(proc_dir=PROC_DIR):
+    """Return a dict of pid to (ppid, argv) of every swift process."""
+    processes = {}
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_dir, pid, 'cmdline')) as f:
+                argv = f.read().split('\0')
+            if 'swift-' not in ' '.join(argv):
+                continue
+            with open(os.path.join(proc_dir, pid, 'stat')) as f:
+                # The command name may contain spaces, fields after it don't.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            # The process exited while we were looking at it.
+            continue
+        processes[int(pid)] = (ppid, argv)
+    return processes
+
+
+def read_pidfiles(run_dir=RUN_DIR):
+    """Return a dict of swift-init server name to the pids in its pid files."""
+    pids = {}
+    paths = glob.glob(os.path.join(run_dir, '*.pid'))
+    paths.extend(glob.glob(os.path.join(run_dir, '*', '*.pid')))
+    for path in paths:
+        relative = os.path.relpath(path, run_dir)
+        server = relative.split(os.sep)[0]
+        if server.endswith('.pid'):
+            server = server[:-len('.pid')]
+        try:
+            with open(path) as f:
+                pid = int(f.read().strip())
+        except (IOError, ValueError):
+            continue
+        pids.setdefault(server, []).append(pid)
+    return pids
+
+
+def is_server(argv, server):
+    return any(os.path.basename(arg) == 'swift-' + server for arg in argv)
+
+
+def service_states(services, processes, pidfiles):
+    """Return a list of (service, status, message, workers)."""
+    states = []
+    for service in services:
+        server = server_name(service)
+        members = [pid for pid, (_, argv) in processes.items()
+                   if is_server(argv, server)]
+        parents = [pid for pid in pidfiles.get(server, [])
+                   if pid in processes]
+        if not parents:
+            parents = [pid for pid in members
+                       if processes[pid][0] not in members]
+        workers = len([pid for pid in members
+                       if processes[pid][0] in parents])
+        if not parents:
+            states.append((service, STATUS_CRIT, 'not running', 0))
+        elif pidfiles.get(server) and \
+                len(parents) < len(pidfiles[server]):
+            states.append((service, STATUS_WARN,
+                           'stale pid file, {} workers'.format(workers),
+                           workers))
+        else:
+            states.append((service, STATUS_OK,
+                           'running, {} workers'.format(workers), workers))
+    return states
+
+
+def send_passive(command, host, states):
+    """Submit one result per service to command in send_nsca format."""
+    lines = ''.join('{}\t{}\t{}\t{}\n'.format(host, service, status, message)
+                    for service, status, message, _ in states)
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    proc.communicate(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('services', nargs='+',
+                        help='Services to check, eg. swift-object')
+    parser.add_argument('--passive-host', default=os.uname()[1],
+                        help='Host name used in passive results')
+    # Takes the rest of the command line so the command and its arguments
+    # survive nrpe splitting and rejoining the check command.
+    parser.add_argument('--passive-command', nargs=argparse.REMAINDER,
+                        help='Command per-service passive results are piped '
+                             'to, eg. send_nsca -H nagios')
+    args = parser.parse_args()
+
+    states = service_states(args.services, read_processes(), read_pidfiles())
+    if args.passive_command:
+        send_passive(args.passive_command, args.passive_host, states)
+
+    status = max(state[1] for state in states)
+    problems = ['{} {}'.format(service, message)
+                for service, code, message, _ in states if code != STATUS_OK]
+    perf = ' '.join('{}={}'.format(server_name(service), workers)
+                    for service, _, _, workers in states)
+    summary = '; '.join(problems) or '{} swift services running'.format(
+        len(states))
+    details = '\n'.join('{}: {}'.format(service, message)
+                        for service, _, message, _ in states)
+    label = {STATUS_OK: 'OK', STATUS_WARN: 'WARNING',
+             STATUS_CRIT: 'CRITICAL'}[status]
+    print '{}: {} | {}\n{}'.format(label, summary, perf, details)
+    sys.exit(status)
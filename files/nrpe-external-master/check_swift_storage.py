@@ -6,6 +6,9 @@
 
 import sys
 import json
+import os
+import socket
+import threading
 import urllib2
 import argparse
 import hashlib
@@ -16,6 +19,11 @@ STATUS_WARN = 1
 STATUS_CRIT = 2
 STATUS_UNKNOWN = 3
 
+RINGFILES = ["/etc/swift/object.ring.gz",
+             "/etc/swift/account.ring.gz",
+             "/etc/swift/container.ring.gz"]
+RING_CACHE = "/var/lib/nagios/swift-storage-ringmd5.json"
+
 
 def generate_md5(filename):
     with open(filename, 'rb') as f:
@@ -27,72 +35,251 @@ def generate_md5(filename):
     return md5.hexdigest()
 
 
-def check_md5(base_url):
-    url = base_url + "ringmd5"
-    ringfiles = ["/etc/swift/object.ring.gz",
-                 "/etc/swift/account.ring.gz",
-                 "/etc/swift/container.ring.gz"]
-    results = []
+def cached_md5(filenames, cache_file=RING_CACHE):
+    """Return the md5 of each file, only hashing files that changed.
+
+    Digests are cached in cache_file keyed on the inode, mtime and size of
+    each file. Files which cannot be read are left out of the result.
+    """
     try:
-        data = urllib2.urlopen(url).read()
-        j = json.loads(data)
-    except urllib2.URLError:
-        return [(STATUS_UNKNOWN, "Can't open url: {}".format(url))]
-    except ValueError:
-        return [(STATUS_UNKNOWN, "Can't parse status data")]
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
 
-    for ringfile in ringfiles:
+    digests = {}
+    updated = False
+    for filename in filenames:
         try:
-            if generate_md5(ringfile) != j[ringfile]:
-                results.append((STATUS_CRIT,
-                        "Ringfile {} MD5 sum mismatch".format(ringfile)))
+            st = os.stat(filename)
+            key = [st.st_ino, st.st_mtime, st.st_size]
+            entry = cache.get(filename)
+            if not entry or entry[0] != key:
+                entry = [key, generate_md5(filename)]
+                cache[filename] = entry
+                updated = True
+        except (IOError, OSError):
+            continue
+        digests[filename] = entry[1]
+
+    if updated:
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f)
         except IOError:
+            pass
+    return digests
+
+
+def fetch_recon(base_url, endpoints, timeout):
+    """Query all recon endpoints concurrently.
+
+    Returns a dict of endpoint to the decoded response, or to a
+    (STATUS_UNKNOWN, message) tuple if it could not be fetched in time.
+    """
+    responses = {}
+
+    def fetch(endpoint):
+        url = base_url + endpoint
+        try:
+            data = urllib2.urlopen(url, timeout=timeout).read()
+            responses[endpoint] = json.loads(data)
+        except (urllib2.URLError, socket.error):
+            responses[endpoint] = (STATUS_UNKNOWN,
+                                   "Can't open url: {}".format(url))
+        except ValueError:
+            responses[endpoint] = (STATUS_UNKNOWN,
+                                   "Can't parse status data from {}".format(
+                                       url))
+
+    threads = [threading.Thread(target=fetch, args=(endpoint,))
+               for endpoint in endpoints]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(timeout)
+    for endpoint in endpoints:
+        if endpoint not in responses:
+            responses[endpoint] = (STATUS_UNKNOWN,
+                                   "Timed out querying {}".format(endpoint))
+    return responses
+
+
+def perfdata(label, value, warn='', crit='', uom=''):
+    warn, crit = ['{:g}'.format(i) if i != '' else '' for i in (warn, crit)]
+    return "{}={}{};{};{}".format(label, value, uom, warn, crit)
+
+
+def check_md5(recon, ringfiles=RINGFILES):
+    j = recon["ringmd5"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    digests = cached_md5(ringfiles)
+    for ringfile in ringfiles:
+        if ringfile not in digests:
             results.append(
                 (STATUS_UNKNOWN, "Can't open ringfile {}".format(ringfile)))
-    if results:
-        return results
-    else:
-        return [(STATUS_OK, "OK")]
+        elif digests[ringfile] != j.get(ringfile):
+            results.append((STATUS_CRIT,
+                            "Ringfile {} MD5 sum mismatch".format(ringfile)))
+    return results, []
 
 
-def check_replication(base_url, limits):
+def check_replication(recon, limits):
     types = ["account", "object", "container"]
     results = []
+    perf = []
     for repl in types:
-        url = base_url + "replication/" + repl
-        try:
-            data = urllib2.urlopen(url).read()
-            j = json.loads(data)
-        except urllib2.URLError:
-            results.append((STATUS_UNKNOWN, "Can't open url: {}".format(url)))
-            continue
-        except ValueError:
-            results.append((STATUS_UNKNOWN, "Can't parse status data"))
+        j = recon["replication/" + repl]
+        if isinstance(j, tuple):
+            results.append(j)
             continue
 
         if "object_replication_last" in j:
-            repl_last = datetime.datetime.fromtimestamp(j["object_replication_last"])
+            last = j["object_replication_last"]
         else:
-            repl_last = datetime.datetime.fromtimestamp(j["replication_last"])
+            last = j["replication_last"]
+        if last is None:
+            results.append((STATUS_UNKNOWN,
+                            "'{}' replication has not run".format(repl)))
+            continue
+        repl_last = datetime.datetime.fromtimestamp(last)
         delta = datetime.datetime.now() - repl_last
-        if delta.seconds >= limits[1]:
+        lag = int(delta.total_seconds())
+        perf.append(perfdata("{}_replication_lag".format(repl), lag,
+                             limits[0], limits[1], 's'))
+        if lag >= limits[1]:
             results.append((STATUS_CRIT,
-                "'{}' replication lag is {} seconds".format(repl, delta.seconds)))
-        elif delta.seconds >= limits[0]:
+                "'{}' replication lag is {} seconds".format(repl, lag)))
+        elif lag >= limits[0]:
             results.append((STATUS_WARN,
-                "'{}' replication lag is {} seconds".format(repl, delta.seconds)))
-        if "replication_stats" in j:
+                "'{}' replication lag is {} seconds".format(repl, lag)))
+        if j.get("replication_stats"):
             errors = j["replication_stats"]["failure"]
+            perf.append(perfdata("{}_replication_failures".format(repl),
+                                 errors, limits[2], limits[3]))
             if errors >= limits[3]:
                 results.append(
                     (STATUS_CRIT, "{} replication failures".format(errors)))
             elif errors >= limits[2]:
                 results.append(
                     (STATUS_WARN, "{} replication failures".format(errors)))
+    return results, perf
+
+
+def check_threshold(results, label, value, limits, message, uom=''):
+    """Compare value with (warn, crit) limits, recording the outcome."""
+    if value >= limits[1]:
+        results.append((STATUS_CRIT, message.format(value)))
+    elif value >= limits[0]:
+        results.append((STATUS_WARN, message.format(value)))
+    return perfdata(label, value, limits[0], limits[1], uom)
+
+
+def check_unmounted(recon, limits):
+    j = recon["unmounted"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    devices = sorted(d["device"] for d in j)
+    perf = check_threshold(results, "unmounted", len(devices), limits,
+                           "{} unmounted devices")
     if results:
-        return results
-    else:
-        return [(STATUS_OK, "OK")]
+        results[-1] = (results[-1][0], "{} ({})".format(results[-1][1],
+                                                         ','.join(devices)))
+    return results, [perf]
+
+
+def check_diskusage(recon, limits):
+    j = recon["diskusage"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    perf = []
+    for disk in sorted(j, key=lambda d: d["device"]):
+        if disk.get("mounted") is not True or not disk.get("size"):
+            continue
+        used = int(round(100.0 * disk["used"] / disk["size"]))
+        perf.append(check_threshold(
+            results, "{}_used".format(disk["device"]), used, limits,
+            "device " + disk["device"] + " is {}% full", '%'))
+    return results, perf
+
+
+def check_async(recon, limits):
+    j = recon["async"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    perf = check_threshold(results, "async_pending",
+                           j.get("async_pending") or 0, limits,
+                           "{} async pendings")
+    return results, [perf]
+
+
+def check_quarantined(recon, limits):
+    j = recon["quarantined"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    perf = []
+    for kind in ["objects", "containers", "accounts"]:
+        perf.append(check_threshold(
+            results, "quarantined_{}".format(kind), j.get(kind) or 0, limits,
+            "{} quarantined " + kind))
+    return results, perf
+
+
+def check_driveaudit(recon, limits):
+    j = recon["driveaudit"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    results = []
+    perf = check_threshold(results, "drive_audit_errors",
+                           j.get("drive_audit_errors") or 0, limits,
+                           "{} drive audit errors")
+    return results, [perf]
+
+
+def check_load(recon, limits):
+    j = recon["load"]
+    if isinstance(j, tuple):
+        return [j], []
+
+    load = j.get("5m")
+    if load is None:
+        return [(STATUS_UNKNOWN, "No 5 minute load average in recon")], []
+
+    results = []
+    perf = check_threshold(results, "load5", load, limits,
+                           "5 minute load average is {}")
+    return results, [perf]
+
+
+# Checks taking warn/crit thresholds: (option, recon endpoint, function,
+# help).
+THRESHOLD_CHECKS = [
+    ('unmounted', 'unmounted', check_unmounted,
+     'Check the number of unmounted devices'),
+    ('diskusage', 'diskusage', check_diskusage,
+     'Check the percentage used of each device'),
+    ('async', 'async', check_async,
+     'Check the number of async pendings'),
+    ('quarantined', 'quarantined', check_quarantined,
+     'Check the number of quarantined objects, containers and accounts'),
+    ('driveaudit', 'driveaudit', check_driveaudit,
+     'Check the number of errors found by swift-drive-audit'),
+    ('load', 'load', check_load,
+     'Check the 5 minute load average'),
+]
 
 
 if __name__ == '__main__':
@@ -101,36 +288,64 @@ if __name__ == '__main__':
         help='Hostname to query')
     parser.add_argument('-p', '--port', dest='port', default='6000',
         type=int, help='Port number')
+    parser.add_argument('-t', '--timeout', dest='timeout', default=10,
+        type=float, help='Timeout in seconds for each recon query')
     parser.add_argument('-r', '--replication', dest='check_replication',
         type=int, nargs=4, help='Check replication status',
         metavar=('lag_warn', 'lag_crit', 'failures_warn', 'failures_crit'))
     parser.add_argument('-m', '--md5', dest='check_md5', action='store_true',
         help='Compare server rings md5sum with local copy')
+    for option, _, _, help in THRESHOLD_CHECKS:
+        parser.add_argument('--' + option, type=float, nargs=2, help=help,
+                            metavar=('warn', 'crit'))
     args = parser.parse_args()
 
-    if not args.check_replication and not args.check_md5:
-        print "You must use -r or -m switch"
+    checks = [(endpoint, check, getattr(args, option))
+              for option, endpoint, check, _ in THRESHOLD_CHECKS
+              if getattr(args, option)]
+    if not args.check_replication and not args.check_md5 and not checks:
+        print "You must use -r, -m or a --{} switch".format(
+            ', --'.join(option for option, _, _, _ in THRESHOLD_CHECKS))
         sys.exit(STATUS_UNKNOWN)
 
+    endpoints = []
+    if args.check_replication:
+        endpoints.extend(["replication/account", "replication/object",
+                          "replication/container"])
+    if args.check_md5:
+        endpoints.append("ringmd5")
+    endpoints.extend(endpoint for endpoint, _, _ in checks)
+
     base_url = "http://{}:{}/recon/".format(args.host, args.port)
+    recon = fetch_recon(base_url, endpoints, args.timeout)
     results = []
+    perf = []
     if args.check_replication:
-        results.extend(check_replication(base_url, args.check_replication))
+        _results, _perf = check_replication(recon, args.check_replication)
+        results.extend(_results)
+        perf.extend(_perf)
     if args.check_md5:
-        results.extend(check_md5(base_url))
+        _results, _perf = check_md5(recon)
+        results.extend(_results)
+        perf.extend(_perf)
+    for _, check, limits in checks:
+        _results, _perf = check(recon, limits)
+        results.extend(_results)
+        perf.extend(_perf)
 
     crits = ';'.join([i[1] for i in results if i[0] == STATUS_CRIT])
     warns = ';'.join([i[1] for i in results if i[0] == STATUS_WARN])
     unknowns = ';'.join([i[1] for i in results if i[0] == STATUS_UNKNOWN])
+    perf = ' | ' + ' '.join(perf) if perf else ''
     if crits:
-        print "CRITICAL: " + crits
+        print "CRITICAL: " + crits + perf
         sys.exit(STATUS_CRIT)
     elif warns:
-        print "WARNING: " + warns
+        print "WARNING: " + warns + perf
         sys.exit(STATUS_WARN)
     elif unknowns:
-        print "UNKNOWN: " + unknowns
+        print "UNKNOWN: " + unknowns + perf
         sys.exit(STATUS_UNKNOWN)
     else:
-        print "OK"
+        print "OK" + perf
         sys.exit(0)
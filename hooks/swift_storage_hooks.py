@@ -28,24 +28,46 @@ from lib.swift_storage_utils import (
     register_configs,
     save_script_rc,
     setup_storage,
+    setup_background_profiles,
+    setup_background_controller,
+    setup_sysctl,
+    setup_service_isolation,
+    setup_exporter,
     assert_charm_supports_ipv6,
     setup_rsync,
     remember_devices,
-    REQUIRED_INTERFACES,
-    assess_status,
     ensure_devs_tracked,
-    VERSION_PACKAGE,
+    update_workload_status,
 )
 
-from lib.misc_utils import pause_aware_restart_on_change
-
-from charmhelpers.core.hookenv import (
-    Hooks, UnregisteredHookError,
+from lib.misc_utils import (
+    LazyConfigs,
+    harden,
+    pause_aware_restart_on_change,
+)
+from lib.config_delta import (
+    clear_dirty,
+    get_pending_steps,
+    mark_dirty,
+)
+from lib.log_utils import install as install_log_buffer
+from lib.package_cache import openstack_upgrade_available
+from lib.unitdata_utils import (
+    install as install_unit_state,
+    vacuum_unit_state,
+)
+from lib.hook_tools import (
     config,
-    log,
+    hook_tools,
     relation_get,
     relation_ids,
     relation_set,
+)
+
+from charmhelpers.core.hookenv import (
+    Hooks, UnregisteredHookError,
+    atexit,
+    log,
     relations_of_type,
     status_set,
 )
@@ -60,23 +82,53 @@ from charmhelpers.payload.execd import execd_preinstall
 
 from charmhelpers.contrib.openstack.utils import (
     configure_installation_source,
-    openstack_upgrade_available,
-    set_os_workload_status,
-    os_application_version_set,
 )
 from charmhelpers.contrib.network.ip import (
     get_ipv6_addr
 )
-from charmhelpers.contrib.charmsupport import nrpe
-from charmhelpers.contrib.hardening.harden import harden
 
 from distutils.dir_util import mkpath
 
 hooks = Hooks()
-CONFIGS = register_configs()
+CONFIGS = LazyConfigs(register_configs)
 NAGIOS_PLUGINS = '/usr/local/lib/nagios/plugins'
 SUDOERS_D = '/etc/sudoers.d'
 
+# The steps of config-changed and the options each depends on, None for
+# all of them. Steps without options only run when flagged dirty, which
+# install and upgrade-charm do for every step.
+CONFIG_STEPS = [
+    ('ipv6', ['prefer-ipv6']),
+    ('directories', []),
+    ('upgrade', ['openstack-origin', 'action-managed-upgrade']),
+    ('storage', ['block-device', 'overwrite']),
+    ('background-profiles', None),
+    ('background-controller', [
+        'block-device', 'adaptive-background-concurrency',
+        'adaptive-async-pending-threshold',
+        'adaptive-updater-concurrency-max',
+        'adaptive-throttled-concurrency-min', 'adaptive-disk-util-target',
+        'adaptive-disk-await-target']),
+    ('sysctl', ['block-device', 'sysctl-profile', 'sysctl']),
+    ('service-isolation', [
+        'block-device', 'service-isolation', 'foreground-service-weight',
+        'background-service-weight', 'background-read-bandwidth-max',
+        'foreground-cpu-affinity', 'background-cpu-affinity']),
+    ('exporter', [
+        'prometheus-exporter', 'prometheus-exporter-port',
+        'prometheus-exporter-address', 'prometheus-exporter-open-port']),
+    ('relations', [
+        'block-device', 'zone', 'prefer-ipv6', 'object-server-port',
+        'container-server-port', 'account-server-port']),
+    ('templates', None),
+    ('script-rc', [
+        'object-server-port', 'container-server-port',
+        'account-server-port']),
+    ('nrpe', [
+        'nagios-check-params', 'nagios-aggregate-service-check',
+        'nagios-passive-command', 'nagios_context', 'nagios_servicegroups']),
+]
+
 
 @hooks.hook('install.real')
 @harden()
@@ -90,34 +142,53 @@ def install():
     status_set('maintenance', 'Setting up storage')
     setup_storage()
     ensure_swift_directories()
+    mark_dirty(*[name for name, _ in CONFIG_STEPS])
 
 
 @hooks.hook('config-changed')
 @pause_aware_restart_on_change(RESTART_MAP)
 @harden()
 def config_changed():
-    if config('prefer-ipv6'):
+    steps = get_pending_steps(CONFIG_STEPS, config())
+
+    if 'ipv6' in steps and config('prefer-ipv6'):
         status_set('maintenance', 'Configuring ipv6')
         assert_charm_supports_ipv6()
 
-    ensure_swift_directories()
-    setup_rsync()
+    if 'directories' in steps:
+        ensure_swift_directories()
+        setup_rsync()
 
-    if not config('action-managed-upgrade') and \
+    if 'upgrade' in steps and not config('action-managed-upgrade') and \
             openstack_upgrade_available('swift'):
         status_set('maintenance', 'Running openstack upgrade')
         do_openstack_upgrade(configs=CONFIGS)
 
-    setup_storage()
-
-    for rid in relation_ids('swift-storage'):
-        swift_storage_relation_joined(rid=rid)
-
-    CONFIGS.write_all()
-
-    save_script_rc()
-    if relations_of_type('nrpe-external-master'):
+    if 'storage' in steps:
+        setup_storage()
+    if 'background-profiles' in steps:
+        setup_background_profiles()
+    if 'background-controller' in steps:
+        setup_background_controller()
+    if 'sysctl' in steps:
+        setup_sysctl()
+    if 'service-isolation' in steps:
+        setup_service_isolation()
+    if 'exporter' in steps:
+        setup_exporter()
+
+    if 'relations' in steps:
+        for rid in relation_ids('swift-storage'):
+            swift_storage_relation_joined(rid=rid)
+
+    if 'templates' in steps:
+        CONFIGS.write_all()
+
+    if 'script-rc' in steps:
+        save_script_rc()
+    if 'nrpe' in steps and relations_of_type('nrpe-external-master'):
         update_nrpe_config()
+    clear_dirty(*steps)
 
 
 @hooks.hook('upgrade-charm')
@@ -126,6 +197,8 @@ def upgrade_charm():
     apt_install(filter_installed_packages(PACKAGES), fatal=True)
     update_nrpe_config()
     ensure_devs_tracked()
+    # The new charm may render or set up anything differently.
+    mark_dirty(*[name for name, _ in CONFIG_STEPS])
 
 
 @hooks.hook()
@@ -167,6 +240,7 @@ def swift_storage_relation_changed():
 @hooks.hook('nrpe-external-master-relation-joined')
 @hooks.hook('nrpe-external-master-relation-changed')
 def update_nrpe_config():
+    from charmhelpers.contrib.charmsupport import nrpe
     # python-dbus is used by check_upstart_job
     apt_install('python-dbus')
     log('Refreshing nrpe checks')
@@ -178,6 +252,9 @@ def update_nrpe_config():
     rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'nrpe-external-master',
                        'check_swift_service'),
           os.path.join(NAGIOS_PLUGINS, 'check_swift_service'))
+    rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'nrpe-external-master',
+                       'check_swift_services.py'),
+          os.path.join(NAGIOS_PLUGINS, 'check_swift_services.py'))
     rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'sudo',
                        'swift-storage'),
           os.path.join(SUDOERS_D, 'swift-storage'))
@@ -195,7 +272,28 @@ def update_nrpe_config():
         check_cmd='check_swift_storage.py {}'.format(
             config('nagios-check-params'))
     )
-    nrpe.add_init_service_checks(nrpe_setup, SWIFT_SVCS, current_unit)
+    if config('nagios-aggregate-service-check'):
+        check_cmd = 'check_swift_services.py {}'.format(' '.join(SWIFT_SVCS))
+        if config('nagios-passive-command'):
+            # Without a nagios_hostname the check uses the machine's name.
+            if hostname:
+                check_cmd += ' --passive-host {}'.format(hostname)
+            check_cmd += ' --passive-command {}'.format(
+                config('nagios-passive-command'))
+        nrpe_setup.add_check(
+            shortname='swift_services',
+            description='Check swift services and workers'
+                        ' {%s}' % current_unit,
+            check_cmd=check_cmd
+        )
+        for svc in SWIFT_SVCS:
+            nrpe_setup.remove_check(shortname=svc)
+            cronpath = '/etc/cron.d/nagios-service-check-%s' % svc
+            if os.path.exists(cronpath):
+                os.remove(cronpath)
+    else:
+        nrpe_setup.remove_check(shortname='swift_services')
+        nrpe.add_init_service_checks(nrpe_setup, SWIFT_SVCS, current_unit)
     nrpe_setup.write()
 
 
@@ -205,14 +303,47 @@ def update_status():
     log('Updating status.')
 
 
+def enable_profiling():
+    """Record hook, phase and subprocess timings, see hook-profiling.
+
+    Returns the profiler, whose finish() saves the profile. Template
+    writes are timed on the renderer class, since looking them up on
+    CONFIGS would build it.
+    """
+    from charmhelpers.contrib.openstack.templating import OSConfigRenderer
+    from lib.profile_utils import profile_hooks
+    module = sys.modules[__name__]
+    return profile_hooks(hooks, [
+        (module, 'apt_update', 'apt'),
+        (module, 'apt_install', 'apt'),
+        (module, 'do_openstack_upgrade', 'openstack-upgrade'),
+        (module, 'setup_storage', 'setup-storage'),
+        (module, 'fetch_swift_rings', 'fetch-rings'),
+        (module, 'update_nrpe_config', 'nrpe'),
+        (OSConfigRenderer, 'write', 'templates'),
+        (OSConfigRenderer, 'write_all', 'templates'),
+        (module, 'update_workload_status', 'status'),
+    ], hardening=bool(config('harden')))
+
+
 def main():
+    install_log_buffer()
+    install_unit_state()
+    atexit(hook_tools.log_summary)
+    profiler = enable_profiling() if config('hook-profiling') else None
     try:
-        hooks.execute(sys.argv)
-    except UnregisteredHookError as e:
-        log('Unknown hook {} - skipping.'.format(e))
-    set_os_workload_status(CONFIGS, REQUIRED_INTERFACES,
-                           charm_func=assess_status)
-    os_application_version_set(VERSION_PACKAGE)
+        try:
+            hooks.execute(sys.argv)
+        except UnregisteredHookError as e:
+            log('Unknown hook {} - skipping.'.format(e))
+        # update-status only re-evaluates the status when its inputs change.
+        update_workload_status(
+            CONFIGS, force=os.path.basename(sys.argv[0]) != 'update-status')
+    finally:
+        if profiler:
+            profiler.finish()
+    # Started once the hook has nothing left to write to the unit state.
+    vacuum_unit_state()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+from charmhelpers.core.hookenv import log, DEBUG
+from charmhelpers.core.unitdata import kv
+
+# unitdata key of the config-changed steps still to be run, see
+# get_pending_steps().
+DIRTY_KEY = 'config-changed-dirty'
+
+
+def get_changed_options(cfg):
+    """Return the options whose value differs from the last saved config.
+
+    Every option counts as changed when there is no saved config to
+    compare against.
+    """
+    if cfg is None:
+        return set()
+    if not hasattr(cfg, 'changed'):
+        return set(cfg)
+    return set(option for option in cfg if cfg.changed(option))
+
+
+def mark_dirty(*steps):
+    """Flag steps to be run by the next config-changed hook."""
+    db = kv()
+    dirty = set(db.get(DIRTY_KEY) or [])
+    dirty.update(steps)
+    db.set(DIRTY_KEY, sorted(dirty))
+    db.flush()
+
+
+def clear_dirty(*steps):
+    db = kv()
+    dirty = set(db.get(DIRTY_KEY) or [])
+    dirty.difference_update(steps)
+    db.set(DIRTY_KEY, sorted(dirty))
+    db.flush()
+
+
+def get_pending_steps(steps, cfg):
+    """Return the names of the steps that need to run for cfg.
+
+    steps is a list of (name, options) in the order they run, where
+    options lists the config options the step depends on, or is None if
+    it depends on all of them. A step runs if one of its options changed
+    or it was flagged by mark_dirty(). The steps returned stay flagged
+    until clear_dirty(), so those not completed by a failed hook are
+    run again by the next one.
+    """
+    changed = get_changed_options(cfg)
+    dirty = set(kv().get(DIRTY_KEY) or [])
+    pending = []
+    for name, options in steps:
+        if name in dirty:
+            pending.append(name)
+        elif changed and (options is None or changed.intersection(options)):
+            pending.append(name)
+    log('Changed options: %s; running %s' % (
+        ', '.join(sorted(changed)) or 'none', ', '.join(pending) or 'nothing'),
+        level=DEBUG)
+    mark_dirty(*pending)
+    return pending
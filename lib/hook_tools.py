@@ -0,0 +1,201 @@
+import collections
+import json
+import os
+import subprocess
+import tempfile
+import yaml
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.hookenv import (
+    local_unit,
+    log,
+    DEBUG,
+)
+
+
+class HookTools(object):
+    """Memoizing client for the Juju hook tools.
+
+    Results are cached for the life of the process under tuple keys of the
+    form (tool, args...), so an entry can be invalidated without scanning
+    the rest of the cache. Relation data is fetched a whole unit at a time
+    and individual settings are served from that, and options from a
+    single config-get --all.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.calls = collections.Counter()
+        self.hits = collections.Counter()
+        self._relation_set_accepts_file = None
+
+    def memo(self, key, func, *args):
+        """Return the cached result for key, calling func(*args) on a miss."""
+        if key in self.cache:
+            self.hits[key[0]] += 1
+            return self.cache[key]
+        self.calls[key[0]] += 1
+        result = self.cache[key] = func(*args)
+        return result
+
+    def invalidate(self, *prefix):
+        """Drop cached results whose key starts with prefix."""
+        for key in [k for k in self.cache if k[:len(prefix)] == prefix]:
+            del self.cache[key]
+
+    def reset(self):
+        self.cache.clear()
+        self.calls.clear()
+        self.hits.clear()
+
+    def run(self, *cmd):
+        output = subprocess.check_output(list(cmd) + ['--format=json'])
+        return json.loads(output.decode('UTF-8'))
+
+    def config(self, scope=None):
+        """As hookenv.config, served from one config-get --all."""
+        config = self.memo(('config-get',), hookenv.config)
+        if scope is None or config is None:
+            return config
+        return config.get(scope)
+
+    def unit_get(self, attribute):
+        return self.memo(('unit-get', attribute),
+                         self.run, 'unit-get', attribute)
+
+    def relation_ids(self, reltype=None):
+        reltype = reltype or hookenv.relation_type()
+        if reltype is None:
+            return []
+        return self.memo(('relation-ids', reltype),
+                         self.run, 'relation-ids', reltype) or []
+
+    def related_units(self, relid=None):
+        relid = relid or hookenv.relation_id()
+        cmd = ['relation-list']
+        if relid is not None:
+            cmd.extend(['-r', relid])
+        return self.memo(('relation-list', relid), self.run, *cmd) or []
+
+    def _relation_data(self, rid, unit):
+        cmd = ['relation-get']
+        if rid:
+            cmd.extend(['-r', rid])
+        cmd.append('-')
+        if unit:
+            cmd.append(unit)
+        try:
+            return self.run(*cmd)
+        except ValueError:
+            return None
+        except subprocess.CalledProcessError as e:
+            if e.returncode == 2:
+                return None
+            raise
+
+    def relation_get(self, attribute=None, unit=None, rid=None):
+        """As hookenv.relation_get, fetching all of a unit's settings."""
+        rid = rid or hookenv.relation_id()
+        unit = unit or hookenv.remote_unit()
+        data = self.memo(('relation-get', rid, unit),
+                         self._relation_data, rid, unit)
+        if attribute is None or data is None:
+            return data
+        return data.get(attribute)
+
+    def relations(self, reltype, local=False):
+        """Return {rid: {unit: settings}} for every unit of reltype.
+
+        Relations are in relation-ids order and units in relation-list
+        order, followed by the local unit if local is True. Units whose
+        settings cannot be read map to an empty dict.
+        """
+        relations = collections.OrderedDict()
+        for rid in self.relation_ids(reltype):
+            units = list(self.related_units(rid))
+            if local:
+                units.append(local_unit())
+            relations[rid] = collections.OrderedDict(
+                (unit, self.relation_get(unit=unit, rid=rid) or {})
+                for unit in units)
+        return relations
+
+    def relation_set_accepts_file(self):
+        """Return True if relation-set supports --file (Juju >= 1.23.2)."""
+        if self._relation_set_accepts_file is None:
+            self.calls['relation-set --help'] += 1
+            self._relation_set_accepts_file = '--file' in \
+                subprocess.check_output(['relation-set', '--help'],
+                                        universal_newlines=True)
+        return self._relation_set_accepts_file
+
+    def relation_set(self, relation_id=None, relation_settings=None,
+                     **kwargs):
+        """As hookenv.relation_set, probing relation-set only once."""
+        cmd = ['relation-set']
+        if relation_id is not None:
+            cmd.extend(['-r', relation_id])
+        settings = dict(relation_settings or {}, **kwargs)
+        for key, value in settings.items():
+            if value is not None:
+                settings[key] = '{}'.format(value)
+        self.calls['relation-set'] += 1
+        if self.relation_set_accepts_file():
+            with tempfile.NamedTemporaryFile(delete=False) as settings_file:
+                settings_file.write(yaml.safe_dump(settings).encode('utf-8'))
+            subprocess.check_call(cmd + ['--file', settings_file.name])
+            os.remove(settings_file.name)
+        else:
+            for key, value in settings.items():
+                cmd.append('{}={}'.format(key, '' if value is None else value))
+            subprocess.check_call(cmd)
+        self.invalidate('relation-get', relation_id or hookenv.relation_id(),
+                        local_unit())
+        # Keep anything still reading through hookenv consistent.
+        hookenv.flush(local_unit())
+
+    def summary(self):
+        """Describe the hook tool calls made and served from cache."""
+        return ', '.join('%s: %d calls, %d cached' % (
+            tool, self.calls[tool], self.hits[tool])
+            for tool in sorted(set(self.calls) | set(self.hits)))
+
+    def log_summary(self):
+        summary = self.summary()
+        if summary:
+            log('Hook tools: %s' % summary, level=DEBUG)
+
+
+hook_tools = HookTools()
+
+
+def config(scope=None):
+    return hook_tools.config(scope)
+
+
+def unit_get(attribute):
+    return hook_tools.unit_get(attribute)
+
+
+def unit_private_ip():
+    return hook_tools.unit_get('private-address')
+
+
+def relation_ids(reltype=None):
+    return hook_tools.relation_ids(reltype)
+
+
+def related_units(relid=None):
+    return hook_tools.related_units(relid)
+
+
+def relation_get(attribute=None, unit=None, rid=None):
+    return hook_tools.relation_get(attribute, unit, rid)
+
+
+def relations(reltype, local=False):
+    return hook_tools.relations(reltype, local)
+
+
+def relation_set(relation_id=None, relation_settings=None, **kwargs):
+    return hook_tools.relation_set(relation_id, relation_settings, **kwargs)
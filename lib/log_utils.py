@@ -0,0 +1,97 @@
+import atexit
+import subprocess
+import sys
+
+import six
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.hookenv import (
+    config,
+    CRITICAL,
+    DEBUG,
+    ERROR,
+    INFO,
+    WARNING,
+)
+
+LOG_LEVELS = [DEBUG, INFO, WARNING, ERROR, CRITICAL]
+
+# Queued messages are written once either limit is reached, which keeps a
+# batch well below the argument size limit of a single juju-log call.
+MAX_BATCH_MESSAGES = 100
+MAX_BATCH_BYTES = 64 * 1024
+
+_juju_log = hookenv.log
+_queue = []
+_queued_bytes = 0
+_threshold = None
+
+
+def severity(level):
+    """Return the rank of level in LOG_LEVELS, juju-log defaults to INFO."""
+    if level in LOG_LEVELS:
+        return LOG_LEVELS.index(level)
+    return LOG_LEVELS.index(INFO)
+
+
+def get_log_threshold():
+    """Return the rank of the log-level option, read once per hook."""
+    global _threshold
+    if _threshold is None:
+        try:
+            level = config('log-level') or DEBUG
+        except (OSError, subprocess.CalledProcessError):
+            # Not running in a hook context, keep everything.
+            level = DEBUG
+        _threshold = severity(level.upper())
+    return _threshold
+
+
+def flush():
+    """Write out queued messages, one juju-log call per run of a level."""
+    global _queued_bytes
+    batches = []
+    for level, message in _queue:
+        if batches and batches[-1][0] == level:
+            batches[-1][1].append(message)
+        else:
+            batches.append((level, [message]))
+    del _queue[:]
+    _queued_bytes = 0
+    for level, messages in batches:
+        _juju_log('\n'.join(messages), level=level)
+
+
+def log(message, level=None):
+    """Queue a message for the juju log, see hookenv.log.
+
+    Messages below the log-level option are dropped. ERROR and CRITICAL
+    messages are written straight away along with anything queued before
+    them.
+    """
+    global _queued_bytes
+    if severity(level) < get_log_threshold():
+        return
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    _queue.append((level, message))
+    _queued_bytes += len(message)
+    full = len(_queue) >= MAX_BATCH_MESSAGES or \
+        _queued_bytes >= MAX_BATCH_BYTES
+    if full or severity(level) >= severity(ERROR):
+        flush()
+
+
+def install():
+    """Send charm and charmhelpers logging through log() for this process.
+
+    hookenv.log forks a juju-log process per message. Modules that have
+    already imported it are rebound too, and the queue is flushed when the
+    hook completes or, failing that, when the interpreter exits.
+    """
+    hookenv.log = log
+    for module in list(sys.modules.values()):
+        if getattr(module, 'log', None) is _juju_log:
+            module.log = log
+    hookenv.atexit(flush)
+    atexit.register(flush)
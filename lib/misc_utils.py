@@ -1,3 +1,4 @@
+import functools
 import os
 
 from charmhelpers.contrib.storage.linux.utils import (
@@ -32,6 +33,8 @@ from charmhelpers.core.unitdata import (
     kv,
 )
 
+from hook_tools import config
+
 DEFAULT_LOOPBACK_SIZE = '5G'
 
 
@@ -112,10 +115,56 @@ def is_paused():
 
 
 def pause_aware_restart_on_change(restart_map):
-    """Avoids restarting services if config changes when unit is paused."""
+    """Avoids restarting services if config changes when unit is paused.
+
+    Whether the unit is paused is checked when the hook runs rather than
+    when it is defined, so loading the hooks does not open the unit's
+    state.
+    """
     def wrapper(f):
-        if is_paused():
-            return f
-        else:
-            return restart_on_change(restart_map)(f)
+        restart_f = restart_on_change(restart_map)(f)
+
+        @functools.wraps(f)
+        def wrapped_f(*args, **kwargs):
+            if is_paused():
+                return f(*args, **kwargs)
+            return restart_f(*args, **kwargs)
+        return wrapped_f
     return wrapper
+
+
+def harden(overrides=None):
+    """Hardening decorator, see charmhelpers.contrib.hardening.harden.
+
+    The hardening stack is only imported when the harden option (or
+    overrides) enables a module, so hooks on units without hardening do
+    not pay for loading it.
+    """
+    def wrapper(f):
+        @functools.wraps(f)
+        def _harden(*args, **kwargs):
+            if not overrides and not config('harden'):
+                return f(*args, **kwargs)
+            from charmhelpers.contrib.hardening.harden import (
+                harden as _charmhelpers_harden,
+            )
+            return _charmhelpers_harden(overrides)(f)(*args, **kwargs)
+        return _harden
+    return wrapper
+
+
+class LazyConfigs(object):
+    """Proxy for the OSConfigRenderer returned by factory, built on first use.
+
+    Building the renderer looks up the installed OpenStack release, which
+    opens the apt cache, so this is left until a hook actually needs it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._configs = None
+
+    def __getattr__(self, name):
+        if self._configs is None:
+            self._configs = self._factory()
+        return getattr(self._configs, name)
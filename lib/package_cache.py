@@ -0,0 +1,103 @@
+import os
+
+from charmhelpers.core.hookenv import application_version_set
+from charmhelpers.core.host import lsb_release
+from charmhelpers.core.unitdata import kv
+from charmhelpers.contrib.openstack import utils as openstack_utils
+from charmhelpers.fetch import ubuntu
+
+from hook_tools import config
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+APT_LISTS = '/var/lib/apt/lists'
+# unitdata key of the package versions cached by PackageCache.
+PACKAGE_CACHE_KEY = 'package-version-cache'
+
+
+def get_package_state():
+    """Return the [mtime, size] of the dpkg status and the apt lists.
+
+    Installing, removing or upgrading a package rewrites the dpkg status
+    and apt-get update replaces files in the lists directory, so either
+    changing means answers derived from the apt cache may be stale.
+    """
+    state = []
+    for path in (DPKG_STATUS, APT_LISTS):
+        try:
+            st = os.stat(path)
+            state.append([st.st_mtime, st.st_size])
+        except OSError:
+            state.append(None)
+    return state
+
+
+class PackageCache(object):
+    """Answers from the apt cache, kept in unitdata across hooks.
+
+    Building an apt cache takes seconds on a loaded node and every
+    lookup in charmhelpers builds a fresh one, so results are stored
+    under (question, args...) keys together with get_package_state() and
+    all of them are dropped as soon as that changes. The state is checked
+    on every lookup since a hook may install or upgrade packages.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+
+    def get(self, key, func, *args):
+        """Return the cached result for key, calling func(*args) on a miss."""
+        db = kv()
+        state = get_package_state()
+        cache = db.get(PACKAGE_CACHE_KEY)
+        if not cache or cache['state'] != state:
+            cache = {'state': state, 'entries': {}}
+        entry = '/'.join(str(k) for k in key)
+        if entry in cache['entries']:
+            self.hits += 1
+            return cache['entries'][entry]
+        self.calls += 1
+        result = cache['entries'][entry] = func(*args)
+        db.set(PACKAGE_CACHE_KEY, cache)
+        db.flush()
+        return result
+
+
+package_cache = PackageCache()
+
+
+def get_os_codename_package(package, fatal=True):
+    """As charmhelpers' get_os_codename_package, cached in unitdata."""
+    codename = package_cache.get(
+        ('codename', package),
+        openstack_utils.get_os_codename_package, package, False)
+    if codename is None and fatal:
+        # Let charmhelpers report why the package has no codename.
+        return openstack_utils.get_os_codename_package(package, fatal=True)
+    return codename
+
+
+def get_upstream_version(package):
+    """As charmhelpers' get_upstream_version, cached in unitdata."""
+    return package_cache.get(('upstream-version', package),
+                             ubuntu.get_upstream_version, package)
+
+
+def os_application_version_set(package):
+    """As charmhelpers' os_application_version_set, cached in unitdata."""
+    version = get_upstream_version(package)
+    if not version:
+        version = openstack_utils.os_release(package)
+    application_version_set(version)
+
+
+def openstack_upgrade_available(package):
+    """As charmhelpers' openstack_upgrade_available, cached in unitdata.
+
+    The answer also depends on the configured installation source and the
+    Ubuntu series, so both are part of the key.
+    """
+    return package_cache.get(
+        ('upgrade-available', package, config('openstack-origin'),
+         lsb_release()['DISTRIB_CODENAME']),
+        openstack_utils.openstack_upgrade_available, package)
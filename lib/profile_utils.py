@@ -0,0 +1,194 @@
+import functools
+import os
+import subprocess
+import time
+
+import six
+
+from charmhelpers.core import host
+from charmhelpers.core.unitdata import kv
+
+PROFILE_KEY = 'hook-profile'
+# Bounds on the history kept in unitdata: the number of hooks, and the
+# slowest commands kept for each of them.
+MAX_HOOKS = 20
+MAX_COMMANDS = 50
+MAX_COMMAND_LENGTH = 200
+
+HARDENING_MODULES = ['run_os_checks', 'run_ssh_checks', 'run_mysql_checks',
+                     'run_apache_checks']
+
+
+class HookProfiler(object):
+    """Record the time spent in phases of a hook and in every subprocess."""
+
+    def __init__(self):
+        self.phases = {}
+        self.commands = []
+        self._popen = None
+        self.hook_name = None
+        self.start_time = None
+
+    def phase(self, name, func):
+        """Return func wrapped to add its wall time to phase name."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                calls, duration = self.phases.get(name, (0, 0))
+                self.phases[name] = (calls + 1,
+                                     duration + time.time() - start)
+        return wrapper
+
+    def wrap(self, obj, attr, name):
+        """Replace obj.attr with a version timed as phase name."""
+        setattr(obj, attr, self.phase(name, getattr(obj, attr)))
+
+    def add_command(self, args, duration, returncode):
+        if not isinstance(args, six.string_types):
+            args = ' '.join(str(arg) for arg in args)
+        self.commands.append((args[:MAX_COMMAND_LENGTH], duration,
+                              returncode))
+
+    def trace_subprocess(self):
+        """Time every subprocess.Popen until untrace_subprocess()."""
+        profiler = self
+        popen = self._popen = subprocess.Popen
+
+        class TracedPopen(popen):
+
+            def __init__(self, args, *pargs, **kwargs):
+                self._trace_args = args
+                self._trace_start = time.time()
+                self._traced = False
+                try:
+                    super(TracedPopen, self).__init__(args, *pargs, **kwargs)
+                except OSError:
+                    self._trace(None)
+                    raise
+
+            def _trace(self, returncode):
+                if not self._traced:
+                    self._traced = True
+                    profiler.add_command(self._trace_args,
+                                         time.time() - self._trace_start,
+                                         returncode)
+
+            def wait(self, *args, **kwargs):
+                returncode = super(TracedPopen, self).wait(*args, **kwargs)
+                self._trace(returncode)
+                return returncode
+
+            def poll(self, *args, **kwargs):
+                returncode = super(TracedPopen, self).poll(*args, **kwargs)
+                if returncode is not None:
+                    self._trace(returncode)
+                return returncode
+
+        subprocess.Popen = TracedPopen
+
+    def untrace_subprocess(self):
+        if self._popen:
+            subprocess.Popen = self._popen
+            self._popen = None
+
+    def start(self, hook_name):
+        """Start profiling hook_name, tracing subprocesses until finish()."""
+        self.hook_name = hook_name
+        self.start_time = time.time()
+        self.trace_subprocess()
+
+    def finish(self):
+        """Stop profiling and save the hook's profile, if it was started."""
+        self.untrace_subprocess()
+        if self.start_time is not None:
+            save_profile(self.record(self.hook_name, self.start_time,
+                                     time.time() - self.start_time))
+            self.start_time = None
+
+    def record(self, hook_name, start, duration):
+        """Return the profile of a hook for the unitdata history."""
+        commands = sorted(self.commands, key=lambda c: c[1], reverse=True)
+        return {
+            'hook': hook_name,
+            'start': start,
+            'duration': duration,
+            'phases': self.phases,
+            'commands': commands[:MAX_COMMANDS],
+            'command-count': len(self.commands),
+            'command-time': sum(c[1] for c in self.commands),
+        }
+
+
+def save_profile(record):
+    """Append record to the bounded per-unit history of hook profiles."""
+    db = kv()
+    history = db.get(PROFILE_KEY) or []
+    history.append(record)
+    db.set(PROFILE_KEY, history[-MAX_HOOKS:])
+    db.flush()
+
+
+def profile_hooks(hooks, targets, hardening=False):
+    """Profile executions of hooks, a hookenv.Hooks instance.
+
+    targets is a list of (object, attribute, phase) to time as phases in
+    addition to service control and, if hardening is True, the hardening
+    modules. Profiling starts when hooks.execute() is called and the
+    profile is saved by the returned profiler's finish(), so it can cover
+    work done after the hook function returns.
+    """
+    profiler = HookProfiler()
+    for obj, attr, name in targets:
+        profiler.wrap(obj, attr, name)
+    profiler.wrap(host, 'service', 'services')
+    if hardening:
+        # Only loaded when hardening runs, see misc_utils.harden().
+        import charmhelpers.contrib.hardening.harden as _hardening
+        for attr in HARDENING_MODULES:
+            profiler.wrap(_hardening, attr, 'hardening')
+
+    execute = hooks.execute
+
+    @functools.wraps(execute)
+    def wrapper(args):
+        profiler.start(os.path.basename(args[0]))
+        return execute(args)
+    hooks.execute = wrapper
+    return profiler
+
+
+def get_profile_report(history, hooks=5, top=10):
+    """Summarise the slowest phases and commands of the last hooks.
+
+    Returns a dict suitable for action_set().
+    """
+    recent = history[-hooks:] if hooks else []
+    report = {}
+    for i, record in enumerate(reversed(recent), 1):
+        report['hooks.{}'.format(i)] = '{} at {} took {:.1f}s, {} commands ' \
+            'took {:.1f}s'.format(
+                record['hook'],
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(record['start'])),
+                record['duration'], record['command-count'],
+                record['command-time'])
+
+    phases = [(duration, name, calls, record['hook'])
+              for record in recent
+              for name, (calls, duration) in record['phases'].items()]
+    for i, (duration, name, calls, hook) in enumerate(
+            sorted(phases, reverse=True)[:top], 1):
+        report['phases.{}'.format(i)] = '{} took {:.1f}s in {} calls ' \
+            '({})'.format(name, duration, calls, hook)
+
+    commands = [(duration, cmd, returncode, record['hook'])
+                for record in recent
+                for cmd, duration, returncode in record['commands']]
+    for i, (duration, cmd, returncode, hook) in enumerate(
+            sorted(commands, reverse=True)[:top], 1):
+        report['commands.{}'.format(i)] = '{} took {:.1f}s, exit {} ' \
+            '({})'.format(cmd, duration, returncode, hook)
+    return report
@@ -1,37 +1,259 @@
+import ast
+import operator
 import re
+import time
+import yaml
 
 from charmhelpers.core.hookenv import (
-    config,
+    local_unit,
     log,
-    related_units,
-    relation_get,
-    relation_ids,
-    unit_private_ip,
+    WARNING,
 )
 
 from charmhelpers.contrib.openstack.context import (
     OSContextGenerator,
+    WorkerConfigContext,
 )
 
 from charmhelpers.contrib.network.ip import (
     get_ipv6_addr,
 )
 
+from hook_tools import (
+    config,
+    relations,
+    unit_private_ip,
+)
+
+from swift_storage_tuning import (
+    get_auditor_rates,
+    get_local_devices,
+    tuned_config,
+)
+
+# Listen backlog set by the network sysctl-profile, used both for the
+# kernel accept queue limits and the servers' own backlog.
+NETWORK_BACKLOG = 8192
+
+# Options a background profile may set, mapped to the server config file,
+# section and key they are rendered as.
+PROFILE_OPTIONS = {
+    'account-replicator-concurrency': [
+        ('account', 'account-replicator', 'concurrency')],
+    'container-replicator-concurrency': [
+        ('container', 'container-replicator', 'concurrency')],
+    'object-replicator-concurrency': [
+        ('object', 'object-replicator', 'concurrency')],
+    'auditor-files-per-second': [
+        ('object', 'object-auditor', 'files_per_second')],
+    'auditor-bytes-per-second': [
+        ('object', 'object-auditor', 'bytes_per_second')],
+    'auditor-zero-byte-files-per-second': [
+        ('object', 'object-auditor', 'zero_byte_files_per_second')],
+    'auditor-concurrency': [
+        ('object', 'object-auditor', 'concurrency')],
+    'auditor-interval': [
+        ('account', 'account-auditor', 'interval'),
+        ('container', 'container-auditor', 'interval'),
+        ('object', 'object-auditor', 'interval')],
+    'container-updater-concurrency': [
+        ('container', 'container-updater', 'concurrency')],
+    'object-updater-concurrency': [
+        ('object', 'object-updater', 'concurrency')],
+    'account-reaper-concurrency': [
+        ('account', 'account-reaper', 'concurrency')],
+}
+
+
+WORKER_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.USub: operator.neg,
+}
+WORKER_FUNCTIONS = {
+    'max': max,
+    'min': min,
+    'int': int,
+}
+
+
+def eval_workers(expression, names):
+    """Evaluate a worker count expression such as max(cpus, disks).
+
+    Only numbers, the given names, + - * / // and the functions in
+    WORKER_FUNCTIONS are allowed. Raises ValueError for anything else.
+    """
+    def _eval(node):
+        if isinstance(node, ast.Num):
+            return node.n
+        if isinstance(node, ast.Name) and node.id in names:
+            return names[node.id]
+        op = WORKER_OPERATORS.get(type(getattr(node, 'op', None)))
+        if isinstance(node, ast.BinOp) and op:
+            return op(_eval(node.left), _eval(node.right))
+        if isinstance(node, ast.UnaryOp) and op:
+            return op(_eval(node.operand))
+        if isinstance(node, ast.Call) and not node.keywords:
+            func = getattr(node.func, 'id', None)
+            if func in WORKER_FUNCTIONS:
+                return WORKER_FUNCTIONS[func](
+                    *[_eval(arg) for arg in node.args])
+        raise ValueError('unsupported expression')
+
+    try:
+        tree = ast.parse(str(expression).strip(), mode='eval')
+        return _eval(tree.body)
+    except (SyntaxError, TypeError, ZeroDivisionError) as e:
+        raise ValueError(str(e))
+
+
+def get_background_profiles():
+    """Parse the background-profiles option.
+
+    Returns a dict of profile name to a dict of option overrides. Options
+    which cannot be set by a profile are dropped with a warning.
+    """
+    try:
+        profiles = yaml.safe_load(config('background-profiles') or '') or {}
+    except yaml.YAMLError:
+        log('Unable to parse background-profiles', level=WARNING)
+        return {}
+
+    if not isinstance(profiles, dict):
+        log('background-profiles must be a mapping of profile names to '
+            'options', level=WARNING)
+        return {}
+
+    valid = {}
+    for name, options in profiles.items():
+        valid[name] = {}
+        for option, value in (options or {}).items():
+            if option not in PROFILE_OPTIONS:
+                log("Ignoring unsupported option '%s' in background profile "
+                    "'%s'" % (option, name), level=WARNING)
+                continue
+            valid[name][option] = value
+    return valid
+
+
+def get_sysctl_overrides():
+    """Parse the sysctl option into a dict of sysctl keys to values."""
+    try:
+        overrides = yaml.safe_load(config('sysctl') or '') or {}
+    except yaml.YAMLError:
+        log('Unable to parse sysctl option', level=WARNING)
+        return {}
+
+    if not isinstance(overrides, dict):
+        log('sysctl must be a mapping of keys to values', level=WARNING)
+        return {}
+    return overrides
+
+
+def get_server_backlog():
+    """Return the listen backlog matching the network sysctl-profile.
+
+    None is returned when the network profile is not in use, leaving the
+    swift default in place.
+    """
+    if 'network' not in (config('sysctl-profile') or '').split():
+        return None
+    return get_sysctl_overrides().get('net.core.somaxconn', NETWORK_BACKLOG)
+
+
+def get_background_schedule(profiles=None):
+    """Parse the background-schedule option.
+
+    Returns a list of (minute of day, profile name) tuples sorted by start
+    time. Each profile stays active until the next entry starts.
+    """
+    if profiles is None:
+        profiles = get_background_profiles()
+    schedule = []
+    for entry in (config('background-schedule') or '').split():
+        try:
+            start, name = entry.split('=', 1)
+            hour, minute = [int(i) for i in start.split(':')]
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError
+        except ValueError:
+            log("Ignoring invalid background-schedule entry '%s'" % entry,
+                level=WARNING)
+            continue
+
+        if name not in profiles:
+            log("Ignoring background-schedule entry '%s' for unknown profile "
+                "'%s'" % (entry, name), level=WARNING)
+            continue
+        schedule.append((hour * 60 + minute, name))
+    return sorted(schedule)
+
+
+def get_active_profile_name(schedule, now=None):
+    """Return the name of the profile active at now (local time)."""
+    if not schedule:
+        return None
+
+    now = time.localtime(now)
+    minute = now.tm_hour * 60 + now.tm_min
+    # Before the first window of the day the last window from the previous
+    # day is still active.
+    active = schedule[-1][1]
+    for start, name in schedule:
+        if start <= minute:
+            active = name
+    return active
+
+
+def get_active_profile():
+    """Return the option overrides of the currently active profile."""
+    profiles = get_background_profiles()
+    name = get_active_profile_name(get_background_schedule(profiles))
+    if not name:
+        return {}
+    return profiles[name]
+
+
+class BackgroundContextGenerator(OSContextGenerator):
+    """Base for contexts rendering options a background profile may set.
+
+    By default the currently active profile is applied; a specific profile
+    (or {} for none) may be passed instead to render its settings ahead of
+    time.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile
+
+    def get_profile(self):
+        if self.profile is None:
+            return get_active_profile()
+        return self.profile
+
+    def background_config(self, option, profile=None):
+        if profile is None:
+            profile = self.get_profile()
+        if option in profile:
+            return profile[option]
+        return tuned_config(option)
+
 
 class SwiftStorageContext(OSContextGenerator):
     interfaces = ['swift-storage']
 
     def __call__(self):
-        rids = relation_ids('swift-storage')
-        if not rids:
+        rels = relations('swift-storage')
+        if not rels:
             return {}
 
         swift_hash = None
-        for rid in rids:
-            for unit in related_units(rid):
+        for units in rels.values():
+            for settings in units.values():
                 if not swift_hash:
-                    swift_hash = relation_get('swift_hash', rid=rid,
-                                              unit=unit)
+                    swift_hash = settings.get('swift_hash')
         if not swift_hash:
             log('No swift_hash passed via swift-storage relation. '
                 'Peer not ready?')
@@ -61,9 +283,8 @@ class RsyncContext(OSContextGenerator):
             ctxt['local_ip'] = unit_private_ip()
 
         timestamps = []
-        for rid in relation_ids('swift-storage'):
-            for unit in related_units(rid):
-                settings = relation_get(unit=unit, rid=rid)
+        for units in relations('swift-storage').values():
+            for settings in units.values():
                 ts = settings.get('timestamp')
                 allowed_hosts = settings.get('rsync_allowed_hosts')
                 if allowed_hosts and ts:
@@ -72,11 +293,14 @@ class RsyncContext(OSContextGenerator):
 
                     timestamps.append(ts)
 
+        if config('rsync-module-per-device'):
+            ctxt['devices'] = get_local_devices()
+
         self.enable_rsyncd()
         return ctxt
 
 
-class SwiftStorageServerContext(OSContextGenerator):
+class SwiftStorageServerContext(BackgroundContextGenerator):
     interfaces = []
 
     def __call__(self):
@@ -85,12 +309,158 @@ class SwiftStorageServerContext(OSContextGenerator):
             'account_server_port': config('account-server-port'),
             'container_server_port': config('container-server-port'),
             'object_server_port': config('object-server-port'),
-            'object_server_threads_per_disk': config(
+            'object_server_threads_per_disk': tuned_config(
                 'object-server-threads-per-disk'),
+            'object_keep_cache_size': tuned_config('object-keep-cache-size'),
             'account_max_connections': config('account-max-connections'),
             'container_max_connections': config('container-max-connections'),
-            'object_max_connections': config('object-max-connections'),
-            'object_replicator_concurrency': config(
+            'object_max_connections': tuned_config('object-max-connections'),
+            'object_replicator_concurrency': self.background_config(
                 'object-replicator-concurrency'),
+            'rsync_module_per_device': config('rsync-module-per-device'),
+            'backlog': get_server_backlog(),
+        }
+        return ctxt
+
+
+class ServerWorkerContext(WorkerConfigContext):
+    """Override workers for one server from its <server>-workers option.
+
+    Registered after WorkerConfigContext so that worker-multiplier still
+    applies to servers without their own setting.
+    """
+    interfaces = []
+
+    def __init__(self, server):
+        self.server = server
+
+    def __call__(self):
+        option = '%s-workers' % self.server
+        expression = tuned_config(option)
+        if expression is None or str(expression).strip() == '':
+            return {}
+
+        names = {'cpus': self.num_cpus, 'disks': len(get_local_devices())}
+        try:
+            workers = int(eval_workers(expression, names))
+        except ValueError as e:
+            log("Ignoring invalid %s '%s': %s" % (option, expression, e),
+                level=WARNING)
+            return {}
+        return {'workers': max(workers, 1)}
+
+
+class StatsdContext(OSContextGenerator):
+    """Render the statsd settings shared by all storage daemons.
+
+    Metrics are prefixed with <statsd-metric-prefix>.z<zone>.<unit> so they
+    can be graphed per zone and per node.
+    """
+    interfaces = []
+
+    def __call__(self):
+        if config('statsd-local-aggregator'):
+            host = '127.0.0.1'
+        else:
+            host = config('statsd-host')
+        if not host:
+            return {'statsd': {}}
+
+        prefix = '%s.z%s.%s' % (config('statsd-metric-prefix') or 'swift',
+                                config('zone'),
+                                local_unit().replace('/', '-'))
+        return {
+            'statsd': {
+                'log_statsd_host': host,
+                'log_statsd_port': config('statsd-port'),
+                'log_statsd_default_sample_rate':
+                    config('statsd-sample-rate'),
+                'log_statsd_metric_prefix': prefix,
+            },
+        }
+
+
+class AuditorContext(BackgroundContextGenerator):
+    interfaces = []
+
+    def __call__(self):
+        object_auditor = {}
+        if config('auditor-auto-rate'):
+            object_auditor.update(get_auditor_rates(get_local_devices()))
+
+        options = {
+            'files_per_second': 'auditor-files-per-second',
+            'bytes_per_second': 'auditor-bytes-per-second',
+            'zero_byte_files_per_second':
+                'auditor-zero-byte-files-per-second',
+            'concurrency': 'auditor-concurrency',
+            'disk_chunk_size': 'auditor-disk-chunk-size',
+            'interval': 'auditor-interval',
+        }
+        profile = self.get_profile()
+        for key, option in options.items():
+            value = self.background_config(option, profile)
+            if value is not None:
+                object_auditor[key] = value
+
+        db_auditor = {}
+        if object_auditor.get('interval') is not None:
+            db_auditor['interval'] = object_auditor['interval']
+
+        return {
+            'account_auditor': db_auditor,
+            'container_auditor': db_auditor,
+            'object_auditor': object_auditor,
+        }
+
+
+class UpdaterContext(BackgroundContextGenerator):
+    interfaces = []
+
+    def __call__(self):
+        sections = {
+            'object_updater': {
+                'concurrency': 'object-updater-concurrency',
+                'updater_workers': 'object-updater-workers',
+                'objects_per_second': 'object-updater-objects-per-second',
+                'slowdown': 'updater-slowdown',
+                'node_timeout': 'updater-node-timeout',
+            },
+            'container_updater': {
+                'concurrency': 'container-updater-concurrency',
+                'containers_per_second':
+                    'container-updater-containers-per-second',
+                'slowdown': 'updater-slowdown',
+                'node_timeout': 'updater-node-timeout',
+            },
+            'account_reaper': {
+                'concurrency': 'account-reaper-concurrency',
+                'delay_reaping': 'account-reaper-delay-reaping',
+            },
+        }
+        profile = self.get_profile()
+        ctxt = {}
+        for section, options in sections.items():
+            ctxt[section] = {}
+            for key, option in options.items():
+                value = self.background_config(option, profile)
+                if value is not None:
+                    ctxt[section][key] = value
+        return ctxt
+
+
+class BackgroundProfileContext(BackgroundContextGenerator):
+    """Render the profile-only options of the active background profile."""
+    interfaces = []
+
+    def __call__(self):
+        ctxt = {
+            'account_replicator': {},
+            'container_replicator': {},
         }
+        for option, value in self.get_profile().items():
+            for _, section, key in PROFILE_OPTIONS[option]:
+                section = section.replace('-', '_')
+                if section in ctxt and value is not None:
+                    ctxt[section][key] = value
         return ctxt
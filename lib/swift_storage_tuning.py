@@ -0,0 +1,225 @@
+import glob
+import multiprocessing
+import os
+import yaml
+
+from charmhelpers.core.hookenv import (
+    cached,
+    charm_dir,
+)
+
+from charmhelpers.core.host import (
+    get_total_ram,
+    mounts,
+)
+
+from hook_tools import config
+
+SWIFT_NODE_DIR = '/srv/node'
+SYSFS_NODE_DIR = '/sys/devices/system/node'
+
+# Per-device object auditor budgets used when auditor-auto-rate or auto-tune
+# is enabled, keyed on whether the device is rotational.
+AUDITOR_DEVICE_RATES = {
+    True: {
+        'files_per_second': 10,
+        'bytes_per_second': 4 * 1024 * 1024,
+        'zero_byte_files_per_second': 25,
+    },
+    False: {
+        'files_per_second': 100,
+        'bytes_per_second': 50 * 1024 * 1024,
+        'zero_byte_files_per_second': 250,
+    },
+}
+AUDITOR_MAX_CONCURRENCY = 4
+
+# Bandwidth (Mbit/s) assumed to be consumed by one object rsync connection.
+RSYNC_CONNECTION_MBPS = 100
+
+SWIFT_KEEP_CACHE_SIZE = 5 * 1024 * 1024
+
+
+def get_local_devices():
+    """Return the names of the devices mounted under /srv/node.
+
+    These are the devices setup_storage() has formatted and mounted for use
+    by swift, named after the directory they are mounted on.
+    """
+    devices = []
+    for mountpoint, _ in mounts():
+        if os.path.dirname(mountpoint) == SWIFT_NODE_DIR:
+            devices.append(os.path.basename(mountpoint))
+    return sorted(set(devices))
+
+
+def is_rotational(device):
+    """Return True if device (eg. sdb) is backed by rotational media.
+
+    Partitions are resolved to their parent disk. If the rotational class
+    cannot be determined the device is assumed to be rotational.
+    """
+    path = os.path.realpath(os.path.join('/sys/class/block', device))
+    if not os.path.isdir(os.path.join(path, 'queue')):
+        path = os.path.dirname(path)
+    try:
+        with open(os.path.join(path, 'queue', 'rotational')) as f:
+            return f.read().strip() != '0'
+    except IOError:
+        return True
+
+
+def get_auditor_rates(devices):
+    """Derive object auditor settings for the given local devices.
+
+    Each device contributes a files/bytes per second budget according to its
+    rotational class. The node-wide budget is spread over the auditor
+    workers since swift applies the limits per worker.
+    """
+    if not devices:
+        return {}
+
+    totals = {}
+    for device in devices:
+        for key, rate in AUDITOR_DEVICE_RATES[is_rotational(device)].items():
+            totals[key] = totals.get(key, 0) + rate
+
+    concurrency = min(len(devices), AUDITOR_MAX_CONCURRENCY)
+    rates = {k: max(1, v // concurrency) for k, v in totals.items()}
+    rates['concurrency'] = concurrency
+    return rates
+
+
+def get_nic_speed():
+    """Return the speed (Mbit/s) of the fastest NIC with a link, or None."""
+    speeds = []
+    for path in glob.glob('/sys/class/net/*/speed'):
+        try:
+            with open(path) as f:
+                speeds.append(int(f.read().strip()))
+        except (IOError, ValueError):
+            # Virtual and down interfaces do not report a speed.
+            continue
+    speeds = [speed for speed in speeds if speed > 0]
+    return max(speeds) if speeds else None
+
+
+def get_numa_node_count():
+    """Return the number of NUMA nodes, 1 where sysfs does not list them."""
+    nodes = glob.glob(os.path.join(SYSFS_NODE_DIR, 'node[0-9]*'))
+    return max(1, len(nodes))
+
+
+def get_node_profile():
+    """Describe the hardware of this node for get_recommendations()."""
+    devices = get_local_devices()
+    hdds = [device for device in devices if is_rotational(device)]
+    return {
+        'cpus': multiprocessing.cpu_count(),
+        'ram': get_total_ram(),
+        'numa-nodes': get_numa_node_count(),
+        'devices': devices,
+        'hdds': len(hdds),
+        'ssds': len(devices) - len(hdds),
+        'nic-speed': get_nic_speed(),
+    }
+
+
+def get_recommendations(profile):
+    """Return recommended settings for the node described by profile.
+
+    Returns a dict of config option to a (value, derivation) tuple where
+    derivation explains how the value was reached.
+    """
+    cpus = profile['cpus']
+    nodes = profile['numa-nodes']
+    disks = profile['hdds'] + profile['ssds']
+    rec = {}
+
+    workers = max(cpus, disks, 1)
+    derivation = ('max(cpus=%d, disks=%d): one worker per disk so a slow '
+                  'disk only blocks its own worker, at least one per cpu' %
+                  (cpus, disks))
+    if workers % nodes:
+        workers += nodes - workers % nodes
+        derivation += (', rounded up to a multiple of numa-nodes=%d so '
+                       'each node runs as many' % nodes)
+    rec['object-workers'] = (workers, derivation)
+    rec['container-workers'] = (
+        max(2, cpus // 4), 'max(2, cpus=%d // 4)' % cpus)
+    rec['account-workers'] = (
+        max(2, cpus // 8), 'max(2, cpus=%d // 8)' % cpus)
+
+    if profile['hdds']:
+        rec['object-server-threads-per-disk'] = (
+            4, '4 for rotational disks, which serve few concurrent seeks')
+    elif disks:
+        rec['object-server-threads-per-disk'] = (
+            8, '8 for solid state disks, which sustain deep queues')
+
+    connections = max(2, disks * 2)
+    derivation = 'max(2, disks=%d * 2)' % disks
+    if profile['nic-speed']:
+        limit = max(2, profile['nic-speed'] // RSYNC_CONNECTION_MBPS)
+        if limit < connections:
+            connections = limit
+            derivation = ('nic-speed=%dMbit/s // %dMbit/s per connection' %
+                          (profile['nic-speed'], RSYNC_CONNECTION_MBPS))
+    rec['object-max-connections'] = (connections, derivation)
+    rec['object-replicator-concurrency'] = (
+        max(1, min(disks // 2, cpus // 2, connections)),
+        'max(1, min(disks=%d // 2, cpus=%d // 2, object-max-connections=%d))'
+        % (disks, cpus, connections))
+
+    ram_per_disk = profile['ram'] // max(disks, 1)
+    if ram_per_disk >= 2 * 1024 ** 3:
+        rec['object-keep-cache-size'] = (
+            SWIFT_KEEP_CACHE_SIZE,
+            '%dMiB RAM per disk leaves room to cache small objects' %
+            (ram_per_disk // 1024 ** 2))
+    else:
+        rec['object-keep-cache-size'] = (
+            0, '%dMiB RAM per disk is kept for inode and dentry caches' %
+            (ram_per_disk // 1024 ** 2))
+
+    rates = get_auditor_rates(profile['devices'])
+    derivation = ('per-device budgets for %d hdds and %d ssds spread over '
+                  '%d auditor workers' % (profile['hdds'], profile['ssds'],
+                                          rates.get('concurrency', 0)))
+    for key, value in rates.items():
+        option = 'auditor-%s' % key.replace('_', '-')
+        rec[option] = (value, derivation)
+    return rec
+
+
+@cached
+def get_tuning():
+    """Return the recommendations for this node, computed once per hook."""
+    return get_recommendations(get_node_profile())
+
+
+@cached
+def get_charm_defaults():
+    """Return the default value of each option in config.yaml."""
+    with open(os.path.join(charm_dir(), 'config.yaml')) as f:
+        options = yaml.safe_load(f)['options']
+    return {k: v.get('default') for k, v in options.items()}
+
+
+def is_explicit(option):
+    """Return True if option has been set to other than its default."""
+    return config(option) != get_charm_defaults().get(option)
+
+
+def tuned_config(option):
+    """Return config(option), or its recommended value under auto-tune.
+
+    Explicitly set options always take priority over recommendations.
+    """
+    if not config('auto-tune') or is_explicit(option):
+        return config(option)
+
+    recommendation = get_tuning().get(option)
+    if recommendation is None:
+        return config(option)
+    return recommendation[0]
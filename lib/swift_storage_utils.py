@@ -1,9 +1,11 @@
+import glob
 import json
 import os
 import re
 import subprocess
 import shutil
 import tempfile
+import yaml
 
 from subprocess import check_call, call, CalledProcessError, check_output
 
@@ -16,9 +18,29 @@ from misc_utils import (
 )
 
 from swift_storage_context import (
+    AuditorContext,
+    BackgroundProfileContext,
     SwiftStorageContext,
     SwiftStorageServerContext,
     RsyncContext,
+    ServerWorkerContext,
+    StatsdContext,
+    UpdaterContext,
+    NETWORK_BACKLOG,
+    PROFILE_OPTIONS,
+    get_background_profiles,
+    get_background_schedule,
+    get_sysctl_overrides,
+)
+
+from swift_storage_tuning import (
+    get_local_devices,
+)
+
+from hook_tools import (
+    config,
+    relations,
+    unit_private_ip,
 )
 
 from charmhelpers.fetch import (
@@ -28,27 +50,38 @@ from charmhelpers.fetch import (
 
 from charmhelpers.core.unitdata import (
     Storage as KVStore,
+    kv,
 )
 
 from charmhelpers.core.host import (
+    file_hash,
+    get_total_ram,
+    init_is_systemd,
+    is_container,
     mkdir,
+    mounts,
     mount,
     fstab_add,
+    rsync,
     service_restart,
-    lsb_release
+    service_running,
+    service_start,
+    service_stop,
+    symlink,
+    lsb_release,
+    write_file,
 )
 
 from charmhelpers.core.hookenv import (
-    config,
     log,
     DEBUG,
     INFO,
     WARNING,
     ERROR,
-    unit_private_ip,
     local_unit,
-    relation_get,
-    relation_ids,
+    status_set,
+    open_port,
+    close_port,
 )
 
 from charmhelpers.contrib.storage.linux.utils import (
@@ -61,17 +94,29 @@ from charmhelpers.contrib.storage.linux.loopback import (
 )
 
 from charmhelpers.contrib.openstack.utils import (
+    _determine_os_workload_status,
     configure_installation_source,
     get_os_codename_install_source,
-    get_os_codename_package,
     save_script_rc as _save_script_rc,
 )
 
+from package_cache import (
+    DPKG_STATUS,
+    get_os_codename_package,
+    os_application_version_set,
+)
+
+from charmhelpers.contrib.network.ip import (
+    get_iface_from_addr,
+)
+
 from charmhelpers.contrib.openstack import (
     templating,
     context
 )
 
+from charmhelpers.core.sysctl import create as sysctl_create
+
 from charmhelpers.core.decorators import (
     retry_on_exception,
 )
@@ -107,6 +152,13 @@ OBJECT_SVCS = [
 
 SWIFT_SVCS = ACCOUNT_SVCS + CONTAINER_SVCS + OBJECT_SVCS
 
+# Services answering proxy requests; everything else in SWIFT_SVCS is a
+# background daemon.
+FOREGROUND_SVCS = ['swift-account', 'swift-container', 'swift-object']
+
+SERVICE_ISOLATION_DROPIN = \
+    '/etc/systemd/system/%s.service.d/50-swift-storage-isolation.conf'
+
 RESTART_MAP = {
     '/etc/rsync-juju.d/050-swift-storage.conf': ['rsync'],
     '/etc/swift/account-server.conf': ACCOUNT_SVCS,
@@ -114,8 +166,15 @@ RESTART_MAP = {
     '/etc/swift/object-server.conf': OBJECT_SVCS,
     '/etc/swift/swift.conf': ACCOUNT_SVCS + CONTAINER_SVCS + OBJECT_SVCS
 }
+RESTART_MAP.update({SERVICE_ISOLATION_DROPIN % svc: [svc]
+                    for svc in SWIFT_SVCS})
 
 SWIFT_CONF_DIR = '/etc/swift'
+SWIFT_RECON_CACHE = '/var/cache/swift'
+SWIFT_RUN_DIR = '/var/run/swift'
+# unitdata key of the inputs and result of the last workload status
+# evaluation, see update_workload_status().
+STATUS_CACHE_KEY = 'workload-status-cache'
 SWIFT_RING_EXT = 'ring.gz'
 
 # NOTE(hopem): we intentionally place this database outside of unit context so
@@ -128,6 +187,25 @@ SWIFT_RING_EXT = 'ring.gz'
 # FIXME: add charm support for removing devices (see LP: #1448190)
 KV_DB_PATH = '/var/lib/juju/swift_storage/charm_kvdata.db'
 
+BACKGROUND_TOOLS_DIR = '/usr/local/lib/swift-background'
+BACKGROUND_PROFILES = '/etc/swift/background-profiles.json'
+BACKGROUND_PROFILE_BIN = '/usr/local/bin/swift-background-profile'
+BACKGROUND_PROFILE_CRON = '/etc/cron.d/swift-background-profile'
+BACKGROUND_CONTROLLER = '/etc/swift/background-controller.json'
+BACKGROUND_CONTROLLER_BIN = '/usr/local/bin/swift-background-controller'
+BACKGROUND_CONTROLLER_CRON = '/etc/cron.d/swift-background-controller'
+
+EXPORTER_SERVICE = 'swift-storage-exporter'
+EXPORTER_DIR = '/usr/local/lib/swift-storage-exporter'
+EXPORTER_BIN = os.path.join(EXPORTER_DIR, EXPORTER_SERVICE)
+EXPORTER_SYSTEMD_UNIT = '/etc/systemd/system/swift-storage-exporter.service'
+EXPORTER_UPSTART_JOB = '/etc/init/swift-storage-exporter.conf'
+EXPORTER_PORT_KEY = 'prometheus-exporter-opened-port'
+
+SYSCTL_FILE = '/etc/sysctl.d/50-swift-storage.conf'
+XFSSYNCD_CENTISECS = '/proc/sys/fs/xfs/xfssyncd_centisecs'
+SYSFS_NODE_DIR = '/sys/devices/system/node'
+
 
 def ensure_swift_directories():
     '''
@@ -155,7 +233,12 @@ def register_configs():
         configs.register('/etc/swift/%s-server.conf' % server,
                          [SwiftStorageServerContext(),
                           context.BindHostContext(),
-                          context.WorkerConfigContext()]),
+                          context.WorkerConfigContext(),
+                          ServerWorkerContext(server),
+                          StatsdContext(),
+                          AuditorContext(),
+                          UpdaterContext(),
+                          BackgroundProfileContext()]),
     return configs
 
 
@@ -347,8 +430,9 @@ def is_device_in_ring(dev, skip_rel_check=False, ignore_deactivated=True):
         return False
 
     # Then check swift-storage relation with proxy
-    for rid in relation_ids('swift-storage'):
-        devstore = relation_get(attribute='device', rid=rid, unit=local_unit())
+    unit = local_unit()
+    for units in relations('swift-storage', local=True).values():
+        devstore = units[unit].get('device')
         if devstore and dev in devstore.split(':'):
             if not ignore_deactivated or dev not in deactivated:
                 log("Device '%s' appears to be in use by swift (found on "
@@ -413,8 +497,9 @@ def remember_devices(devs):
 
 
 def ensure_devs_tracked():
-    for rid in relation_ids('swift-storage'):
-        devs = relation_get(attribute='device', rid=rid, unit=local_unit())
+    unit = local_unit()
+    for units in relations('swift-storage', local=True).values():
+        devs = units[unit].get('device')
         if devs:
             for dev in devs.split(':'):
                 # this will migrate if not already in the local store
@@ -560,3 +645,727 @@ def assess_status(configs):
                 "Paused. Use 'resume' action to resume normal service.")
     else:
         return ("active", "Unit is ready")
+
+
+def get_async_pending():
+    """Return the object async pending count from the recon cache.
+
+    Returns None if the object updater has not reported a count yet.
+    """
+    try:
+        with open(os.path.join(SWIFT_RECON_CACHE, 'object.recon')) as f:
+            return int(json.load(f)['async_pending'])
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def get_status_message(state, message):
+    """Return message with the async pending backlog of an active unit."""
+    if state == 'active':
+        async_pending = get_async_pending()
+        if async_pending is not None:
+            message = '%s (async pendings: %d)' % (message, async_pending)
+    return message
+
+
+def get_swift_services():
+    """Return the swift services which should be running on the unit."""
+    services = SWIFT_SVCS[:]
+    # Before Icehouse there was no swift-container-sync
+    release = get_os_codename_package('swift-container', fatal=False)
+    if release and release < 'icehouse':
+        services.remove('swift-container-sync')
+    return services
+
+
+def get_server_ports():
+    """Return the ports of the account, container and object servers."""
+    return [config('account-server-port'), config('container-server-port'),
+            config('object-server-port')]
+
+
+def get_running_services(services):
+    """Return {service: running} for services from one init system query.
+
+    With systemd this is a single systemctl show for all of the units, and
+    with upstart a single initctl list, falling back to the init script
+    status of services upstart does not know.
+    """
+    if init_is_systemd():
+        cmd = ['systemctl', 'show', '--property=Id',
+               '--property=ActiveState']
+        cmd.extend('%s.service' % service for service in services)
+        states = {}
+        for block in check_output(cmd).decode('UTF-8').split('\n\n'):
+            unit = dict(line.split('=', 1) for line in block.splitlines()
+                        if '=' in line)
+            if 'Id' in unit:
+                states[unit['Id']] = unit.get('ActiveState')
+        return {service: states.get('%s.service' % service) in
+                ('active', 'reloading')
+                for service in services}
+
+    jobs = {}
+    for line in check_output(['initctl', 'list']).decode('UTF-8').splitlines():
+        if line.strip():
+            jobs[line.split()[0]] = 'start/running' in line
+    return {service: jobs[service] if service in jobs
+            else service_running(service)
+            for service in services}
+
+
+def check_swift_services(running=True):
+    """Check the swift services and server ports are up, or all down.
+
+    The services are queried in one go by get_running_services() and the
+    ports read from /proc/net rather than checked one at a time. Returns
+    (state, message) on a mismatch, using the messages of charmhelpers'
+    own service checks, or (None, None).
+    """
+    services = get_running_services(get_swift_services())
+    ports = get_server_ports()
+    listening = get_listening_ports()
+    wrong_services = sorted(service for service, up in services.items()
+                            if up != running)
+    wrong_ports = [str(port) for port in ports
+                   if (port in listening) != running]
+    messages = []
+    if running:
+        if wrong_services:
+            messages.append('Services not running that should be: %s' %
+                            ', '.join(wrong_services))
+        if wrong_ports:
+            messages.append('Ports which should be open, but are not: %s' %
+                            ', '.join(wrong_ports))
+        if messages:
+            return 'blocked', '; '.join(messages)
+    else:
+        if wrong_services:
+            messages.append('these services running: %s' %
+                            ', '.join(wrong_services))
+        if wrong_ports:
+            messages.append('these ports which should be closed, but are '
+                            'open: %s' % ', '.join(wrong_ports))
+        if messages:
+            return 'blocked', 'Services should be paused but %s' % \
+                ', '.join(messages)
+    return None, None
+
+
+def set_workload_status(configs):
+    """Set the workload status of the unit.
+
+    Once the relations are complete, or the unit is paused, the swift
+    services and ports are checked with check_swift_services(). When the
+    unit is active the async pending backlog is included in the message
+    so it is visible when the updaters are not keeping up.
+
+    Returns the (state, message) determined before the backlog was added.
+    """
+    state, message = _determine_os_workload_status(
+        configs, REQUIRED_INTERFACES, charm_func=assess_status)
+    paused = is_paused()
+    if state == 'active' or paused:
+        check_state, check_message = check_swift_services(running=not paused)
+        if check_state is not None:
+            state, message = check_state, check_message
+    status_set(state, get_status_message(state, message))
+    return state, message
+
+
+def get_swift_pids(run_dir=SWIFT_RUN_DIR):
+    """Return the pid of each swift pid file, or None if it is not running.
+
+    The result is keyed on the path of the pid file relative to run_dir.
+    """
+    pids = {}
+    paths = glob.glob(os.path.join(run_dir, '*.pid'))
+    paths.extend(glob.glob(os.path.join(run_dir, '*', '*.pid')))
+    for path in paths:
+        try:
+            with open(path) as f:
+                pid = int(f.read().strip())
+        except (IOError, ValueError):
+            pid = None
+        if pid and not os.path.exists('/proc/%d' % pid):
+            pid = None
+        pids[os.path.relpath(path, run_dir)] = pid
+    return pids
+
+
+def get_listening_ports():
+    """Return the sorted TCP ports listened on, read from /proc/net."""
+    ports = set()
+    for path in ['/proc/net/tcp', '/proc/net/tcp6']:
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # 0A is TCP_LISTEN
+            if len(fields) > 3 and fields[3] == '0A':
+                ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+    return sorted(ports)
+
+
+def get_status_inputs(ports):
+    """Return the inputs of the workload status that are cheap to read.
+
+    These are the running swift daemons, which of ports are listened on,
+    whether the unit is paused and the state of the dpkg database.
+    """
+    try:
+        st = os.stat(DPKG_STATUS)
+        dpkg = [st.st_mtime, st.st_size]
+    except OSError:
+        dpkg = None
+    return {
+        'pids': get_swift_pids(),
+        'ports': [port for port in get_listening_ports() if port in ports],
+        'paused': bool(kv().get('unit-paused')),
+        'dpkg': dpkg,
+    }
+
+
+def update_workload_status(configs, force=True):
+    """Set the workload status and application version of the unit.
+
+    update-status runs every few minutes on every unit, so unless force is
+    set the full evaluation (relation data, contexts and the apt cache) is
+    skipped while the inputs from get_status_inputs() are unchanged since
+    the last one. Only the async pending backlog is refreshed then.
+    """
+    db = kv()
+    cache = db.get(STATUS_CACHE_KEY)
+    if not force and cache:
+        inputs = get_status_inputs(cache['ports'])
+        if inputs == cache['inputs']:
+            message = get_status_message(cache['state'], cache['message'])
+            if message != cache['shown']:
+                status_set(cache['state'], message)
+                cache['shown'] = message
+                db.set(STATUS_CACHE_KEY, cache)
+                db.flush()
+            return
+
+    ports = get_server_ports()
+    state, message = set_workload_status(configs)
+    os_application_version_set(VERSION_PACKAGE)
+    db.set(STATUS_CACHE_KEY, {
+        'inputs': get_status_inputs(ports),
+        'ports': ports,
+        'state': state,
+        'message': message,
+        'shown': get_status_message(state, message),
+    })
+    db.flush()
+
+
+def get_profile_settings(profile):
+    """Return the server config settings rendered for a background profile.
+
+    The result maps each server config file to the sections and keys which
+    any background profile may change, with the values a hook would render
+    if the profile were active (None meaning the key is not rendered).
+    """
+    contexts = [SwiftStorageServerContext(profile=profile),
+                AuditorContext(profile=profile),
+                UpdaterContext(profile=profile),
+                BackgroundProfileContext(profile=profile)]
+    ctxt = {}
+    for _ctxt in contexts:
+        ctxt.update(_ctxt())
+
+    options = set()
+    for _profile in get_background_profiles().values():
+        options.update(_profile.keys())
+
+    settings = {}
+    for option in options:
+        for server, section, key in PROFILE_OPTIONS[option]:
+            if section == 'object-replicator':
+                value = ctxt['object_replicator_concurrency']
+            else:
+                value = ctxt[section.replace('-', '_')].get(key)
+            conf = '/etc/swift/%s-server.conf' % server
+            settings.setdefault(conf, {}).setdefault(section, {})[key] = value
+    return settings
+
+
+def install_background_tools():
+    """Install the background daemon tuning tools shipped with the charm."""
+    rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'background', ''),
+          BACKGROUND_TOOLS_DIR)
+    for tool in [BACKGROUND_PROFILE_BIN, BACKGROUND_CONTROLLER_BIN]:
+        symlink(os.path.join(BACKGROUND_TOOLS_DIR, os.path.basename(tool)),
+                tool)
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            log('Removing %s' % path, level=DEBUG)
+            os.unlink(path)
+
+
+def setup_background_profiles():
+    """Install or remove the time of day background profile schedule.
+
+    The settings of every profile are written to BACKGROUND_PROFILES and a
+    cron entry applies the scheduled profile at each window boundary so
+    that no hook execution is needed.
+    """
+    profiles = get_background_profiles()
+    schedule = get_background_schedule(profiles)
+    if not schedule:
+        remove_files([BACKGROUND_PROFILE_CRON, BACKGROUND_PROFILES])
+        return
+
+    data = {
+        'schedule': schedule,
+        'profiles': {name: get_profile_settings(profiles[name])
+                     for name in set(n for _, n in schedule)},
+    }
+    write_file(BACKGROUND_PROFILES, json.dumps(data, sort_keys=True),
+               perms=0o644)
+    install_background_tools()
+
+    cron = ['# Managed by juju: applies the background profile scheduled by',
+            '# the background-schedule option of the swift-storage charm.']
+    for start, name in schedule:
+        cron.append('%d %d * * * root %s' %
+                    (start % 60, start // 60, BACKGROUND_PROFILE_BIN))
+    write_file(BACKGROUND_PROFILE_CRON, '\n'.join(cron) + '\n',
+               perms=0o644)
+
+
+def setup_background_controller():
+    """Install or remove the adaptive background concurrency controller.
+
+    The controller runs every minute from cron and adjusts updater,
+    replicator and auditor concurrency within the bounds written to
+    BACKGROUND_CONTROLLER.
+    """
+    if not config('adaptive-background-concurrency'):
+        remove_files([BACKGROUND_CONTROLLER_CRON, BACKGROUND_CONTROLLER])
+        return
+
+    data = {
+        'devices': get_local_devices(),
+        'async_pending_threshold': config('adaptive-async-pending-threshold'),
+        'updater_concurrency_max':
+            config('adaptive-updater-concurrency-max'),
+        'throttled_concurrency_min':
+            config('adaptive-throttled-concurrency-min'),
+        'disk_util_target': config('adaptive-disk-util-target'),
+        'disk_await_target': config('adaptive-disk-await-target'),
+    }
+    write_file(BACKGROUND_CONTROLLER, json.dumps(data, sort_keys=True),
+               perms=0o644)
+    install_background_tools()
+    write_file(BACKGROUND_CONTROLLER_CRON,
+               '# Managed by juju: swift-storage adaptive-background-'
+               'concurrency\n* * * * * root %s\n' % BACKGROUND_CONTROLLER_BIN,
+               perms=0o644)
+
+
+def get_storage_sysctl(total_ram, ndevices):
+    """Kernel VM and filesystem settings for a storage node.
+
+    Keeps XFS inodes and dentries cached in preference to page cache and
+    bounds dirty page cache so writeback does not stall the object servers.
+    Writeback starts at 64MiB per device, capped at 1% of RAM.
+    """
+    mib = 1024 * 1024
+    settings = {
+        'vm.vfs_cache_pressure': 10,
+        'vm.dirty_ratio': 10 if total_ram >= 32 * 1024 * mib else 20,
+        'vm.dirty_background_bytes': max(
+            64 * mib, min(64 * mib * max(ndevices, 1), total_ram // 100)),
+        'vm.min_free_kbytes': max(
+            65536, min(total_ram // 1024 // 100, 2 * 1024 * 1024)),
+    }
+    # The xfs key only exists once the module is loaded; sysctl -p fails
+    # on unknown keys.
+    if os.path.exists(XFSSYNCD_CENTISECS):
+        settings['fs.xfs.xfssyncd_centisecs'] = 1000
+    return settings
+
+
+def get_network_sysctl(total_ram, ndevices):
+    """Kernel network settings for a storage node.
+
+    Deepens the accept and SYN queues so that bursts of short connections
+    from proxies and replicators are not dropped, allows TIME_WAIT sockets
+    to be reused for outgoing replication connections and raises socket
+    buffer limits to 16MiB.
+    """
+    buffer_max = 16 * 1024 * 1024
+    return {
+        'net.core.somaxconn': NETWORK_BACKLOG,
+        'net.core.netdev_max_backlog': NETWORK_BACKLOG,
+        'net.ipv4.tcp_max_syn_backlog': NETWORK_BACKLOG,
+        'net.ipv4.tcp_tw_reuse': 1,
+        'net.core.rmem_max': buffer_max,
+        'net.core.wmem_max': buffer_max,
+        'net.ipv4.tcp_rmem': '4096 87380 %d' % buffer_max,
+        'net.ipv4.tcp_wmem': '4096 65536 %d' % buffer_max,
+    }
+
+
+SYSCTL_PROFILES = {
+    'storage': get_storage_sysctl,
+    'network': get_network_sysctl,
+}
+
+
+def get_sysctl_settings():
+    """Return the kernel settings for the sysctl-profile and sysctl options.
+
+    Values from the sysctl option override those derived from the profiles.
+    """
+    settings = {}
+    profiles = (config('sysctl-profile') or '').split()
+    if profiles:
+        total_ram = get_total_ram()
+        ndevices = len(get_local_devices())
+    for profile in profiles:
+        if profile not in SYSCTL_PROFILES:
+            log("Ignoring unknown sysctl-profile '%s'" % profile,
+                level=WARNING)
+            continue
+        settings.update(SYSCTL_PROFILES[profile](total_ram, ndevices))
+
+    settings.update(get_sysctl_overrides())
+    return settings
+
+
+def setup_sysctl():
+    """Write and apply the managed sysctl file, or remove it if unused."""
+    if is_container():
+        log('Not applying kernel settings in a container', level=INFO)
+        return
+
+    settings = get_sysctl_settings()
+    if not settings:
+        remove_files([SYSCTL_FILE])
+        return
+    sysctl_create(yaml.safe_dump(settings), SYSCTL_FILE)
+
+
+def get_systemd_version():
+    """Return the major version of the running systemd."""
+    return int(check_output(['systemctl', '--version']).split()[1])
+
+
+def get_swift_block_devices():
+    """Return the block devices mounted under /srv/node."""
+    return sorted(set(dev for mp, dev in mounts()
+                      if os.path.dirname(mp) == '/srv/node'))
+
+
+def get_service_isolation(service, systemd_version, devices, affinity=None):
+    """Return the resource control drop-in for a swift service.
+
+    Weights are given on the CPUWeight/IOWeight scale (default 100) and are
+    converted to CPUShares/BlockIOWeight for systemd older than 234.
+    affinity maps the 'foreground' and 'background' service groups to the
+    CPUs they are pinned to, if any.
+    """
+    foreground = service in FOREGROUND_SVCS
+    group = 'foreground' if foreground else 'background'
+    lines = ['# Managed by juju: swift-storage service-isolation',
+             '[Service]']
+    if config('service-isolation'):
+        weight = config('%s-service-weight' % group)
+        if systemd_version >= 234:
+            lines.append('CPUWeight=%d' % weight)
+            lines.append('IOWeight=%d' % weight)
+            bandwidth_key = 'IOReadBandwidthMax'
+        else:
+            lines.append('CPUShares=%d' % (weight * 1024 // 100))
+            lines.append('BlockIOWeight=%d' % max(10, min(weight * 5, 1000)))
+            bandwidth_key = 'BlockIOReadBandwidth'
+
+        bandwidth = config('background-read-bandwidth-max')
+        if bandwidth and service.endswith(('-replicator', '-auditor')):
+            for dev in devices:
+                lines.append('%s=%s %s' % (bandwidth_key, dev, bandwidth))
+
+    cpus = (affinity or {}).get(group)
+    if cpus:
+        lines.append('CPUAffinity=%s' % ' '.join(str(cpu) for cpu in cpus))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_cpulist(cpulist):
+    """Expand a kernel cpulist (eg. 0-3,8) into a sorted list of CPUs."""
+    cpus = set()
+    for part in cpulist.replace(' ', ',').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def get_numa_nodes():
+    """Return a dict of NUMA node id to the CPUs it contains."""
+    nodes = {}
+    for path in glob.glob(os.path.join(SYSFS_NODE_DIR, 'node*', 'cpulist')):
+        node = os.path.basename(os.path.dirname(path))[len('node'):]
+        with open(path) as f:
+            nodes[int(node)] = parse_cpulist(f.read().strip())
+    return nodes
+
+
+def get_device_numa_node(path):
+    """Return the NUMA node of the device behind a sysfs path, or None.
+
+    The device tree is walked upwards from path until a numa_node
+    attribute is found, so partitions and virtual block devices resolve to
+    their controller.
+    """
+    path = os.path.realpath(path)
+    while path.startswith('/sys/devices/'):
+        numa_node = os.path.join(path, 'numa_node')
+        if os.path.exists(numa_node):
+            with open(numa_node) as f:
+                node = int(f.read().strip())
+            return node if node >= 0 else None
+        path = os.path.dirname(path)
+    return None
+
+
+def is_iface_irq(name, iface):
+    """Return True if the IRQ action name belongs to iface.
+
+    Drivers name their IRQs after the interface, on its own or followed by
+    a queue suffix such as eth0-TxRx-0, so eth1 must not match eth10.
+    """
+    return name == iface or name.startswith(iface + '-')
+
+
+def get_irq_cpus(iface):
+    """Return the CPU affinity of each IRQ raised by iface."""
+    irq_cpus = []
+    with open('/proc/interrupts') as f:
+        for line in f:
+            fields = line.split()
+            # A shared IRQ lists each of its actions, separated by commas.
+            names = [field.rstrip(',') for field in fields[1:]]
+            if not any(is_iface_irq(name, iface) for name in names):
+                continue
+            irq = fields[0].rstrip(':')
+            try:
+                with open('/proc/irq/%s/smp_affinity_list' % irq) as f_irq:
+                    irq_cpus.append(parse_cpulist(f_irq.read().strip()))
+            except IOError:
+                continue
+    return irq_cpus
+
+
+def get_local_numa_nodes(nodes):
+    """Return the NUMA nodes local to the storage HBAs and NIC.
+
+    A node is local if it hosts the controller of a data disk or the NIC
+    carrying the unit's private address, or if an IRQ of that NIC is
+    confined to its CPUs.
+    """
+    local = set()
+    paths = [os.path.join('/sys/class/block', os.path.basename(dev))
+             for dev in get_swift_block_devices()]
+    iface = get_iface_from_addr(unit_private_ip())
+    if iface:
+        paths.append(os.path.join('/sys/class/net', iface))
+    for path in paths:
+        node = get_device_numa_node(path)
+        if node is not None:
+            local.add(node)
+
+    if iface:
+        for cpus in get_irq_cpus(iface):
+            irq_nodes = [n for n, node_cpus in nodes.items()
+                         if set(cpus) & set(node_cpus)]
+            if len(irq_nodes) == 1:
+                local.add(irq_nodes[0])
+    return local
+
+
+def get_cpu_affinity():
+    """Resolve the foreground and background CPU affinity options.
+
+    Each option is either a CPU list or 'local' / 'remote', selecting the
+    CPUs of the NUMA nodes local to the storage devices and NIC or of the
+    remaining nodes. When every node is local, or the host has a single
+    node, both resolve to all CPUs.
+    """
+    affinity = {}
+    nodes = None
+    for group in ('foreground', 'background'):
+        value = config('%s-cpu-affinity' % group)
+        if not value:
+            continue
+        if value not in ('local', 'remote'):
+            try:
+                cpus = parse_cpulist(value)
+            except ValueError:
+                cpus = None
+            if not cpus:
+                log("Ignoring invalid %s-cpu-affinity '%s'" % (group, value),
+                    level=WARNING)
+                continue
+            affinity[group] = cpus
+            continue
+
+        if nodes is None:
+            nodes = get_numa_nodes()
+            local = get_local_numa_nodes(nodes)
+            if not local or local == set(nodes):
+                log('No NUMA locality to exploit, not restricting CPU '
+                    'affinity', level=INFO)
+                local = set(nodes)
+            remote = (set(nodes) - local) or set(nodes)
+        selected = local if value == 'local' else remote
+        affinity[group] = sorted(cpu for node in selected
+                                 for cpu in nodes[node])
+    return affinity
+
+
+def setup_service_isolation():
+    """Install or remove systemd drop-ins weighting swift services.
+
+    The account, container and object servers are given a larger share of
+    CPU and disk time than the replicators, auditors, updaters and reaper,
+    whose reads from the data disks may also be capped, and either group
+    may be pinned to a set of CPUs. Services are
+    restarted through RESTART_MAP when their drop-in changes.
+    """
+    enabled = any(config(option) for option in (
+        'service-isolation', 'foreground-cpu-affinity',
+        'background-cpu-affinity'))
+    if not init_is_systemd():
+        if enabled:
+            log('service-isolation and cpu affinity require systemd, '
+                'ignoring', level=WARNING)
+        return
+
+    changed = False
+    if not enabled:
+        for service in SWIFT_SVCS:
+            dropin = SERVICE_ISOLATION_DROPIN % service
+            if os.path.exists(dropin):
+                remove_files([dropin])
+                changed = True
+    else:
+        version = get_systemd_version()
+        devices = get_swift_block_devices()
+        affinity = get_cpu_affinity()
+        for service in SWIFT_SVCS:
+            dropin = SERVICE_ISOLATION_DROPIN % service
+            content = get_service_isolation(service, version, devices,
+                                            affinity)
+            if os.path.exists(dropin):
+                with open(dropin) as f:
+                    if f.read() == content:
+                        continue
+            mkdir(os.path.dirname(dropin), perms=0o755)
+            write_file(dropin, content, perms=0o644)
+            changed = True
+
+    if changed:
+        check_call(['systemctl', 'daemon-reload'])
+
+
+def get_exporter_service(address, port):
+    """Return the systemd unit or upstart job running the exporter."""
+    command = '%s --address %s --port %d' % (EXPORTER_BIN, address, port)
+    if init_is_systemd():
+        return ('# Managed by juju: swift-storage prometheus-exporter\n'
+                '[Unit]\n'
+                'Description=Swift storage Prometheus exporter\n'
+                'After=network.target\n\n'
+                '[Service]\n'
+                'User=swift\n'
+                'ExecStart=/usr/bin/python %s\n'
+                'Restart=on-failure\n\n'
+                '[Install]\n'
+                'WantedBy=multi-user.target\n' % command)
+    return ('# Managed by juju: swift-storage prometheus-exporter\n'
+            'description "Swift storage Prometheus exporter"\n'
+            'start on runlevel [2345]\n'
+            'stop on runlevel [!2345]\n'
+            'respawn\n'
+            'setuid swift\n'
+            'exec /usr/bin/python %s\n' % command)
+
+
+def set_exporter_port(port):
+    """Open port for the exporter, closing any other port opened for it.
+
+    The opened port is kept in the unit state so a change of
+    prometheus-exporter-port does not leave the old port exposed. A port of
+    None just closes the opened one.
+    """
+    db = kv()
+    opened = db.get(EXPORTER_PORT_KEY)
+    if opened and opened != port:
+        close_port(opened)
+    if port:
+        open_port(port)
+    db.set(EXPORTER_PORT_KEY, port)
+    db.flush()
+
+
+def setup_exporter():
+    """Install, update or remove the Prometheus exporter service.
+
+    The exporter is restarted only when its script or service definition
+    changes, and is left stopped while the unit is paused. Its port is only
+    opened if prometheus-exporter-open-port is set.
+    """
+    if init_is_systemd():
+        service_file = EXPORTER_SYSTEMD_UNIT
+    else:
+        service_file = EXPORTER_UPSTART_JOB
+    port = config('prometheus-exporter-port')
+
+    if not config('prometheus-exporter'):
+        if os.path.exists(service_file):
+            service_stop(EXPORTER_SERVICE)
+            remove_files([service_file])
+        set_exporter_port(None)
+        return
+
+    before = file_hash(EXPORTER_BIN)
+    rsync(os.path.join(os.getenv('CHARM_DIR'), 'files', 'exporter', ''),
+          EXPORTER_DIR)
+    changed = before != file_hash(EXPORTER_BIN)
+
+    content = get_exporter_service(
+        config('prometheus-exporter-address') or '127.0.0.1', port)
+    current = None
+    if os.path.exists(service_file):
+        with open(service_file) as f:
+            current = f.read()
+    if current != content:
+        write_file(service_file, content, perms=0o644)
+        changed = True
+        if init_is_systemd():
+            check_call(['systemctl', 'daemon-reload'])
+            check_call(['systemctl', 'enable', EXPORTER_SERVICE])
+
+    if is_paused():
+        log('Unit is paused, not starting %s' % EXPORTER_SERVICE,
+            level=INFO)
+    elif changed:
+        service_restart(EXPORTER_SERVICE)
+    else:
+        service_start(EXPORTER_SERVICE)
+    set_exporter_port(port if config('prometheus-exporter-open-port')
+                      else None)
@@ -0,0 +1,171 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+from charmhelpers.core import hookenv, unitdata
+from charmhelpers.core.hookenv import log, DEBUG, WARNING
+
+from hook_tools import config
+
+# Write a key unless it already has that value, so that unchanged keys
+# neither rewrite their row nor record a revision.
+KV_UPSERT = '''
+    insert or replace into kv (key, data)
+    select ?, ? where not exists (
+        select 1 from kv where key = ? and data = ?)'''
+REVISION_UPSERT = '''
+    insert or replace into kv_revisions (key, revision, data)
+    select ?, ?, ? where not exists (
+        select 1 from kv where key = ? and data = ?)'''
+
+# unitdata key of the first hooks.version of each of the recent runs, see
+# CompactStorage.start_run().
+RUNS_KEY = 'unit-state-runs'
+# Milliseconds to wait for another process, such as a vacuum, to release
+# the database before failing with "database is locked".
+BUSY_TIMEOUT = 60000
+# Vacuum once this fraction of the database is free pages.
+VACUUM_FREE_RATIO = 0.25
+VACUUM_SCRIPT = '''
+import sqlite3, sys
+conn = sqlite3.connect(sys.argv[1], timeout=60)
+conn.execute('vacuum')
+conn.close()
+'''
+
+
+class CompactStorage(unitdata.Storage):
+    """unitdata.Storage with cheaper writes and bounded history.
+
+    Storage.set() reads a key before inserting or updating it, and again
+    for its revision, and update() does that one key at a time. Here each
+    write is a single conditional upsert and update() batches them with
+    executemany(). The database uses write-ahead logging, and prune()
+    drops the revisions and hooks older than a number of runs of the charm.
+    """
+
+    def _init(self):
+        self.cursor.execute('pragma busy_timeout=%d' % BUSY_TIMEOUT)
+        try:
+            self.cursor.execute('pragma journal_mode=wal')
+            self.cursor.execute('pragma synchronous=normal')
+        except sqlite3.DatabaseError as e:
+            log('Unable to use WAL for %s: %s' % (self.db_path, e),
+                level=WARNING)
+        super(CompactStorage, self)._init()
+
+    def _write(self, items):
+        """Write (key, serialized) pairs which differ from the stored ones."""
+        if self.revision:
+            self.cursor.executemany(REVISION_UPSERT, [
+                (key, self.revision, data, key, data)
+                for key, data in items])
+        self.cursor.executemany(KV_UPSERT, [
+            (key, data, key, data) for key, data in items])
+
+    def set(self, key, value):
+        self._write([(key, json.dumps(value))])
+        return value
+
+    def update(self, mapping, prefix=""):
+        self._write([('%s%s' % (prefix, key), json.dumps(value))
+                     for key, value in mapping.items()])
+
+    def start_run(self):
+        """Record that a hook or action run starts here.
+
+        A run opens a hook scope, and so adds a row to the hooks table, for
+        each HookData context it enters, so runs are told apart by the
+        first version they can have been given.
+        """
+        self.cursor.execute('select max(version) from hooks')
+        newest = self.cursor.fetchone()[0] or 0
+        runs = self.get(RUNS_KEY) or []
+        runs.append(newest + 1)
+        self.set(RUNS_KEY, runs)
+        self.flush()
+
+    def prune(self, keep_runs):
+        """Drop the revisions and hooks from before the last keep_runs runs.
+
+        Returns the number of revisions dropped.
+        """
+        runs = self.get(RUNS_KEY) or []
+        if not keep_runs or len(runs) <= keep_runs:
+            return 0
+        oldest = runs[-keep_runs]
+        self.cursor.execute('delete from kv_revisions where revision < ?',
+                            [oldest])
+        pruned = self.cursor.rowcount
+        self.cursor.execute('delete from hooks where version < ?', [oldest])
+        self.set(RUNS_KEY, runs[-keep_runs:])
+        self.flush()
+        return pruned
+
+    def needs_vacuum(self):
+        self.cursor.execute('pragma page_count')
+        pages = self.cursor.fetchone()[0]
+        self.cursor.execute('pragma freelist_count')
+        free = self.cursor.fetchone()[0]
+        return bool(pages) and free >= pages * VACUUM_FREE_RATIO
+
+    def vacuum_in_background(self):
+        """Vacuum the database from a detached process.
+
+        The hook does not wait for it, and sqlite's locking keeps it from
+        interfering with later hooks, which wait for it if they need to.
+        """
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen([sys.executable, '-c', VACUUM_SCRIPT,
+                              self.db_path],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid)
+
+
+def prune_unit_state():
+    """Apply unit-state-retention to the unit's state database."""
+    db = unitdata.kv()
+    keep_runs = config('unit-state-retention')
+    if not isinstance(db, CompactStorage):
+        return
+    if not keep_runs:
+        # Runs are not recorded while retention is disabled, so forget the
+        # ones from before rather than prune by them once it is enabled.
+        if db.get(RUNS_KEY) is not None:
+            db.unset(RUNS_KEY)
+            db.flush()
+        return
+    pruned = db.prune(keep_runs)
+    if pruned:
+        log('Pruned %d revisions from the unit state' % pruned,
+            level=DEBUG)
+
+
+def vacuum_unit_state():
+    """Vacuum the unit's state database if enough of it is free.
+
+    The vacuum locks the database, so this must be the last thing a hook
+    does with it.
+    """
+    db = unitdata.kv()
+    if isinstance(db, CompactStorage) and db.needs_vacuum():
+        db.flush()
+        db.vacuum_in_background()
+
+
+def install():
+    """Make unitdata.kv() a CompactStorage, pruned when the hook exits.
+
+    The run is recorded for unit-state-retention the first time this is
+    called by a process, unless retention is disabled.
+    """
+    if not isinstance(unitdata._KV, CompactStorage):
+        if unitdata._KV is not None:
+            unitdata._KV.flush()
+            unitdata._KV.close()
+        unitdata._KV = CompactStorage()
+        if config('unit-state-retention'):
+            unitdata._KV.start_run()
+    hookenv.atexit(prune_unit_state)
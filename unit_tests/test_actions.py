@@ -23,20 +23,14 @@ import yaml
 
 from test_utils import CharmTestCase
 
-from mock import patch, MagicMock
+from mock import MagicMock
 
 # python-apt is not installed as part of test-requirements but is imported by
 # some charmhelpers modules so create a fake import.
 sys.modules['apt'] = MagicMock()
 sys.modules['apt_pkg'] = MagicMock()
 
-with patch('actions.hooks.charmhelpers.contrib.hardening.harden.harden') as \
-        mock_dec:
-    mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
-                            lambda *args, **kwargs: f(*args, **kwargs))
-    with patch('actions.hooks.lib.misc_utils.is_paused') as is_paused:
-        with patch('actions.hooks.lib.swift_storage_utils.register_configs'):
-            import actions.actions
+import actions.actions
 
 
 class PauseTestCase(CharmTestCase):
@@ -44,7 +38,7 @@ class PauseTestCase(CharmTestCase):
     def setUp(self):
         super(PauseTestCase, self).setUp(
             actions.actions, ["service_pause", "HookData", "kv",
-                              "set_os_workload_status"])
+                              "set_workload_status"])
 
         class FakeArgs(object):
             services = ['swift-account',
@@ -115,12 +109,28 @@ class PauseTestCase(CharmTestCase):
         self.kv().set.assert_called_with('unit-paused', True)
 
 
+class GetServicesTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(GetServicesTestCase, self).setUp(
+            actions.actions, ["config", "get_swift_services"])
+        self.config.side_effect = self.test_config.get
+        self.get_swift_services.return_value = ['swift-object']
+
+    def test_get_services(self):
+        """The exporter is only (un)paused when it is enabled."""
+        self.assertEqual(actions.actions._get_services(), ['swift-object'])
+        self.test_config.set('prometheus-exporter', True)
+        self.assertEqual(actions.actions._get_services(),
+                         ['swift-object', 'swift-storage-exporter'])
+
+
 class ResumeTestCase(CharmTestCase):
 
     def setUp(self):
         super(ResumeTestCase, self).setUp(
             actions.actions, ["service_resume", "HookData", "kv",
-                              "set_os_workload_status"])
+                              "set_workload_status"])
 
         class FakeArgs(object):
             services = ['swift-account',
@@ -190,6 +200,61 @@ class ResumeTestCase(CharmTestCase):
         self.kv().set.assert_called_with('unit-paused', False)
 
 
+class ShowTuningTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(ShowTuningTestCase, self).setUp(
+            actions.actions, ["action_set", "config", "get_node_profile",
+                              "get_recommendations", "is_explicit"])
+        self.config.side_effect = self.test_config.get
+
+    def test_show_tuning(self):
+        """show-tuning reports the profile and each recommendation."""
+        self.test_config.set('auto-tune', True)
+        self.get_node_profile.return_value = {'cpus': 8, 'numa-nodes': 2,
+                                              'devices': ['sdb', 'sdc']}
+        self.get_recommendations.return_value = {
+            'object-workers': (8, 'max(cpus=8, disks=2)')}
+        self.is_explicit.return_value = False
+        actions.actions.show_tuning(None)
+        self.get_recommendations.assert_called_with(
+            self.get_node_profile.return_value)
+        self.action_set.assert_called_with({
+            'profile.cpus': 8,
+            'profile.numa-nodes': 2,
+            'profile.devices': 'sdb sdc',
+            'tuning.object-workers.recommended': 8,
+            'tuning.object-workers.derivation': 'max(cpus=8, disks=2)',
+            'tuning.object-workers.configured': None,
+            'tuning.object-workers.applied': True})
+
+
+class HookProfileTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(HookProfileTestCase, self).setUp(
+            actions.actions, ["action_fail", "action_get", "action_set",
+                              "get_profile_report", "kv"])
+        self.action_get.side_effect = {'hooks': 5, 'top': 10}.get
+
+    def test_hook_profile(self):
+        """hook-profile reports on the recorded history."""
+        self.kv().get.return_value = ['profile']
+        self.get_profile_report.return_value = {'hooks.1': 'install'}
+        actions.actions.hook_profile(None)
+        self.kv().get.assert_called_with('hook-profile')
+        self.get_profile_report.assert_called_with(['profile'], hooks=5,
+                                                   top=10)
+        self.action_set.assert_called_with({'hooks.1': 'install'})
+
+    def test_hook_profile_no_history(self):
+        """hook-profile fails when no hooks have been profiled."""
+        self.kv().get.return_value = None
+        actions.actions.hook_profile(None)
+        self.assertTrue(self.action_fail.called)
+        self.assertFalse(self.action_set.called)
+
+
 class GetActionParserTestCase(unittest.TestCase):
 
     def test_definition_from_yaml(self):
@@ -209,7 +274,8 @@ class MainTestCase(CharmTestCase):
         super(MainTestCase, self).setUp(
             actions.actions, ["_get_action_name",
                               "get_action_parser",
-                              "action_fail"])
+                              "action_fail",
+                              "install_unit_state"])
 
     def test_invokes_pause(self):
         dummy_calls = []
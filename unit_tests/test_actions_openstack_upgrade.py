@@ -24,7 +24,7 @@ os.environ['JUJU_UNIT_NAME'] = 'swift-storge'
 sys.modules['apt'] = MagicMock()
 sys.modules['apt_pkg'] = MagicMock()
 
-with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
+with patch('lib.misc_utils.harden') as mock_dec:
     mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
                             lambda *args, **kwargs: f(*args, **kwargs))
     with patch('lib.misc_utils.is_paused') as is_paused:
@@ -38,8 +38,42 @@ from test_utils import (
 TO_PATCH = [
     'config_changed',
     'do_openstack_upgrade',
+    'mark_dirty',
 ]
 
+hooks = sys.modules['swift_storage_hooks']
+config_delta = sys.modules[hooks.mark_dirty.__module__]
+
+# Every step of config-changed in hooks, see test_upgrade_writes_configs.
+HOOK_STEPS = [
+    'ensure_swift_directories',
+    'setup_rsync',
+    'setup_storage',
+    'setup_background_profiles',
+    'setup_background_controller',
+    'setup_sysctl',
+    'setup_service_isolation',
+    'setup_exporter',
+    'save_script_rc',
+    'update_nrpe_config',
+]
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def flush(self):
+        pass
+
+
+class UnchangedConfig(dict):
+    """A config in which no option changed since the last hook."""
+
+    def changed(self, option):
+        return False
+
 
 class TestSwiftStorageUpgradeActions(CharmTestCase):
 
@@ -63,6 +97,8 @@ class TestSwiftStorageUpgradeActions(CharmTestCase):
 
         self.assertTrue(self.do_openstack_upgrade.called)
         self.assertTrue(self.config_changed.called)
+        self.mark_dirty.assert_called_with(
+            *[name for name, _ in hooks.CONFIG_STEPS])
 
     @patch('actions.charmhelpers.contrib.openstack.utils.config')
     @patch('actions.charmhelpers.contrib.openstack.utils.action_set')
@@ -80,3 +116,36 @@ class TestSwiftStorageUpgradeActions(CharmTestCase):
 
         self.assertFalse(self.do_openstack_upgrade.called)
         self.assertFalse(self.config_changed.called)
+        self.assertFalse(self.mark_dirty.called)
+
+
+class TestSwiftStorageUpgradeConfigChanged(CharmTestCase):
+
+    def setUp(self):
+        super(TestSwiftStorageUpgradeConfigChanged, self).setUp(
+            hooks, HOOK_STEPS + ['CONFIGS', 'config', 'relation_ids',
+                                 'relations_of_type', 'status_set'])
+        cfg = UnchangedConfig(self.test_config.config)
+        cfg['action-managed-upgrade'] = True
+        self.config.side_effect = lambda scope=None: \
+            cfg if scope is None else cfg.get(scope)
+        self.relation_ids.return_value = ['swift-storage:0']
+        self.relations_of_type.return_value = True
+        for target, attr, value in [
+                (config_delta, 'kv', lambda db=FakeKV(): db),
+                (hooks, 'swift_storage_relation_joined', MagicMock()),
+                (sys.modules[hooks.pause_aware_restart_on_change.__module__],
+                 'is_paused', lambda: True),
+                (openstack_upgrade, 'do_action_openstack_upgrade',
+                 lambda *args: True)]:
+            patcher = patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_upgrade_writes_configs(self):
+        openstack_upgrade.openstack_upgrade()
+        self.CONFIGS.write_all.assert_called_with()
+        hooks.swift_storage_relation_joined.assert_called_with(
+            rid='swift-storage:0')
+        for step in HOOK_STEPS:
+            self.assertTrue(getattr(self, step).called, step)
@@ -0,0 +1,358 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+BACKGROUND_DIR = os.path.join(os.path.dirname(__file__), '..', 'files',
+                              'background')
+sys.path.insert(0, BACKGROUND_DIR)
+
+import swift_background  # noqa: E402
+
+background_profile = imp.load_source(
+    'swift_background_profile',
+    os.path.join(BACKGROUND_DIR, 'swift-background-profile'))
+controller = imp.load_source(
+    'swift_background_controller',
+    os.path.join(BACKGROUND_DIR, 'swift-background-controller'))
+
+OBJECT_SERVER_CONF = """[DEFAULT]
+bind_port = 6000
+workers = 4
+
+[object-replicator]
+# Tuned by the charm
+concurrency = 1
+
+[object-updater]
+concurrency = 2
+; leave this comment
+slowdown = 0.01
+
+[object-auditor]
+files_per_second = 20
+"""
+
+
+def local_time(hour, minute):
+    return time.mktime((2016, 6, 1, hour, minute, 0, 0, 0, -1))
+
+
+class UpdateSectionsTests(unittest.TestCase):
+
+    def update(self, sections, conf=OBJECT_SERVER_CONF):
+        lines, changed = swift_background.update_sections(
+            conf.splitlines(True), sections)
+        return ''.join(lines), changed
+
+    def test_only_targeted_sections_change(self):
+        conf, changed = self.update({
+            'object-updater': {'concurrency': 8, 'node_timeout': 20},
+            'object-auditor': {'files_per_second': None},
+        })
+        self.assertEqual(changed, set(['object-updater', 'object-auditor']))
+        self.assertEqual(conf, OBJECT_SERVER_CONF.replace(
+            'concurrency = 2\n', 'concurrency = 8\n').replace(
+            'slowdown = 0.01\n', 'slowdown = 0.01\nnode_timeout = 20\n')
+            .replace('files_per_second = 20\n', ''))
+
+    def test_unrelated_keys_and_comments_kept(self):
+        conf, changed = self.update({'object-replicator': {
+            'concurrency': 4}})
+        self.assertEqual(changed, set(['object-replicator']))
+        self.assertIn('# Tuned by the charm\nconcurrency = 4\n', conf)
+        self.assertIn('; leave this comment\n', conf)
+        self.assertIn('[DEFAULT]\nbind_port = 6000\nworkers = 4\n', conf)
+
+    def test_unchanged(self):
+        conf, changed = self.update({'object-updater': {
+            'concurrency': 2, 'interval': None}})
+        self.assertEqual(changed, set())
+        self.assertEqual(conf, OBJECT_SERVER_CONF)
+
+    def test_missing_section(self):
+        conf, changed = self.update({
+            'object-reconstructor': {'concurrency': 2, 'interval': None},
+            'object-expirer': {'interval': None},
+        })
+        self.assertEqual(changed, set(['object-reconstructor']))
+        self.assertEqual(conf, '%s\n[object-reconstructor]\n'
+                         'concurrency = 2\n' % OBJECT_SERVER_CONF)
+
+    def test_write_settings(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'object-server.conf')
+        with open(path, 'w') as f:
+            f.write(OBJECT_SERVER_CONF)
+        os.chmod(path, 0o640)
+        self.assertEqual(swift_background.write_settings(
+            path, {'object-updater': {'concurrency': 2}}), set())
+        self.assertEqual(swift_background.write_settings(
+            path, {'object-updater': {'concurrency': 3}}),
+            set(['object-updater']))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         [swift_background.LOCK_NAME, 'object-server.conf'])
+        self.assertEqual(swift_background.read_setting(
+            path, 'object-updater', 'concurrency'), '3')
+        self.assertEqual(swift_background.read_setting(
+            path, 'object-updater', 'interval'), None)
+
+    @patch('fcntl.flock')
+    def test_write_settings_locked(self, flock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'object-server.conf')
+        with open(path, 'w') as f:
+            f.write(OBJECT_SERVER_CONF)
+        swift_background.write_settings(
+            path, {'object-updater': {'concurrency': 3}})
+        lock_file = flock.call_args[0][0]
+        self.assertEqual(lock_file.name,
+                         os.path.join(tmpdir, swift_background.LOCK_NAME))
+        self.assertEqual(flock.call_args[0][1], fcntl.LOCK_EX)
+        flock.reset_mock()
+        swift_background.write_settings(
+            path, {'object-updater': {'concurrency': 4}}, lock=False)
+        self.assertFalse(flock.called)
+
+    @patch('os.rename')
+    def test_write_settings_failure_cleans_up(self, rename):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'object-server.conf')
+        with open(path, 'w') as f:
+            f.write(OBJECT_SERVER_CONF)
+        rename.side_effect = OSError(2, 'No such file or directory')
+        self.assertRaises(OSError, swift_background.write_settings,
+                          path, {'object-updater': {'concurrency': 3}})
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         [swift_background.LOCK_NAME, 'object-server.conf'])
+
+
+class ReloadDaemonTests(unittest.TestCase):
+
+    @patch('subprocess.call')
+    @patch('os.path.isdir')
+    def test_reload_systemd(self, isdir, call):
+        isdir.return_value = True
+        call.return_value = 0
+        self.assertTrue(swift_background.reload_daemon('object-replicator'))
+        self.assertEqual([c[0][0] for c in call.call_args_list], [
+            ['systemctl', 'is-active', '--quiet', 'swift-object-replicator'],
+            ['systemctl', 'reload-or-restart', 'swift-object-replicator']])
+        isdir.assert_called_with(swift_background.SYSTEMD_SYSTEM)
+
+    @patch('subprocess.call')
+    @patch('os.path.isdir')
+    def test_reload_upstart(self, isdir, call):
+        isdir.return_value = False
+        call.return_value = 0
+        self.assertTrue(swift_background.reload_daemon('object-auditor'))
+        self.assertEqual([c[0][0] for c in call.call_args_list], [
+            ['swift-init', 'object-auditor', 'status'],
+            ['swift-init', 'object-auditor', 'reload']])
+
+    @patch('subprocess.call')
+    @patch('os.path.isdir')
+    def test_stopped_daemon_left(self, isdir, call):
+        isdir.return_value = True
+        call.return_value = 3
+        self.assertFalse(swift_background.reload_daemon('object-updater'))
+        self.assertEqual(call.call_count, 1)
+
+
+class ActiveProfileTests(unittest.TestCase):
+
+    SCHEDULE = [(7 * 60, 'day'), (22 * 60 + 30, 'night')]
+
+    def test_active_profile(self):
+        active = background_profile.active_profile
+        self.assertEqual(active(self.SCHEDULE, local_time(7, 0)), 'day')
+        self.assertEqual(active(self.SCHEDULE, local_time(22, 29)), 'day')
+        self.assertEqual(active(self.SCHEDULE, local_time(22, 30)), 'night')
+        self.assertEqual(active([], local_time(12, 0)), None)
+
+    def test_active_profile_wraps_past_midnight(self):
+        active = background_profile.active_profile
+        self.assertEqual(active(self.SCHEDULE, local_time(23, 59)), 'night')
+        self.assertEqual(active(self.SCHEDULE, local_time(0, 0)), 'night')
+        self.assertEqual(active(self.SCHEDULE, local_time(6, 59)), 'night')
+        self.assertEqual(active([(8 * 60, 'day')], local_time(1, 0)), 'day')
+
+
+CONTROLLER_CONFIG = {
+    'devices': ['sdb'],
+    'async_pending_threshold': 1000,
+    'updater_concurrency_max': 4,
+    'throttled_concurrency_min': 2,
+    'disk_util_target': 80,
+    'disk_await_target': 50,
+}
+
+
+def diskstats_line(device, ticks, ios, io_ms):
+    # reads and writes are split evenly, as are their times
+    return '   8  16 %s %d 0 0 %d %d 0 0 %d 0 %d %d\n' % (
+        device, ios // 2, io_ms // 2, ios - ios // 2, io_ms - io_ms // 2,
+        ticks, io_ms)
+
+
+class ControllerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.object_conf = self.write('object-server.conf',
+                                      '[object-replicator]\nconcurrency = 4\n'
+                                      '\n[object-auditor]\n'
+                                      '\n[object-updater]\nconcurrency = 2\n')
+        self.recon = os.path.join(self.tmpdir, 'object.recon')
+        self.diskstats = os.path.join(self.tmpdir, 'diskstats')
+        for attr, value in [
+                ('OBJECT_CONF', self.object_conf),
+                ('OBJECT_RECON', self.recon),
+                ('DISKSTATS', self.diskstats),
+                ('THROTTLED', [(self.object_conf, 'object-replicator'),
+                               (self.object_conf, 'object-auditor')])]:
+            patcher = patch.object(controller, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for attr in ['reload_daemon', 'syslog']:
+            patcher = patch.object(controller, attr)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.state = {}
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def concurrency(self, section):
+        return swift_background.read_setting(self.object_conf, section,
+                                             'concurrency')
+
+    def step(self, backlog, ticks=0, ios=0, io_ms=0, now=60):
+        self.write('object.recon', '{"async_pending": %d}' % backlog)
+        self.write('diskstats', ''.join([
+            diskstats_line('sdb', ticks, ios, io_ms),
+            diskstats_line('sda', 60000, 100, 100)]))
+        controller.control(CONTROLLER_CONFIG, self.state, now)
+
+    def test_read_async_pending(self):
+        self.assertEqual(controller.read_async_pending(), None)
+        self.write('object.recon', '{"async_pending": 12}')
+        self.assertEqual(controller.read_async_pending(), 12)
+        self.write('object.recon', '{"async_pending": null}')
+        self.assertEqual(controller.read_async_pending(), None)
+        self.write('object.recon', 'not json')
+        self.assertEqual(controller.read_async_pending(), None)
+
+    def test_disk_load(self):
+        previous = {'sdb': (1000, 100, 500), 'sdc': (0, 0, 0)}
+        current = {'sdb': (1900, 200, 2500), 'sdc': (100, 0, 0),
+                   'sdd': (1000, 10, 1000)}
+        self.assertEqual(controller.disk_load(previous, current, 1),
+                         (90.0, 20.0))
+        self.assertEqual(controller.disk_load(previous, current, 0),
+                         (0.0, 0.0))
+        self.assertEqual(controller.disk_load({}, current, 1), (0.0, 0.0))
+
+    def test_read_diskstats(self):
+        self.write('diskstats', ''.join([
+            diskstats_line('sdb', 1500, 11, 300), '   8  0 sda 1 2 3\n']))
+        self.assertEqual(controller.read_diskstats(['sdb', 'sda']),
+                         {'sdb': (1500, 11, 300)})
+
+    def test_current_value_and_adjust(self):
+        section = 'object-replicator'
+        self.assertEqual(controller.current_value(
+            self.state, self.object_conf, section), (4, 4))
+        self.assertTrue(controller.adjust(self.state, self.object_conf,
+                                          section, 3, 'test'))
+        self.assertFalse(controller.adjust(self.state, self.object_conf,
+                                           section, 3, 'test'))
+        self.assertEqual(self.concurrency(section), '3')
+        self.assertEqual(controller.current_value(
+            self.state, self.object_conf, section), (3, 4))
+        controller.reload_daemon.assert_called_once_with(section)
+        # A profile applied since current_value() is not overwritten.
+        swift_background.write_settings(
+            self.object_conf, {section: {'concurrency': 5}})
+        self.assertFalse(controller.adjust(self.state, self.object_conf,
+                                           section, 2, 'test'))
+        self.assertEqual(self.concurrency(section), '5')
+        self.assertEqual(controller.current_value(
+            self.state, self.object_conf, section), (5, 5))
+        # A hook rendering a new value makes it the baseline.
+        swift_background.write_settings(
+            self.object_conf, {section: {'concurrency': 6}})
+        self.assertEqual(controller.current_value(
+            self.state, self.object_conf, section), (6, 6))
+        # Settings which are not rendered use swift's default.
+        self.assertEqual(controller.current_value(
+            self.state, self.object_conf, 'object-auditor'), (1, 1))
+
+    def test_backlog_growing_and_draining(self):
+        self.step(2000)
+        self.assertEqual(self.concurrency('object-updater'), '3')
+        self.step(2500)
+        self.step(3000)
+        self.step(3500)
+        # Capped at updater_concurrency_max
+        self.assertEqual(self.concurrency('object-updater'), '4')
+        # Draining, but still above the threshold: left alone
+        self.step(1500)
+        self.assertEqual(self.concurrency('object-updater'), '4')
+        self.step(400)
+        self.step(300)
+        self.step(200)
+        # Back to, and not below, the configured value
+        self.assertEqual(self.concurrency('object-updater'), '2')
+
+    def test_busy_and_idle_disks(self):
+        self.step(0, now=0)
+        # 90% utilisation over the minute
+        self.step(0, ticks=54000, ios=600, io_ms=600, now=60)
+        self.assertEqual(self.concurrency('object-replicator'), '3')
+        self.step(0, ticks=108000, ios=1200, io_ms=1200, now=120)
+        self.step(0, ticks=162000, ios=1800, io_ms=1800, now=180)
+        # Not below throttled_concurrency_min, and unset settings at
+        # swift's default of 1 are not lowered either.
+        self.assertEqual(self.concurrency('object-replicator'), '2')
+        self.assertEqual(self.concurrency('object-auditor'), None)
+        # Idle: drifts back up to the baseline one step per run
+        self.step(0, ticks=163000, ios=1810, io_ms=1810, now=240)
+        self.assertEqual(self.concurrency('object-replicator'), '3')
+        self.step(0, ticks=164000, ios=1820, io_ms=1820, now=300)
+        self.step(0, ticks=165000, ios=1830, io_ms=1830, now=360)
+        self.assertEqual(self.concurrency('object-replicator'), '4')
+
+    def test_busy_by_await(self):
+        self.step(0, now=0)
+        # 2% utilisation but 200ms average await
+        self.step(0, ticks=1200, ios=10, io_ms=2000, now=60)
+        self.assertEqual(self.concurrency('object-replicator'), '3')
@@ -0,0 +1,120 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import imp
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+check = imp.load_source(
+    'check_swift_services',
+    os.path.join(os.path.dirname(__file__), '..', 'files',
+                 'nrpe-external-master', 'check_swift_services.py'))
+
+
+def argv(server):
+    return ['/usr/bin/python', '/usr/bin/swift-%s' % server,
+            '/etc/swift/%s.conf' % server.split('-')[0], '']
+
+
+class CheckSwiftServicesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, path, content):
+        path = os.path.join(self.tmpdir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def add_process(self, pid, ppid, args, comm='python'):
+        self.write('proc/%d/cmdline' % pid, '\0'.join(args))
+        self.write('proc/%d/stat' % pid,
+                   '%d (%s) S %d %d 0 0\n' % (pid, comm, ppid, pid))
+
+    def test_server_name(self):
+        self.assertEqual(check.server_name('swift-object'), 'object-server')
+        self.assertEqual(check.server_name('swift-object-replicator'),
+                         'object-replicator')
+
+    def test_read_processes(self):
+        self.add_process(100, 1, argv('object-server'))
+        self.add_process(101, 100, argv('object-server'),
+                         comm='swift (object) server')
+        self.add_process(7, 1, ['/usr/sbin/sshd', '-D', ''])
+        # Exited between reading its cmdline and its stat.
+        self.write('proc/8/cmdline', '\0'.join(argv('object-auditor')))
+        self.write('proc/self/cmdline', '\0'.join(argv('object-server')))
+        self.assertEqual(check.read_processes(
+            os.path.join(self.tmpdir, 'proc')), {
+                100: (1, argv('object-server')),
+                101: (100, argv('object-server'))})
+
+    def test_read_pidfiles(self):
+        self.write('run/object-server.pid', '100\n')
+        self.write('run/account-server/1.pid', '400\n')
+        self.write('run/account-server/2.pid', '499\n')
+        self.write('run/object-auditor.pid', 'garbage\n')
+        pids = check.read_pidfiles(os.path.join(self.tmpdir, 'run'))
+        pids['account-server'].sort()
+        self.assertEqual(pids, {'object-server': [100],
+                                'account-server': [400, 499]})
+
+    def test_service_states(self):
+        processes = {
+            # Parent from its pid file, with two workers.
+            100: (1, argv('object-server')),
+            101: (100, argv('object-server')),
+            102: (100, argv('object-server')),
+            # No pid file: the parent is the member whose parent is not.
+            300: (1, argv('container-server')),
+            301: (300, argv('container-server')),
+            # One of two pid files is stale.
+            400: (1, argv('account-server')),
+            401: (400, argv('account-server')),
+            # Pid file of an exited process, restarted without one.
+            600: (1, argv('object-updater')),
+        }
+        pidfiles = {'object-server': [100], 'object-replicator': [200],
+                    'account-server': [400, 499], 'object-updater': [500]}
+        states = check.service_states(
+            ['swift-object', 'swift-container', 'swift-object-replicator',
+             'swift-account', 'swift-object-updater'], processes, pidfiles)
+        self.assertEqual(states, [
+            ('swift-object', check.STATUS_OK, 'running, 2 workers', 2),
+            ('swift-container', check.STATUS_OK, 'running, 1 workers', 1),
+            ('swift-object-replicator', check.STATUS_CRIT, 'not running', 0),
+            ('swift-account', check.STATUS_WARN,
+             'stale pid file, 1 workers', 1),
+            ('swift-object-updater', check.STATUS_OK, 'running, 0 workers',
+             0),
+        ])
+
+    @patch('subprocess.Popen')
+    def test_send_passive(self, popen):
+        states = [('swift-object', check.STATUS_OK, 'running, 2 workers', 2),
+                  ('swift-account', check.STATUS_CRIT, 'not running', 0)]
+        check.send_passive(['send_nsca', '-H', 'nagios'], 'juju-storage-0',
+                           states)
+        popen.assert_called_with(['send_nsca', '-H', 'nagios'],
+                                 stdin=check.subprocess.PIPE)
+        popen.return_value.communicate.assert_called_with(
+            'juju-storage-0\tswift-object\t0\trunning, 2 workers\n'
+            'juju-storage-0\tswift-account\t2\tnot running\n')
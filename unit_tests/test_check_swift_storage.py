@@ -0,0 +1,259 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import imp
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import MagicMock, patch
+
+check = imp.load_source(
+    'check_swift_storage',
+    os.path.join(os.path.dirname(__file__), '..', 'files',
+                 'nrpe-external-master', 'check_swift_storage.py'))
+
+NOW = datetime.datetime(2016, 10, 1, 12, 0, 0)
+
+
+def timestamp(seconds_ago):
+    then = NOW - datetime.timedelta(seconds=seconds_ago)
+    return time.mktime(then.timetuple())
+
+
+class FixedDateTime(datetime.datetime):
+
+    @classmethod
+    def now(cls):
+        return NOW
+
+
+class CachedMD5Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.ring = os.path.join(self.tmpdir, 'object.ring.gz')
+        self.cache = os.path.join(self.tmpdir, 'ringmd5.json')
+        self.write(self.ring, 'ring')
+        patcher = patch.object(check, 'generate_md5',
+                               side_effect=check.generate_md5)
+        self.generate_md5 = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def digests(self):
+        return check.cached_md5([self.ring], self.cache)
+
+    def test_cache_hit(self):
+        digest = self.digests()[self.ring]
+        self.assertEqual(digest, check.generate_md5(self.ring))
+        with open(self.cache) as f:
+            self.assertEqual(json.load(f)[self.ring][1], digest)
+        self.generate_md5.reset_mock()
+        self.assertEqual(self.digests(), {self.ring: digest})
+        self.assertFalse(self.generate_md5.called)
+
+    def test_rehash_on_size_change(self):
+        self.digests()
+        st = os.stat(self.ring)
+        self.write(self.ring, 'new ring')
+        os.utime(self.ring, (st.st_atime, st.st_mtime))
+        self.assertEqual(self.digests()[self.ring],
+                         check.generate_md5(self.ring))
+        self.assertEqual(self.generate_md5.call_count, 3)
+
+    def test_rehash_on_mtime_change(self):
+        self.digests()
+        st = os.stat(self.ring)
+        os.utime(self.ring, (st.st_atime, st.st_mtime + 10))
+        self.digests()
+        self.assertEqual(self.generate_md5.call_count, 2)
+
+    def test_rehash_on_inode_change(self):
+        self.digests()
+        st = os.stat(self.ring)
+        new = self.ring + '.new'
+        self.write(new, 'gnir')
+        os.utime(new, (st.st_atime, st.st_mtime))
+        os.rename(new, self.ring)
+        self.assertNotEqual(os.stat(self.ring).st_ino, st.st_ino)
+        self.assertEqual(self.digests()[self.ring],
+                         check.generate_md5(self.ring))
+        self.assertEqual(self.generate_md5.call_count, 3)
+
+    def test_unreadable_ring_left_out(self):
+        os.remove(self.ring)
+        self.assertEqual(self.digests(), {})
+
+
+class FetchReconTests(unittest.TestCase):
+
+    def setUp(self):
+        self.hang = threading.Event()
+        self.addCleanup(self.hang.set)
+
+    def fake_urlopen(self, url, timeout=None):
+        if url.endswith('/load'):
+            self.hang.wait()
+        response = MagicMock()
+        response.read.return_value = json.dumps({'url': url})
+        return response
+
+    @patch.object(check.urllib2, 'urlopen')
+    def test_hung_endpoint_times_out(self, urlopen):
+        urlopen.side_effect = self.fake_urlopen
+        start = time.time()
+        responses = check.fetch_recon('http://localhost:6000/recon/',
+                                      ['async', 'load', 'unmounted'], 0.2)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(responses['async'],
+                         {'url': 'http://localhost:6000/recon/async'})
+        self.assertEqual(responses['unmounted'],
+                         {'url': 'http://localhost:6000/recon/unmounted'})
+        self.assertEqual(responses['load'],
+                         (check.STATUS_UNKNOWN, 'Timed out querying load'))
+        for call_args in urlopen.call_args_list:
+            self.assertEqual(call_args[1]['timeout'], 0.2)
+
+    @patch.object(check.urllib2, 'urlopen')
+    def test_errors(self, urlopen):
+        def urlopen_error(url, timeout=None):
+            if url.endswith('/async'):
+                raise check.urllib2.URLError('refused')
+            response = MagicMock()
+            response.read.return_value = 'not json'
+            return response
+        urlopen.side_effect = urlopen_error
+        responses = check.fetch_recon('http://localhost:6000/recon/',
+                                      ['async', 'load'], 1)
+        self.assertEqual(responses['async'][0], check.STATUS_UNKNOWN)
+        self.assertTrue(responses['async'][1].startswith("Can't open url"))
+        self.assertEqual(responses['load'][0], check.STATUS_UNKNOWN)
+        self.assertTrue(responses['load'][1].startswith("Can't parse"))
+
+
+class CheckThresholdTests(unittest.TestCase):
+
+    def test_below_warn(self):
+        results = []
+        perf = check.check_threshold(results, 'async_pending', 5, [10, 20],
+                                     '{} async pendings')
+        self.assertEqual(results, [])
+        self.assertEqual(perf, 'async_pending=5;10;20')
+
+    def test_warn(self):
+        results = []
+        check.check_threshold(results, 'async_pending', 10, [10, 20],
+                              '{} async pendings')
+        self.assertEqual(results, [(check.STATUS_WARN, '10 async pendings')])
+
+    def test_crit(self):
+        results = []
+        perf = check.check_threshold(results, 'sdb_used', 95, [80.0, 90.0],
+                                     'device sdb is {}% full', '%')
+        self.assertEqual(results,
+                         [(check.STATUS_CRIT, 'device sdb is 95% full')])
+        self.assertEqual(perf, 'sdb_used=95%;80;90')
+
+
+class CheckLoadTests(unittest.TestCase):
+
+    def test_load(self):
+        results, perf = check.check_load(
+            {'load': {'1m': 9.0, '5m': 2.5, '15m': 1.0}}, [4, 8])
+        self.assertEqual(results, [])
+        self.assertEqual(perf, ['load5=2.5;4;8'])
+
+    def test_load_crit(self):
+        results, _ = check.check_load({'load': {'5m': 8.5}}, [4, 8])
+        self.assertEqual(results, [
+            (check.STATUS_CRIT, '5 minute load average is 8.5')])
+
+    def test_load_missing(self):
+        results, perf = check.check_load({'load': {'1m': 1.0}}, [4, 8])
+        self.assertEqual([status for status, _ in results],
+                         [check.STATUS_UNKNOWN])
+        self.assertEqual(perf, [])
+
+    def test_load_unavailable(self):
+        error = (check.STATUS_UNKNOWN, "Can't open url")
+        self.assertEqual(check.check_load({'load': error}, [4, 8]),
+                         ([error], []))
+
+
+@patch.object(check.datetime, 'datetime', FixedDateTime)
+class CheckReplicationTests(unittest.TestCase):
+
+    def recon(self, object_lag, other_lag, failures=0):
+        other = {'replication_last': timestamp(other_lag),
+                 'replication_stats': {'failure': failures}}
+        return {
+            'replication/account': other,
+            'replication/container': other,
+            'replication/object': {
+                'object_replication_last': timestamp(object_lag)},
+        }
+
+    def test_lag_ok(self):
+        results, perf = check.check_replication(self.recon(60, 120),
+                                                [600, 1200, 5, 10])
+        self.assertEqual(results, [])
+        self.assertEqual(perf, [
+            'account_replication_lag=120s;600;1200',
+            'account_replication_failures=0;5;10',
+            'object_replication_lag=60s;600;1200',
+            'container_replication_lag=120s;600;1200',
+            'container_replication_failures=0;5;10',
+        ])
+
+    def test_lag_warn_and_crit(self):
+        results, _ = check.check_replication(self.recon(1500, 700),
+                                             [600, 1200, 5, 10])
+        self.assertEqual(results, [
+            (check.STATUS_WARN, "'account' replication lag is 700 seconds"),
+            (check.STATUS_CRIT, "'object' replication lag is 1500 seconds"),
+            (check.STATUS_WARN,
+             "'container' replication lag is 700 seconds"),
+        ])
+
+    def test_lag_over_a_day(self):
+        results, perf = check.check_replication(self.recon(90000, 60),
+                                                [600, 1200, 5, 10])
+        self.assertEqual(results, [
+            (check.STATUS_CRIT, "'object' replication lag is 90000 seconds")])
+        self.assertIn('object_replication_lag=90000s;600;1200', perf)
+
+    def test_failures(self):
+        results, _ = check.check_replication(self.recon(0, 0, failures=12),
+                                             [600, 1200, 5, 10])
+        self.assertEqual(results, [
+            (check.STATUS_CRIT, '12 replication failures'),
+            (check.STATUS_CRIT, '12 replication failures'),
+        ])
+
+    def test_not_run(self):
+        recon = self.recon(0, 0)
+        recon['replication/object'] = {'object_replication_last': None}
+        results, _ = check.check_replication(recon, [600, 1200, 5, 10])
+        self.assertEqual(results, [
+            (check.STATUS_UNKNOWN, "'object' replication has not run")])
@@ -0,0 +1,86 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test_utils import CharmTestCase
+
+import lib.config_delta as config_delta
+
+TO_PATCH = [
+    'kv',
+    'log',
+]
+
+STEPS = [
+    ('directories', []),
+    ('storage', ['block-device', 'overwrite']),
+    ('templates', None),
+    ('nrpe', ['nagios_context']),
+]
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def flush(self):
+        pass
+
+
+class FakeConfig(dict):
+
+    def __init__(self, current, previous=None):
+        super(FakeConfig, self).__init__(current)
+        self._previous = previous
+
+    def changed(self, key):
+        if self._previous is None:
+            return True
+        return self._previous.get(key) != self.get(key)
+
+
+class ConfigDeltaTests(CharmTestCase):
+
+    def setUp(self):
+        super(ConfigDeltaTests, self).setUp(config_delta, TO_PATCH)
+        self.db = FakeKV()
+        self.kv.return_value = self.db
+
+    def test_get_changed_options(self):
+        cfg = FakeConfig({'zone': 1, 'worker-multiplier': 2},
+                         {'zone': 1, 'worker-multiplier': 1})
+        self.assertEqual(config_delta.get_changed_options(cfg),
+                         set(['worker-multiplier']))
+        self.assertEqual(config_delta.get_changed_options(
+            FakeConfig({'zone': 1})), set(['zone']))
+        self.assertEqual(config_delta.get_changed_options(None), set())
+
+    def test_pending_steps_for_changed_option(self):
+        cfg = FakeConfig({'worker-multiplier': 2, 'block-device': 'sdb'},
+                         {'worker-multiplier': 1, 'block-device': 'sdb'})
+        self.assertEqual(config_delta.get_pending_steps(STEPS, cfg),
+                         ['templates'])
+        self.assertEqual(self.db[config_delta.DIRTY_KEY], ['templates'])
+        config_delta.clear_dirty('templates')
+        self.assertEqual(self.db[config_delta.DIRTY_KEY], [])
+
+    def test_pending_steps_unchanged(self):
+        cfg = FakeConfig({'zone': 1}, {'zone': 1})
+        self.assertEqual(config_delta.get_pending_steps(STEPS, cfg), [])
+
+    def test_pending_steps_dirty(self):
+        config_delta.mark_dirty('directories', 'nrpe')
+        cfg = FakeConfig({'overwrite': True}, {'overwrite': False})
+        self.assertEqual(config_delta.get_pending_steps(STEPS, cfg),
+                         ['directories', 'storage', 'templates', 'nrpe'])
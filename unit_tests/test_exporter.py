@@ -0,0 +1,153 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import imp
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from collections import namedtuple
+from mock import patch
+
+exporter = imp.load_source(
+    'swift_storage_exporter',
+    os.path.join(os.path.dirname(__file__), '..', 'files', 'exporter',
+                 'swift-storage-exporter'))
+
+StatVFS = namedtuple('StatVFS', ['f_blocks', 'f_bfree', 'f_bavail',
+                                 'f_frsize'])
+
+OBJECT_RECON = {
+    'async_pending': 3,
+    'object_replication_time': 1.5,
+    'object_replication_last': 1476000000.0,
+    'replication_stats': {'attempted': 10, 'failure': 1, 'rsync': 'n/a'},
+    'object_auditor_stats_ALL': {
+        'bytes_processed': 100, 'passes': 4, 'quarantined': 0,
+        'errors': 1, 'audit_time': 2.5, 'start_time': 1476000000.0},
+}
+
+NESTED_AUDITOR_STATS = {
+    'sdb,sdc': {'bytes_processed': 100, 'passes': 4, 'quarantined': 1,
+                'errors': 0, 'audit_time': 2.0},
+    'sdd': {'bytes_processed': 50, 'passes': 2, 'quarantined': 0,
+            'errors': 1, 'audit_time': 1.0},
+}
+
+
+class ExporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write_recon(self, server, data):
+        with open(os.path.join(self.tmpdir, '%s.recon' % server), 'w') as f:
+            json.dump(data, f)
+
+    def test_recon_metrics_flat(self):
+        self.write_recon('object', OBJECT_RECON)
+        self.write_recon('account', {'account_audits_failed': 2})
+        lines = exporter.recon_metrics(exporter.ReconCache(self.tmpdir))
+        self.assertIn('swift_object_async_pending 3', lines)
+        self.assertIn('swift_object_replication_time_seconds 90.0', lines)
+        self.assertIn('swift_account_audits_failed 2', lines)
+        self.assertIn('swift_replication_stats{server="object",'
+                      'stat="attempted"} 10', lines)
+        self.assertIn('swift_object_auditor_passes{type="ALL"} 4', lines)
+        self.assertIn('swift_object_auditor_audit_time{type="ALL"} 2.5',
+                      lines)
+        for line in lines:
+            self.assertNotIn('rsync', line)
+            self.assertNotIn('start_time', line)
+            self.assertNotIn('ZBF', line)
+
+    def test_recon_metrics_nested_auditor_stats(self):
+        self.write_recon('object', {
+            'object_auditor_stats_ZBF': NESTED_AUDITOR_STATS})
+        lines = exporter.recon_metrics(exporter.ReconCache(self.tmpdir))
+        self.assertEqual(lines, [
+            'swift_object_auditor_audit_time{type="ZBF"} 3.0',
+            'swift_object_auditor_bytes_processed{type="ZBF"} 150',
+            'swift_object_auditor_errors{type="ZBF"} 1',
+            'swift_object_auditor_passes{type="ZBF"} 6',
+            'swift_object_auditor_quarantined{type="ZBF"} 1',
+        ])
+
+    def test_recon_metrics_missing_or_invalid(self):
+        with open(os.path.join(self.tmpdir, 'object.recon'), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(
+            exporter.recon_metrics(exporter.ReconCache(self.tmpdir)), [])
+
+    def test_recon_cache_reparsed_on_change(self):
+        recon = exporter.ReconCache(self.tmpdir)
+        self.write_recon('object', {'async_pending': 1})
+        self.assertEqual(recon.get('object'), {'async_pending': 1})
+        self.write_recon('object', {'async_pending': 12})
+        self.assertEqual(recon.get('object'), {'async_pending': 12})
+
+    @patch('os.statvfs')
+    @patch('os.path.ismount')
+    def test_device_metrics(self, ismount, statvfs):
+        os.mkdir(os.path.join(self.tmpdir, 'sdb'))
+        os.mkdir(os.path.join(self.tmpdir, 'sdc'))
+        ismount.side_effect = lambda path: path.endswith('sdb')
+        statvfs.return_value = StatVFS(f_blocks=100, f_bfree=40, f_bavail=30,
+                                       f_frsize=4096)
+        self.assertEqual(exporter.device_metrics(self.tmpdir), [
+            'swift_device_mounted{device="sdb"} 1',
+            'swift_device_size_bytes{device="sdb"} 409600',
+            'swift_device_avail_bytes{device="sdb"} 122880',
+            'swift_device_used_bytes{device="sdb"} 245760',
+            'swift_device_mounted{device="sdc"} 0',
+        ])
+        statvfs.assert_called_once_with(os.path.join(self.tmpdir, 'sdb'))
+
+    def test_device_metrics_no_node_dir(self):
+        self.assertEqual(
+            exporter.device_metrics(os.path.join(self.tmpdir, 'missing')), [])
+
+    def test_quarantine_metrics(self):
+        for path in ['sdb/quarantined/objects/a', 'sdb/quarantined/objects/b',
+                     'sdc/quarantined/objects/c',
+                     'sdc/quarantined/accounts/d', 'sdd']:
+            os.makedirs(os.path.join(self.tmpdir, path))
+        self.assertEqual(exporter.quarantine_metrics(self.tmpdir), [
+            'swift_quarantined{type="accounts"} 1',
+            'swift_quarantined{type="containers"} 0',
+            'swift_quarantined{type="objects"} 3',
+        ])
+
+    def test_render_page(self):
+        page = exporter.render_page([
+            'swift_device_mounted{device="sdb"} 1',
+            'swift_device_size_bytes{device="sdb"} 409600',
+            'swift_device_mounted{device="sdc"} 0',
+            'swift_unknown 2',
+        ])
+        self.assertEqual(page.splitlines(), [
+            '# HELP swift_device_mounted Whether the device is mounted '
+            'under /srv/node.',
+            '# TYPE swift_device_mounted gauge',
+            'swift_device_mounted{device="sdb"} 1',
+            'swift_device_mounted{device="sdc"} 0',
+            '# HELP swift_device_size_bytes Size of the device filesystem.',
+            '# TYPE swift_device_size_bytes gauge',
+            'swift_device_size_bytes{device="sdb"} 409600',
+            '# TYPE swift_unknown gauge',
+            'swift_unknown 2',
+        ])
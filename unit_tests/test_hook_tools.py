@@ -0,0 +1,120 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from mock import patch
+from test_utils import CharmTestCase
+
+import lib.hook_tools as hook_tools
+
+TO_PATCH = [
+    'hookenv',
+    'local_unit',
+    'log',
+]
+
+RELATION_DATA = {
+    'swift-proxy/0': {'swift_hash': 'hash', 'timestamp': '1'},
+    'swift-proxy/1': {'swift_hash': 'hash', 'timestamp': '2'},
+}
+
+
+class HookToolsTests(CharmTestCase):
+
+    def setUp(self):
+        super(HookToolsTests, self).setUp(hook_tools, TO_PATCH)
+        self.client = hook_tools.HookTools()
+        self.local_unit.return_value = 'swift-storage/0'
+        self.hookenv.relation_id.return_value = None
+        self.hookenv.remote_unit.return_value = None
+
+    def fake_check_output(self, cmd, **kwargs):
+        if cmd[0] == 'relation-ids':
+            return json.dumps(['swift-storage:0'])
+        if cmd[0] == 'relation-list':
+            return json.dumps(sorted(RELATION_DATA))
+        if cmd[0] == 'relation-get':
+            return json.dumps(RELATION_DATA.get(cmd[4], {}))
+        if cmd[0] == 'relation-set':
+            return 'usage: relation-set [options] key=value [key=value ...]'
+
+    @patch('subprocess.check_output')
+    def test_relation_get_fetches_unit_once(self, check_output):
+        check_output.side_effect = self.fake_check_output
+        client = self.client
+        self.assertEqual(client.relation_get('swift_hash', 'swift-proxy/0',
+                                             'swift-storage:0'), 'hash')
+        self.assertEqual(client.relation_get('timestamp', 'swift-proxy/0',
+                                             'swift-storage:0'), '1')
+        self.assertEqual(client.relation_get(unit='swift-proxy/0',
+                                             rid='swift-storage:0'),
+                         RELATION_DATA['swift-proxy/0'])
+        check_output.assert_called_once_with(
+            ['relation-get', '-r', 'swift-storage:0', '-', 'swift-proxy/0',
+             '--format=json'])
+        self.assertEqual(client.calls['relation-get'], 1)
+        self.assertEqual(client.hits['relation-get'], 2)
+
+    @patch('subprocess.check_output')
+    def test_relations(self, check_output):
+        check_output.side_effect = self.fake_check_output
+        self.assertEqual(self.client.relations('swift-storage'),
+                         {'swift-storage:0': RELATION_DATA})
+        self.client.relations('swift-storage')
+        self.assertEqual(check_output.call_count, 4)
+
+    @patch('subprocess.check_output')
+    def test_relations_local(self, check_output):
+        check_output.side_effect = self.fake_check_output
+        relations = self.client.relations('swift-storage', local=True)
+        self.assertEqual(list(relations['swift-storage:0']),
+                         ['swift-proxy/0', 'swift-proxy/1',
+                          'swift-storage/0'])
+        self.assertEqual(relations['swift-storage:0']['swift-storage/0'], {})
+
+    def test_config_reads_all_once(self):
+        self.hookenv.config.return_value = {'zone': 1, 'overwrite': 'true'}
+        self.assertEqual(self.client.config('zone'), 1)
+        self.assertEqual(self.client.config('overwrite'), 'true')
+        self.assertEqual(self.client.config(),
+                         {'zone': 1, 'overwrite': 'true'})
+        self.hookenv.config.assert_called_once_with()
+
+    @patch('subprocess.check_call')
+    @patch('subprocess.check_output')
+    def test_relation_set_invalidates_local_unit(self, check_output,
+                                                 check_call):
+        check_output.side_effect = self.fake_check_output
+        client = self.client
+        client.relation_get(unit='swift-proxy/0', rid='swift-storage:0')
+        client.relation_get(unit='swift-storage/0', rid='swift-storage:0')
+        client.relation_set(relation_id='swift-storage:0', zone=1)
+        client.relation_set(relation_id='swift-storage:0', zone=2)
+        check_call.assert_called_with(
+            ['relation-set', '-r', 'swift-storage:0', 'zone=2'])
+        # relation-set --help is only run once
+        self.assertEqual(client.calls['relation-set --help'], 1)
+        self.assertIn(('relation-get', 'swift-storage:0', 'swift-proxy/0'),
+                      client.cache)
+        self.assertNotIn(('relation-get', 'swift-storage:0',
+                          'swift-storage/0'), client.cache)
+        self.hookenv.flush.assert_called_with('swift-storage/0')
+
+    def test_invalidate(self):
+        self.client.cache = {('relation-get', 'a:0', 'x/0'): 1,
+                             ('relation-get', 'a:1', 'x/0'): 2,
+                             ('relation-ids', 'a'): 3}
+        self.client.invalidate('relation-get', 'a:0')
+        self.assertEqual(sorted(self.client.cache.values()), [2, 3])
@@ -0,0 +1,91 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import call, patch
+from test_utils import CharmTestCase
+
+import lib.log_utils as log_utils
+
+TO_PATCH = [
+    'config',
+    '_juju_log',
+]
+
+
+class LogUtilsTests(CharmTestCase):
+
+    def setUp(self):
+        super(LogUtilsTests, self).setUp(log_utils, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.addCleanup(self.reset)
+        self.reset()
+
+    def reset(self):
+        del log_utils._queue[:]
+        log_utils._queued_bytes = 0
+        log_utils._threshold = None
+
+    def test_log_batches_by_level(self):
+        log_utils.log('one', level='DEBUG')
+        log_utils.log('two', level='DEBUG')
+        log_utils.log('three')
+        log_utils.log('four', level='DEBUG')
+        self.assertFalse(self._juju_log.called)
+        log_utils.flush()
+        self.assertEqual(self._juju_log.call_args_list, [
+            call('one\ntwo', level='DEBUG'),
+            call('three', level=None),
+            call('four', level='DEBUG'),
+        ])
+        self.assertEqual(log_utils._queue, [])
+
+    def test_log_below_threshold_dropped(self):
+        self.test_config.set('log-level', 'warning')
+        log_utils.log('debug', level='DEBUG')
+        log_utils.log('info')
+        log_utils.log('warning', level='WARNING')
+        log_utils.flush()
+        self._juju_log.assert_called_once_with('warning', level='WARNING')
+
+    def test_log_error_flushes(self):
+        log_utils.log('info', level='INFO')
+        log_utils.log('error', level='ERROR')
+        self.assertEqual(self._juju_log.call_args_list, [
+            call('info', level='INFO'),
+            call('error', level='ERROR'),
+        ])
+
+    @patch.object(log_utils, 'MAX_BATCH_MESSAGES', 2)
+    def test_log_full_batch_flushes(self):
+        log_utils.log('one')
+        log_utils.log('two')
+        self._juju_log.assert_called_once_with('one\ntwo', level=None)
+
+    def test_log_threshold_read_once(self):
+        log_utils.log('one')
+        log_utils.log('two')
+        self.config.assert_called_once_with('log-level')
+
+    @patch.object(log_utils.atexit, 'register')
+    @patch.object(log_utils.hookenv, 'atexit')
+    def test_install(self, hookenv_atexit, register):
+        module = type(log_utils)('fake')
+        module.log = log_utils._juju_log
+        with patch.dict('sys.modules', {'fake': module}):
+            with patch.object(log_utils.hookenv, 'log'):
+                log_utils.install()
+                self.assertEqual(log_utils.hookenv.log, log_utils.log)
+        self.assertEqual(module.log, log_utils.log)
+        hookenv_atexit.assert_called_with(log_utils.flush)
+        register.assert_called_with(log_utils.flush)
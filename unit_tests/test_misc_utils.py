@@ -17,9 +17,9 @@ import tempfile
 import unittest
 import shutil
 
-from mock import patch
+from mock import MagicMock, patch
 
-from lib.misc_utils import ensure_block_device
+from lib.misc_utils import ensure_block_device, harden, LazyConfigs
 
 
 class EnsureBlockDeviceTestCase(unittest.TestCase):
@@ -38,3 +38,37 @@ class EnsureBlockDeviceTestCase(unittest.TestCase):
         assert mock_function.called
         self.assertEqual("/dev/null", result)
         shutil.rmtree(temp_dir)
+
+
+class HardenTestCase(unittest.TestCase):
+
+    @patch("lib.misc_utils.config")
+    def test_harden_disabled(self, config):
+        """The hardening stack is not loaded unless harden is set."""
+        config.return_value = None
+        with patch.dict("sys.modules",
+                        {"charmhelpers.contrib.hardening.harden": None}):
+            self.assertEqual(harden()(lambda x: x + 1)(1), 2)
+        config.assert_called_with("harden")
+
+    @patch("lib.misc_utils.config")
+    def test_harden_enabled(self, config):
+        config.return_value = "os"
+        hardening = MagicMock()
+        hardening.harden.return_value = lambda f: f
+        with patch.dict("sys.modules",
+                        {"charmhelpers.contrib.hardening.harden": hardening}):
+            self.assertEqual(harden()(lambda x: x + 1)(1), 2)
+        hardening.harden.assert_called_with(None)
+
+
+class LazyConfigsTestCase(unittest.TestCase):
+
+    def test_built_on_first_use(self):
+        factory = MagicMock()
+        configs = LazyConfigs(factory)
+        self.assertFalse(factory.called)
+        configs.write_all()
+        configs.write("/etc/swift/swift.conf")
+        factory.assert_called_once_with()
+        factory.return_value.write.assert_called_with("/etc/swift/swift.conf")
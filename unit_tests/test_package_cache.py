@@ -0,0 +1,89 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test_utils import CharmTestCase
+
+import lib.package_cache as package_cache
+
+TO_PATCH = [
+    'application_version_set',
+    'config',
+    'get_package_state',
+    'kv',
+    'lsb_release',
+    'openstack_utils',
+    'ubuntu',
+]
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def flush(self):
+        pass
+
+
+class PackageCacheTests(CharmTestCase):
+
+    def setUp(self):
+        super(PackageCacheTests, self).setUp(package_cache, TO_PATCH)
+        self.db = FakeKV()
+        self.kv.return_value = self.db
+        self.get_package_state.return_value = [[1, 100], [2, 4096]]
+        self.config.side_effect = self.test_config.get
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'xenial'}
+        self.openstack_utils.get_os_codename_package.return_value = 'mitaka'
+        self.ubuntu.get_upstream_version.return_value = '2.7.0'
+
+    def test_codename_cached(self):
+        self.assertEqual(package_cache.get_os_codename_package('swift'),
+                         'mitaka')
+        self.assertEqual(package_cache.get_os_codename_package('swift'),
+                         'mitaka')
+        self.openstack_utils.get_os_codename_package.assert_called_once_with(
+            'swift', False)
+
+    def test_state_change_invalidates(self):
+        package_cache.get_os_codename_package('swift')
+        self.get_package_state.return_value = [[3, 100], [2, 4096]]
+        self.openstack_utils.get_os_codename_package.return_value = 'newton'
+        self.assertEqual(package_cache.get_os_codename_package('swift'),
+                         'newton')
+
+    def test_codename_fatal(self):
+        self.openstack_utils.get_os_codename_package.return_value = None
+        self.assertEqual(package_cache.get_os_codename_package(
+            'swift', fatal=False), None)
+        package_cache.get_os_codename_package('swift')
+        self.openstack_utils.get_os_codename_package.assert_called_with(
+            'swift', fatal=True)
+
+    def test_os_application_version_set(self):
+        package_cache.os_application_version_set('swift-account')
+        package_cache.os_application_version_set('swift-account')
+        self.application_version_set.assert_called_with('2.7.0')
+        self.ubuntu.get_upstream_version.assert_called_once_with(
+            'swift-account')
+
+    def test_upgrade_available_keyed_on_source(self):
+        upgrade_available = self.openstack_utils.openstack_upgrade_available
+        upgrade_available.return_value = False
+        self.assertFalse(package_cache.openstack_upgrade_available('swift'))
+        self.assertFalse(package_cache.openstack_upgrade_available('swift'))
+        self.test_config.set('openstack-origin', 'cloud:xenial-newton')
+        upgrade_available.return_value = True
+        self.assertTrue(package_cache.openstack_upgrade_available('swift'))
+        self.assertEqual(upgrade_available.call_count, 2)
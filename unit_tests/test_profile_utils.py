@@ -0,0 +1,135 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import sys
+
+from mock import patch
+from test_utils import CharmTestCase
+
+import lib.profile_utils as profile_utils
+
+TO_PATCH = [
+    'kv',
+]
+
+
+def fake_record(hook, duration, phases, commands):
+    return {'hook': hook, 'start': 0, 'duration': duration,
+            'phases': phases, 'commands': commands,
+            'command-count': len(commands),
+            'command-time': sum(c[1] for c in commands)}
+
+
+class FakeHooks(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, args):
+        self.calls.append(args)
+
+    def setup_storage(self):
+        pass
+
+
+class ProfileUtilsTests(CharmTestCase):
+
+    def setUp(self):
+        super(ProfileUtilsTests, self).setUp(profile_utils, TO_PATCH)
+
+    def test_phase(self):
+        profiler = profile_utils.HookProfiler()
+        func = profiler.phase('apt', lambda x: x * 2)
+        self.assertEqual(func(2), 4)
+        func(3)
+        self.assertEqual(profiler.phases['apt'][0], 2)
+
+    def test_trace_subprocess(self):
+        profiler = profile_utils.HookProfiler()
+        popen = subprocess.Popen
+        profiler.trace_subprocess()
+        try:
+            subprocess.call(['true'])
+            self.assertRaises(subprocess.CalledProcessError,
+                              subprocess.check_output, ['false'])
+            self.assertRaises(OSError, subprocess.call, ['/nonexistent'])
+        finally:
+            profiler.untrace_subprocess()
+        self.assertEqual(subprocess.Popen, popen)
+        self.assertEqual([(c[0], c[2]) for c in profiler.commands],
+                         [('true', 0), ('false', 1), ('/nonexistent', None)])
+
+    def test_save_profile_bounded(self):
+        db = self.kv.return_value
+        db.get.return_value = range(profile_utils.MAX_HOOKS)
+        profile_utils.save_profile('new')
+        history = db.set.call_args[0][1]
+        self.assertEqual(len(history), profile_utils.MAX_HOOKS)
+        self.assertEqual(history[-1], 'new')
+        self.assertTrue(db.flush.called)
+
+    @patch.object(profile_utils, 'save_profile')
+    @patch.object(profile_utils.host, 'service', lambda *args: True)
+    def test_profile_hooks(self, save_profile):
+        hooks = FakeHooks()
+        target = FakeHooks()
+        profiler = profile_utils.profile_hooks(
+            hooks, [(target, 'setup_storage', 'setup-storage')])
+        hooks.execute(['hooks/config-changed'])
+        self.assertEqual(hooks.calls, [['hooks/config-changed']])
+        self.assertFalse(save_profile.called)
+        # Work done after the hook function is part of its profile.
+        target.setup_storage()
+        profiler.finish()
+        record = save_profile.call_args[0][0]
+        self.assertEqual(record['hook'], 'config-changed')
+        self.assertEqual(record['phases']['setup-storage'][0], 1)
+        self.assertEqual(profiler.phases, record['phases'])
+        profiler.finish()
+        self.assertEqual(save_profile.call_count, 1)
+
+    @patch.object(profile_utils.host, 'service', lambda *args: True)
+    def test_profile_hooks_without_hardening(self):
+        modules = [m for m in sys.modules
+                   if m.startswith('charmhelpers.contrib.hardening')]
+        with patch.dict(sys.modules):
+            for module in modules:
+                del sys.modules[module]
+            profile_utils.profile_hooks(FakeHooks(), [])
+            self.assertNotIn('charmhelpers.contrib.hardening.harden',
+                             sys.modules)
+
+    def test_get_profile_report(self):
+        history = [
+            fake_record('install', 100, {'apt': [1, 90]},
+                        [['apt-get install swift', 90, 0]]),
+            fake_record('config-changed', 30,
+                        {'setup-storage': [1, 20], 'templates': [2, 5]},
+                        [['mkfs.xfs /dev/sdb', 15, 0],
+                         ['config-get --all', 0.5, 0]]),
+        ]
+        report = profile_utils.get_profile_report(history, hooks=1, top=1)
+        self.assertEqual(sorted(report), ['commands.1', 'hooks.1',
+                                          'phases.1'])
+        self.assertTrue(report['hooks.1'].startswith('config-changed at'))
+        self.assertEqual(report['phases.1'],
+                         'setup-storage took 20.0s in 1 calls '
+                         '(config-changed)')
+        self.assertEqual(report['commands.1'],
+                         'mkfs.xfs /dev/sdb took 15.0s, exit 0 '
+                         '(config-changed)')
+        report = profile_utils.get_profile_report(history)
+        self.assertEqual(report['hooks.2'].split()[0], 'install')
+        self.assertEqual(report['phases.1'].split()[0], 'apt')
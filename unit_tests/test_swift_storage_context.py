@@ -12,20 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mock import MagicMock
+from mock import MagicMock, PropertyMock, patch
 from test_utils import CharmTestCase, patch_open
 
+import time
+
 import lib.swift_storage_context as swift_context
 
+BACKGROUND_PROFILES = '''
+night: {object-replicator-concurrency: 4, object-updater-concurrency: 8,
+        auditor-files-per-second: 50, bogus-option: 1}
+day: {object-replicator-concurrency: 1, auditor-interval: 600}
+'''
+
 
 TO_PATCH = [
     'config',
     'log',
-    'related_units',
-    'relation_get',
-    'relation_ids',
+    'relations',
     'unit_private_ip',
     'get_ipv6_addr',
+    'local_unit',
+    'get_local_devices',
+    'tuned_config',
 ]
 
 
@@ -34,26 +43,28 @@ class SwiftStorageContextTests(CharmTestCase):
     def setUp(self):
         super(SwiftStorageContextTests, self).setUp(swift_context, TO_PATCH)
         self.config.side_effect = self.test_config.get
+        self.tuned_config.side_effect = self.test_config.get
 
     def test_swift_storage_context_missing_data(self):
-        self.relation_ids.return_value = []
+        self.relations.return_value = {}
         ctxt = swift_context.SwiftStorageContext()
         self.assertEquals(ctxt(), {})
-        self.relation_ids.return_value = ['swift-proxy:0']
-        self.related_units.return_value = ['swift-proxy/0']
-        self.relation_get.return_value = ''
+        self.relations.return_value = {
+            'swift-proxy:0': {'swift-proxy/0': {'swift_hash': ''}}}
         self.assertEquals(ctxt(), {})
 
     def test_swift_storage_context_with_data(self):
-        self.relation_ids.return_value = []
+        self.relations.return_value = {}
         ctxt = swift_context.SwiftStorageContext()
         self.assertEquals(ctxt(), {})
-        self.relation_ids.return_value = ['swift-proxy:0']
-        self.related_units.return_value = ['swift-proxy/0']
-        self.relation_get.return_value = 'fooooo'
+        self.relations.return_value = {
+            'swift-proxy:0': {'swift-proxy/0': {},
+                              'swift-proxy/1': {'swift_hash': 'fooooo'}}}
         self.assertEquals(ctxt(), {'swift_hash': 'fooooo'})
+        self.relations.assert_called_with('swift-storage')
 
     def test_rsync_context(self):
+        self.relations.return_value = {}
         self.unit_private_ip.return_value = '10.0.0.5'
         ctxt = swift_context.RsyncContext()
         ctxt.enable_rsyncd = MagicMock()
@@ -61,7 +72,22 @@ class SwiftStorageContextTests(CharmTestCase):
         self.assertEquals({'local_ip': '10.0.0.5'}, ctxt())
         self.assertTrue(ctxt.enable_rsyncd.called)
 
+    def test_rsync_context_allowed_hosts(self):
+        self.relations.return_value = {
+            'swift-proxy:0': {
+                'swift-proxy/0': {'timestamp': '2',
+                                  'rsync_allowed_hosts': '10.0.0.1'},
+                'swift-proxy/1': {'timestamp': '3',
+                                  'rsync_allowed_hosts': '10.0.0.2'},
+                'swift-proxy/2': {'rsync_allowed_hosts': '10.0.0.3'}}}
+        self.unit_private_ip.return_value = '10.0.0.5'
+        ctxt = swift_context.RsyncContext()
+        ctxt.enable_rsyncd = MagicMock()
+        self.assertEquals({'local_ip': '10.0.0.5',
+                           'allowed_hosts': '10.0.0.2'}, ctxt())
+
     def test_rsync_context_ipv6(self):
+        self.relations.return_value = {}
         self.test_config.set('prefer-ipv6', True)
         self.get_ipv6_addr.return_value = ['2001:db8:1::1']
         ctxt = swift_context.RsyncContext()
@@ -70,6 +96,16 @@ class SwiftStorageContextTests(CharmTestCase):
         self.assertEquals({'local_ip': '2001:db8:1::1'}, ctxt())
         self.assertTrue(ctxt.enable_rsyncd.called)
 
+    def test_rsync_context_per_device(self):
+        self.relations.return_value = {}
+        self.test_config.set('rsync-module-per-device', True)
+        self.unit_private_ip.return_value = '10.0.0.5'
+        self.get_local_devices.return_value = ['sdb', 'sdc']
+        ctxt = swift_context.RsyncContext()
+        ctxt.enable_rsyncd = MagicMock()
+        self.assertEquals({'local_ip': '10.0.0.5',
+                           'devices': ['sdb', 'sdc']}, ctxt())
+
     def test_rsync_enable_rsync(self):
         with patch_open() as (_open, _file):
             ctxt = swift_context.RsyncContext()
@@ -98,9 +134,188 @@ class SwiftStorageContextTests(CharmTestCase):
             'account_server_port': '500',
             'local_ip': '10.0.0.5',
             'object_server_threads_per_disk': '3',
+            'object_keep_cache_size': None,
             'object_replicator_concurrency': '3',
             'account_max_connections': '10',
             'container_max_connections': '10',
             'object_max_connections': '10',
+            'rsync_module_per_device': False,
+            'backlog': None,
         }
         self.assertEquals(ex, result)
+
+    def test_get_server_backlog(self):
+        self.assertEquals(None, swift_context.get_server_backlog())
+        self.test_config.set('sysctl-profile', 'storage network')
+        self.assertEquals(8192, swift_context.get_server_backlog())
+        self.test_config.set('sysctl', '{ net.core.somaxconn: 4096 }')
+        self.assertEquals(4096, swift_context.get_server_backlog())
+
+    def test_auditor_context_defaults(self):
+        ctxt = swift_context.AuditorContext()
+        self.assertEquals({'account_auditor': {},
+                           'container_auditor': {},
+                           'object_auditor': {}}, ctxt())
+
+    def test_auditor_context_explicit(self):
+        self.test_config.set('auditor-files-per-second', 15)
+        self.test_config.set('auditor-bytes-per-second', 1000000)
+        self.test_config.set('auditor-interval', 60)
+        ctxt = swift_context.AuditorContext()
+        self.assertEquals({'account_auditor': {'interval': 60},
+                           'container_auditor': {'interval': 60},
+                           'object_auditor': {'files_per_second': 15,
+                                              'bytes_per_second': 1000000,
+                                              'interval': 60}}, ctxt())
+
+    @patch.object(swift_context, 'get_auditor_rates')
+    def test_auditor_context_auto_rate(self, get_auditor_rates):
+        self.test_config.set('auditor-auto-rate', True)
+        self.test_config.set('auditor-files-per-second', 7)
+        self.get_local_devices.return_value = ['sdb', 'sdc']
+        get_auditor_rates.return_value = {'files_per_second': 55,
+                                          'bytes_per_second': 28311552,
+                                          'zero_byte_files_per_second': 137,
+                                          'concurrency': 2}
+        ctxt = swift_context.AuditorContext()
+        self.assertEquals({'files_per_second': 7,
+                           'bytes_per_second': 28311552,
+                           'zero_byte_files_per_second': 137,
+                           'concurrency': 2}, ctxt()['object_auditor'])
+
+    @patch.object(swift_context, 'get_auditor_rates')
+    def test_auditor_context_auto_rate_explicit_zero(self, get_auditor_rates):
+        self.test_config.set('auditor-auto-rate', True)
+        self.test_config.set('auditor-bytes-per-second', 0)
+        self.test_config.set('auditor-interval', 0)
+        get_auditor_rates.return_value = {'files_per_second': 55,
+                                          'bytes_per_second': 28311552}
+        ctxt = swift_context.AuditorContext()()
+        self.assertEquals({'files_per_second': 55,
+                           'bytes_per_second': 0,
+                           'interval': 0}, ctxt['object_auditor'])
+        self.assertEquals({'interval': 0}, ctxt['account_auditor'])
+
+    def test_get_background_profiles(self):
+        self.test_config.set('background-profiles', BACKGROUND_PROFILES)
+        self.assertEquals(
+            {'night': {'object-replicator-concurrency': 4,
+                       'object-updater-concurrency': 8,
+                       'auditor-files-per-second': 50},
+             'day': {'object-replicator-concurrency': 1,
+                     'auditor-interval': 600}},
+            swift_context.get_background_profiles())
+        self.test_config.set('background-profiles', '[night')
+        self.assertEquals({}, swift_context.get_background_profiles())
+
+    def test_get_background_schedule(self):
+        self.test_config.set('background-profiles', BACKGROUND_PROFILES)
+        self.test_config.set('background-schedule',
+                             '18:30=night 08:00=day 25:00=day 09:00=lunch')
+        self.assertEquals([(480, 'day'), (1110, 'night')],
+                          swift_context.get_background_schedule())
+
+    def test_get_active_profile_name(self):
+        schedule = [(480, 'day'), (1110, 'night')]
+
+        def at(hour, minute):
+            return time.mktime((2016, 1, 1, hour, minute, 0, 0, 0, -1))
+
+        get_name = swift_context.get_active_profile_name
+        self.assertEquals('night', get_name(schedule, at(3, 0)))
+        self.assertEquals('day', get_name(schedule, at(8, 0)))
+        self.assertEquals('day', get_name(schedule, at(18, 29)))
+        self.assertEquals('night', get_name(schedule, at(23, 0)))
+        self.assertEquals(None, get_name([], at(23, 0)))
+
+    @patch.object(swift_context, 'get_active_profile_name')
+    def test_background_profile_applied(self, get_active_profile_name):
+        get_active_profile_name.return_value = 'night'
+        self.test_config.set('background-profiles', BACKGROUND_PROFILES)
+        self.test_config.set('background-schedule', '08:00=day 18:00=night')
+        self.assertEquals(
+            4, swift_context.SwiftStorageServerContext()()[
+                'object_replicator_concurrency'])
+        self.assertEquals(
+            {'files_per_second': 50},
+            swift_context.AuditorContext()()['object_auditor'])
+        self.assertEquals(
+            {'concurrency': 8},
+            swift_context.UpdaterContext()()['object_updater'])
+
+    def test_background_profile_explicit(self):
+        self.test_config.set('object-replicator-concurrency', 2)
+        ctxt = swift_context.SwiftStorageServerContext(profile={})
+        self.assertEquals(2, ctxt()['object_replicator_concurrency'])
+        ctxt = swift_context.SwiftStorageServerContext(
+            profile={'object-replicator-concurrency': 6})
+        self.assertEquals(6, ctxt()['object_replicator_concurrency'])
+        ctxt = swift_context.BackgroundProfileContext(
+            profile={'container-replicator-concurrency': 3})
+        self.assertEquals({'concurrency': 3}, ctxt()['container_replicator'])
+
+    def test_updater_context(self):
+        ctxt = swift_context.UpdaterContext(profile={})
+        self.assertEquals({'object_updater': {},
+                           'container_updater': {},
+                           'account_reaper': {}}, ctxt())
+        self.test_config.set('object-updater-concurrency', 4)
+        self.test_config.set('object-updater-objects-per-second', 100.0)
+        self.test_config.set('container-updater-containers-per-second', 20.0)
+        self.test_config.set('updater-node-timeout', 5)
+        self.test_config.set('account-reaper-concurrency', 8)
+        self.test_config.set('account-reaper-delay-reaping', 0)
+        ctxt = swift_context.UpdaterContext(
+            profile={'account-reaper-concurrency': 2})
+        self.assertEquals({'object_updater': {'concurrency': 4,
+                                              'objects_per_second': 100.0,
+                                              'node_timeout': 5},
+                           'container_updater': {'containers_per_second': 20.0,
+                                                 'node_timeout': 5},
+                           'account_reaper': {'concurrency': 2,
+                                              'delay_reaping': 0}}, ctxt())
+
+    def test_eval_workers(self):
+        names = {'cpus': 8, 'disks': 24}
+        self.assertEquals(4, swift_context.eval_workers('4', names))
+        self.assertEquals(24, swift_context.eval_workers('max(cpus, disks)',
+                                                         names))
+        self.assertEquals(12, swift_context.eval_workers('disks // 2',
+                                                         names))
+        self.assertEquals(4, swift_context.eval_workers('int(cpus / 2.0)',
+                                                        names))
+        for expression in ['__import__("os")', 'cpus ** 2', 'foo', '1 +',
+                           'max()', '"8"']:
+            self.assertRaises(ValueError, swift_context.eval_workers,
+                              expression, names)
+
+    @patch.object(swift_context.ServerWorkerContext, 'num_cpus',
+                  new_callable=PropertyMock)
+    def test_server_worker_context(self, num_cpus):
+        num_cpus.return_value = 8
+        self.get_local_devices.return_value = ['sd%s' % c
+                                               for c in 'bcdefghijklm']
+        ctxt = swift_context.ServerWorkerContext('object')
+        self.assertEquals({}, ctxt())
+        self.test_config.set('object-workers', 'max(cpus, disks)')
+        self.assertEquals({'workers': 12}, ctxt())
+        self.test_config.set('object-workers', 'cpus - 10')
+        self.assertEquals({'workers': 1}, ctxt())
+        self.test_config.set('object-workers', 'bogus')
+        self.assertEquals({}, ctxt())
+        self.assertTrue(self.log.called)
+
+    def test_statsd_context(self):
+        self.local_unit.return_value = 'swift-storage/3'
+        ctxt = swift_context.StatsdContext()
+        self.assertEquals({'statsd': {}}, ctxt())
+        self.test_config.set('statsd-host', '10.0.0.10')
+        self.test_config.set('zone', 2)
+        self.assertEquals(
+            {'statsd': {'log_statsd_host': '10.0.0.10',
+                        'log_statsd_port': 8125,
+                        'log_statsd_default_sample_rate': 1.0,
+                        'log_statsd_metric_prefix':
+                            'swift.z2.swift-storage-3'}}, ctxt())
+        self.test_config.set('statsd-local-aggregator', True)
+        self.assertEquals('127.0.0.1', ctxt()['statsd']['log_statsd_host'])
@@ -12,14 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mock import patch
+from mock import MagicMock, patch
+import importlib
 import os
 import json
+import subprocess
+import sys
+import tempfile
 import uuid
 
 from test_utils import CharmTestCase, patch_open
 
-with patch('hooks.charmhelpers.contrib.hardening.harden.harden') as mock_dec:
+with patch('hooks.lib.misc_utils.harden') as mock_dec:
     mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
                             lambda *args, **kwargs: f(*args, **kwargs))
     with patch('hooks.lib.misc_utils.is_paused') as is_paused:
@@ -27,6 +31,8 @@ with patch('hooks.charmhelpers.contrib.hardening.harden.harden') as mock_dec:
             import hooks.swift_storage_hooks as hooks
 
 from lib.swift_storage_utils import PACKAGES
+from hooks.lib.misc_utils import LazyConfigs
+from hooks.charmhelpers.contrib.openstack.templating import OSConfigRenderer
 
 TO_PATCH = [
     'CONFIGS',
@@ -54,22 +60,42 @@ TO_PATCH = [
     'save_script_rc',
     'setup_rsync',
     'setup_storage',
+    'setup_background_profiles',
+    'setup_background_controller',
+    'setup_sysctl',
+    'setup_service_isolation',
+    'setup_exporter',
     'register_configs',
     'update_nrpe_config',
+    'install_log_buffer',
+    'install_unit_state',
+    'vacuum_unit_state',
+    'atexit',
+    'enable_profiling',
     'get_ipv6_addr',
     'status_set',
-    'set_os_workload_status',
-    'os_application_version_set',
+    'update_workload_status',
+    # config_delta
+    'clear_dirty',
+    'get_pending_steps',
+    'mark_dirty',
 ]
 
+ALL_STEPS = [step for step, options in hooks.CONFIG_STEPS]
+
 
 class SwiftStorageRelationsTests(CharmTestCase):
 
     def setUp(self):
         super(SwiftStorageRelationsTests, self).setUp(hooks,
                                                       TO_PATCH)
+        patcher = patch('hooks.lib.misc_utils.is_paused')
+        self.is_paused = patcher.start()
+        self.is_paused.return_value = False
+        self.addCleanup(patcher.stop)
         self.config.side_effect = self.test_config.get
         self.relation_get.side_effect = self.test_relation.get
+        self.get_pending_steps.return_value = ALL_STEPS
 
     def test_install_hook(self):
         self.test_config.set('openstack-origin', 'cloud:precise-havana')
@@ -122,6 +148,20 @@ class SwiftStorageRelationsTests(CharmTestCase):
         self.assertTrue(self.setup_rsync.called)
         self.assertTrue(self.update_nrpe_config.called)
 
+    def test_config_changed_worker_multiplier(self):
+        self.get_pending_steps.return_value = ['background-profiles',
+                                               'templates']
+        self.relations_of_type.return_value = True
+        hooks.config_changed()
+        self.assertTrue(self.CONFIGS.write_all.called)
+        self.assertTrue(self.setup_background_profiles.called)
+        self.assertFalse(self.setup_storage.called)
+        self.assertFalse(self.setup_rsync.called)
+        self.assertFalse(self.openstack_upgrade_available.called)
+        self.assertFalse(self.update_nrpe_config.called)
+        self.clear_dirty.assert_called_with('background-profiles',
+                                            'templates')
+
     @patch.object(hooks, 'assert_charm_supports_ipv6')
     def test_config_changed_ipv6(self, mock_assert_charm_supports_ipv6):
         self.test_config.set('prefer-ipv6', True)
@@ -142,6 +182,7 @@ class SwiftStorageRelationsTests(CharmTestCase):
             'python-psutil'], fatal=True)
         self.assertTrue(self.update_nrpe_config.called)
         self.assertTrue(mock_ensure_devs_tracked.called)
+        self.mark_dirty.assert_called_with(*ALL_STEPS)
 
     @patch('hooks.lib.swift_storage_utils.get_device_blkid',
            lambda dev: str(uuid.uuid4()))
@@ -149,7 +190,8 @@ class SwiftStorageRelationsTests(CharmTestCase):
     @patch('hooks.lib.swift_storage_utils.os.path.isdir', lambda *args: True)
     @patch.object(hooks, 'relation_set')
     @patch('hooks.lib.swift_storage_utils.local_unit')
-    @patch('hooks.lib.swift_storage_utils.relation_ids', lambda *args: [])
+    @patch('hooks.lib.swift_storage_utils.relations',
+           lambda *args, **kwargs: {})
     @patch('hooks.lib.swift_storage_utils.KVStore')
     @patch.object(uuid, 'uuid4', lambda: 'a-test-uuid')
     def _test_storage_joined_single_device(self, mock_kvstore, mock_local_unit,
@@ -203,7 +245,8 @@ class SwiftStorageRelationsTests(CharmTestCase):
     @patch.object(hooks.os, 'environ')
     @patch('hooks.lib.swift_storage_utils.os.path.isdir', lambda *args: True)
     @patch.object(hooks, 'relation_set')
-    @patch('hooks.lib.swift_storage_utils.relation_ids', lambda *args: [])
+    @patch('hooks.lib.swift_storage_utils.relations',
+           lambda *args, **kwargs: {})
     @patch('hooks.lib.swift_storage_utils.KVStore')
     @patch.object(uuid, 'uuid4', lambda: 'a-test-uuid')
     def test_storage_joined_ipv6(self, mock_kvstore, mock_rel_set,
@@ -231,7 +274,8 @@ class SwiftStorageRelationsTests(CharmTestCase):
     @patch.object(hooks.os, 'environ')
     @patch('hooks.lib.swift_storage_utils.os.path.isdir', lambda *args: True)
     @patch('hooks.lib.swift_storage_utils.local_unit')
-    @patch('hooks.lib.swift_storage_utils.relation_ids', lambda *args: [])
+    @patch('hooks.lib.swift_storage_utils.relations',
+           lambda *args, **kwargs: {})
     @patch('hooks.lib.swift_storage_utils.KVStore')
     @patch.object(uuid, 'uuid4', lambda: 'a-test-uuid')
     def test_storage_joined_multi_device(self, mock_kvstore, mock_local_unit,
@@ -273,7 +317,8 @@ class SwiftStorageRelationsTests(CharmTestCase):
     @patch.object(hooks.os, 'environ')
     @patch('hooks.lib.swift_storage_utils.os.path.isdir', lambda *args: True)
     @patch('hooks.lib.swift_storage_utils.local_unit')
-    @patch('hooks.lib.swift_storage_utils.relation_ids', lambda *args: [])
+    @patch('hooks.lib.swift_storage_utils.relations',
+           lambda *args, **kwargs: {})
     @patch('hooks.lib.swift_storage_utils.KVStore')
     def test_storage_joined_dev_exists_unknown_juju_env_uuid(self,
                                                              mock_kvstore,
@@ -332,3 +377,154 @@ class SwiftStorageRelationsTests(CharmTestCase):
     def test_main_hook_missing(self, _argv):
         hooks.main()
         self.assertTrue(self.log.called)
+        self.assertFalse(self.enable_profiling.called)
+
+    @patch('sys.argv', ['hooks/update-status'])
+    def test_main_update_status(self):
+        hooks.main()
+        self.update_workload_status.assert_called_with(self.CONFIGS,
+                                                       force=False)
+
+    @patch('sys.argv', ['hooks/config-changed'])
+    def test_main_config_changed(self):
+        calls = []
+        self.update_workload_status.side_effect = \
+            lambda *args, **kwargs: calls.append('status')
+        self.vacuum_unit_state.side_effect = lambda: calls.append('vacuum')
+        hooks.main()
+        self.update_workload_status.assert_called_with(self.CONFIGS,
+                                                       force=True)
+        self.assertEqual(calls, ['status', 'vacuum'])
+
+    @patch('sys.argv')
+    def test_main_hook_profiling(self, _argv):
+        self.test_config.set('hook-profiling', True)
+        hooks.main()
+        self.assertTrue(self.enable_profiling.called)
+        self.assertTrue(self.enable_profiling.return_value.finish.called)
+
+
+# Imports the hooks module in a fresh interpreter and reports what loading it
+# cost: whether CONFIGS was built and which optional modules were imported.
+STARTUP_SCRIPT = """
+import json
+import sys
+import time
+from mock import MagicMock
+sys.modules['apt'] = MagicMock()
+sys.modules['apt_pkg'] = MagicMock()
+start = time.time()
+import hooks.swift_storage_hooks as hooks
+print(json.dumps({
+    'configs': hooks.CONFIGS._configs is not None,
+    'modules': sorted(name for name, module in sys.modules.items()
+                      if module and ('hardening' in name or
+                                     'charmsupport' in name or
+                                     'profile_utils' in name)),
+    'seconds': time.time() - start,
+}))
+"""
+
+
+class SwiftStorageHooksStartupTests(CharmTestCase):
+
+    def setUp(self):
+        super(SwiftStorageHooksStartupTests, self).setUp(hooks, [])
+
+    def test_import_is_lazy(self):
+        """Loading the hooks defers CONFIGS, hardening, nrpe and profiling."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        state = tempfile.NamedTemporaryFile(suffix='.db')
+        self.addCleanup(state.close)
+        env = dict(os.environ, CHARM_DIR=root, UNIT_STATE_DB=state.name)
+        output = subprocess.check_output([sys.executable, '-c',
+                                          STARTUP_SCRIPT], cwd=root, env=env)
+        startup = json.loads(output.splitlines()[-1])
+        self.assertFalse(startup['configs'])
+        self.assertEqual(startup['modules'], [])
+        self.assertLess(startup['seconds'], 10)
+
+    @patch.object(hooks, 'config', lambda option: None)
+    @patch('hooks.lib.profile_utils.profile_hooks')
+    def test_enable_profiling_is_lazy(self, profile_hooks):
+        """Profiling hooks does not build CONFIGS."""
+        factory = MagicMock()
+        with patch.object(hooks, 'CONFIGS', LazyConfigs(factory)):
+            hooks.enable_profiling()
+        self.assertFalse(factory.called)
+        targets = profile_hooks.call_args[0][1]
+        self.assertIn((OSConfigRenderer, 'write_all', 'templates'), targets)
+        self.assertIn((hooks, 'update_workload_status', 'status'), targets)
+
+
+NRPE_TO_PATCH = [
+    'apt_install',
+    'config',
+    'log',
+    'mkpath',
+    'rsync',
+]
+
+
+class SwiftStorageNRPETests(CharmTestCase):
+
+    def setUp(self):
+        super(SwiftStorageNRPETests, self).setUp(hooks, NRPE_TO_PATCH)
+        # nrpe is imported by update_nrpe_config() when it is called.
+        importlib.import_module('hooks.charmhelpers.contrib.charmsupport.nrpe')
+        patcher = patch('hooks.charmhelpers.contrib.charmsupport.nrpe')
+        self.nrpe = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config.side_effect = self.test_config.get
+        self.nrpe.get_nagios_hostname.return_value = 'juju-storage-0'
+        self.nrpe.get_nagios_unit_name.return_value = 'swift-storage/0'
+
+    def check_cmds(self):
+        nrpe_setup = self.nrpe.NRPE.return_value
+        return {c[1]['shortname']: c[1]['check_cmd']
+                for c in nrpe_setup.add_check.call_args_list}
+
+    @patch('os.path.exists')
+    def test_update_nrpe_config_aggregate(self, exists):
+        exists.return_value = False
+        hooks.update_nrpe_config()
+        nrpe_setup = self.nrpe.NRPE.return_value
+        self.assertEqual(
+            self.check_cmds()['swift_services'],
+            'check_swift_services.py {}'.format(' '.join(hooks.SWIFT_SVCS)))
+        nrpe_setup.remove_check.assert_any_call(shortname='swift-object')
+        self.assertFalse(self.nrpe.add_init_service_checks.called)
+        self.assertTrue(nrpe_setup.write.called)
+
+    @patch('os.path.exists')
+    def test_update_nrpe_config_passive(self, exists):
+        exists.return_value = False
+        self.test_config.set('nagios-passive-command',
+                             '/usr/sbin/send_nsca -H nagios')
+        hooks.update_nrpe_config()
+        self.assertTrue(self.check_cmds()['swift_services'].endswith(
+            '--passive-host juju-storage-0 '
+            '--passive-command /usr/sbin/send_nsca -H nagios'))
+
+    @patch('os.path.exists')
+    def test_update_nrpe_config_passive_no_hostname(self, exists):
+        exists.return_value = False
+        self.nrpe.get_nagios_hostname.return_value = None
+        self.test_config.set('nagios-passive-command',
+                             '/usr/sbin/send_nsca -H nagios')
+        hooks.update_nrpe_config()
+        check_cmd = self.check_cmds()['swift_services']
+        self.assertNotIn('--passive-host', check_cmd)
+        self.assertTrue(check_cmd.endswith(
+            ' --passive-command /usr/sbin/send_nsca -H nagios'))
+
+    @patch('os.path.exists')
+    def test_update_nrpe_config_per_service(self, exists):
+        exists.return_value = False
+        self.test_config.set('nagios-aggregate-service-check', False)
+        hooks.update_nrpe_config()
+        nrpe_setup = self.nrpe.NRPE.return_value
+        self.assertNotIn('swift_services', self.check_cmds())
+        nrpe_setup.remove_check.assert_called_with(shortname='swift_services')
+        self.nrpe.add_init_service_checks.assert_called_with(
+            nrpe_setup, hooks.SWIFT_SVCS, 'swift-storage/0')
@@ -0,0 +1,127 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import patch
+from test_utils import CharmTestCase, get_default_config
+
+import lib.swift_storage_tuning as swift_tuning
+
+from charmhelpers.core import hookenv
+
+GiB = 1024 ** 3
+
+TO_PATCH = [
+    'config',
+    'get_total_ram',
+    'mounts',
+]
+
+
+class SwiftStorageTuningTests(CharmTestCase):
+
+    def setUp(self):
+        super(SwiftStorageTuningTests, self).setUp(swift_tuning, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+
+    def profile(self, **kwargs):
+        profile = {'cpus': 16, 'ram': 128 * GiB, 'numa-nodes': 2,
+                   'devices': [], 'hdds': 0, 'ssds': 0, 'nic-speed': None}
+        profile.update(kwargs)
+        return profile
+
+    def test_get_local_devices(self):
+        self.mounts.return_value = [['/', '/dev/sda1'],
+                                    ['/srv/node/sdc', '/dev/sdc'],
+                                    ['/srv/node/sdb', '/dev/sdb'],
+                                    ['/srv/nodes/sdd', '/dev/sdd']]
+        self.assertEquals(['sdb', 'sdc'], swift_tuning.get_local_devices())
+
+    @patch.object(swift_tuning, 'is_rotational')
+    def test_get_auditor_rates_caps_concurrency(self, is_rotational):
+        is_rotational.return_value = True
+        devices = ['sd%s' % c for c in 'bcdefghi']
+        rates = swift_tuning.get_auditor_rates(devices)
+        self.assertEquals({'files_per_second': 20,
+                           'bytes_per_second': 8388608,
+                           'zero_byte_files_per_second': 50,
+                           'concurrency': 4}, rates)
+        self.assertEquals({}, swift_tuning.get_auditor_rates([]))
+
+    @patch.object(swift_tuning, 'is_rotational')
+    def test_get_recommendations(self, is_rotational):
+        is_rotational.return_value = True
+        devices = ['sd%s' % c for c in 'bcdefghijklm']
+        rec = swift_tuning.get_recommendations(self.profile(
+            devices=devices, hdds=12))
+        values = {k: v[0] for k, v in rec.items()}
+        self.assertEquals(16, values['object-workers'])
+        self.assertEquals(4, values['container-workers'])
+        self.assertEquals(2, values['account-workers'])
+        self.assertEquals(4, values['object-server-threads-per-disk'])
+        self.assertEquals(24, values['object-max-connections'])
+        self.assertEquals(6, values['object-replicator-concurrency'])
+        self.assertEquals(5242880, values['object-keep-cache-size'])
+        self.assertEquals(30, values['auditor-files-per-second'])
+        self.assertEquals(4, values['auditor-concurrency'])
+
+    def test_get_recommendations_numa_nodes(self):
+        rec = swift_tuning.get_recommendations(self.profile(
+            cpus=16, ssds=18, **{'numa-nodes': 4}))
+        self.assertEquals(20, rec['object-workers'][0])
+        self.assertTrue('numa-nodes=4' in rec['object-workers'][1])
+        rec = swift_tuning.get_recommendations(self.profile(
+            cpus=16, ssds=12, **{'numa-nodes': 4}))
+        self.assertEquals(16, rec['object-workers'][0])
+        self.assertFalse('numa-nodes' in rec['object-workers'][1])
+
+    @patch('glob.glob')
+    def test_get_numa_node_count(self, _glob):
+        _glob.return_value = ['/sys/devices/system/node/node0',
+                              '/sys/devices/system/node/node1']
+        self.assertEquals(2, swift_tuning.get_numa_node_count())
+        _glob.assert_called_with('/sys/devices/system/node/node[0-9]*')
+        _glob.return_value = []
+        self.assertEquals(1, swift_tuning.get_numa_node_count())
+
+    def test_get_recommendations_constrained(self):
+        rec = swift_tuning.get_recommendations(self.profile(
+            cpus=4, ram=8 * GiB, devices=[], ssds=8, **{'nic-speed': 1000}))
+        values = {k: v[0] for k, v in rec.items()}
+        self.assertEquals(8, values['object-workers'])
+        self.assertEquals(8, values['object-server-threads-per-disk'])
+        self.assertEquals(10, values['object-max-connections'])
+        self.assertTrue('nic-speed=1000' in rec['object-max-connections'][1])
+        self.assertEquals(2, values['object-replicator-concurrency'])
+        self.assertEquals(0, values['object-keep-cache-size'])
+
+    @patch.object(swift_tuning, 'get_charm_defaults')
+    @patch.object(swift_tuning, 'get_tuning')
+    def test_tuned_config(self, get_tuning, get_charm_defaults):
+        get_charm_defaults.return_value = get_default_config()
+        get_tuning.return_value = {
+            'object-max-connections': (24, 'derivation'),
+            'object-workers': (16, 'derivation')}
+        self.assertEquals(
+            2, swift_tuning.tuned_config('object-max-connections'))
+        self.test_config.set('auto-tune', True)
+        self.assertEquals(
+            24, swift_tuning.tuned_config('object-max-connections'))
+        self.assertEquals(16, swift_tuning.tuned_config('object-workers'))
+        self.assertEquals(
+            1, swift_tuning.tuned_config('object-replicator-concurrency'))
+        self.test_config.set('object-workers', 'max(cpus, disks)')
+        self.assertEquals('max(cpus, disks)',
+                          swift_tuning.tuned_config('object-workers'))
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import json
+import os
 import shutil
 import tempfile
 
@@ -236,6 +239,24 @@ class SwiftStorageUtilsTests(CharmTestCase):
             ['mkfs.xfs', '-f', '-i', 'size=1024', '/dev/sdb']
         )
 
+    @patch.object(swift_utils, 'remember_devices')
+    @patch.object(swift_utils, 'local_unit')
+    @patch.object(swift_utils, 'relations')
+    @patch.object(swift_utils, 'KVStore')
+    @patch('os.path.isdir')
+    def test_is_device_in_ring_from_relation(self, isdir, kvstore, relations,
+                                             local_unit, remember_devices):
+        isdir.return_value = True
+        kvstore.return_value.get.return_value = None
+        local_unit.return_value = 'swift-storage/0'
+        relations.return_value = {
+            'swift-storage:0': {'swift-proxy/0': {'device': 'vdd'},
+                                'swift-storage/0': {'device': 'vdb:vdc'}}}
+        self.assertTrue(swift_utils.is_device_in_ring('vdc'))
+        remember_devices.assert_called_once_with(['vdc'])
+        relations.assert_called_with('swift-storage', local=True)
+        self.assertFalse(swift_utils.is_device_in_ring('vdd'))
+
     @patch.object(swift_utils, 'is_device_in_ring')
     @patch.object(swift_utils, 'clean_storage')
     @patch.object(swift_utils, 'mkfs_xfs')
@@ -343,10 +364,21 @@ class SwiftStorageUtilsTests(CharmTestCase):
     @patch.object(swift_utils, 'SwiftStorageContext')
     @patch.object(swift_utils, 'RsyncContext')
     @patch.object(swift_utils, 'SwiftStorageServerContext')
+    @patch.object(swift_utils, 'StatsdContext')
+    @patch.object(swift_utils, 'ServerWorkerContext')
+    @patch.object(swift_utils, 'AuditorContext')
+    @patch.object(swift_utils, 'UpdaterContext')
+    @patch.object(swift_utils, 'BackgroundProfileContext')
     @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
-    def test_register_configs_post_install(self, renderer,
-                                           swift, rsync, server,
+    def test_register_configs_post_install(self, renderer, background,
+                                           updater, auditor, server_worker,
+                                           statsd, swift, rsync, server,
                                            bind_context, worker_context):
+        background.return_value = 'background_context'
+        statsd.return_value = 'statsd_context'
+        server_worker.side_effect = lambda s: '%s_worker_context' % s
+        updater.return_value = 'updater_context'
+        auditor.return_value = 'auditor_context'
         swift.return_value = 'swift_context'
         rsync.return_value = 'rsync_context'
         server.return_value = 'swift_server_context'
@@ -359,19 +391,21 @@ class SwiftStorageUtilsTests(CharmTestCase):
         swift_utils.register_configs()
         renderer.assert_called_with(templates_dir=swift_utils.TEMPLATES,
                                     openstack_release='grizzly')
+
+        def server_contexts(server):
+            return ['swift_context', 'bind_host_context', 'worker_context',
+                    '%s_worker_context' % server, 'statsd_context',
+                    'auditor_context',
+                    'updater_context', 'background_context']
         ex = [
             call('/etc/swift/swift.conf', ['swift_server_context']),
             call('/etc/rsync-juju.d/050-swift-storage.conf',
                  ['rsync_context', 'swift_context']),
-            call('/etc/swift/account-server.conf', ['swift_context',
-                                                    'bind_host_context',
-                                                    'worker_context']),
-            call('/etc/swift/object-server.conf', ['swift_context',
-                                                   'bind_host_context',
-                                                   'worker_context']),
-            call('/etc/swift/container-server.conf', ['swift_context',
-                                                      'bind_host_context',
-                                                      'worker_context'])
+            call('/etc/swift/account-server.conf',
+                 server_contexts('account')),
+            call('/etc/swift/object-server.conf', server_contexts('object')),
+            call('/etc/swift/container-server.conf',
+                 server_contexts('container')),
         ]
         self.assertEquals(ex, configs.register.call_args_list)
 
@@ -432,3 +466,612 @@ class SwiftStorageUtilsTests(CharmTestCase):
         uuid = swift_utils.get_device_blkid(dev)
         self.assertEquals(uuid, "808bc298-0609-4619-aaef-ed7a5ab0ebb7")
         mock_check_output.assert_called_with(cmd)
+
+    @patch.object(swift_utils, 'BackgroundProfileContext')
+    @patch.object(swift_utils, 'UpdaterContext')
+    @patch.object(swift_utils, 'AuditorContext')
+    @patch.object(swift_utils, 'SwiftStorageServerContext')
+    @patch.object(swift_utils, 'get_background_profiles')
+    def test_get_profile_settings(self, get_background_profiles, server,
+                                  auditor, updater, background):
+        get_background_profiles.return_value = {
+            'night': {'object-replicator-concurrency': 4,
+                      'auditor-interval': 60},
+            'day': {'object-updater-concurrency': 2}}
+        server.return_value.return_value = {
+            'object_replicator_concurrency': 4}
+        auditor.return_value.return_value = {
+            'account_auditor': {'interval': 60},
+            'container_auditor': {'interval': 60},
+            'object_auditor': {'interval': 60, 'concurrency': 2}}
+        updater.return_value.return_value = {'object_updater': {}}
+        background.return_value.return_value = {}
+        profile = {'object-replicator-concurrency': 4, 'auditor-interval': 60}
+        settings = swift_utils.get_profile_settings(profile)
+        server.assert_called_with(profile=profile)
+        self.assertEquals(
+            {'/etc/swift/account-server.conf': {
+                'account-auditor': {'interval': 60}},
+             '/etc/swift/container-server.conf': {
+                'container-auditor': {'interval': 60}},
+             '/etc/swift/object-server.conf': {
+                'object-auditor': {'interval': 60},
+                'object-replicator': {'concurrency': 4},
+                'object-updater': {'concurrency': None}}},
+            settings)
+
+    @patch.object(swift_utils, 'get_profile_settings')
+    @patch.object(swift_utils, 'get_background_schedule')
+    @patch.object(swift_utils, 'get_background_profiles')
+    @patch.object(swift_utils, 'install_background_tools')
+    @patch.object(swift_utils, 'write_file')
+    def test_setup_background_profiles(self, write_file, install,
+                                       get_background_profiles,
+                                       get_background_schedule,
+                                       get_profile_settings):
+        get_background_profiles.return_value = {
+            'night': {'object-updater-concurrency': 4},
+            'day': {'object-updater-concurrency': 1}}
+        get_background_schedule.return_value = [(450, 'day'),
+                                                (1140, 'night')]
+        get_profile_settings.side_effect = lambda p: {
+            'object-updater': {
+                'concurrency': p['object-updater-concurrency']}}
+        swift_utils.setup_background_profiles()
+        profiles = json.loads(write_file.call_args_list[0][0][1])
+        self.assertEquals([[450, 'day'], [1140, 'night']],
+                          profiles['schedule'])
+        self.assertEquals({'day': {'object-updater': {'concurrency': 1}},
+                           'night': {'object-updater': {'concurrency': 4}}},
+                          profiles['profiles'])
+        write_file.assert_called_with(
+            swift_utils.BACKGROUND_PROFILE_CRON,
+            '# Managed by juju: applies the background profile scheduled by\n'
+            '# the background-schedule option of the swift-storage charm.\n'
+            '30 7 * * * root /usr/local/bin/swift-background-profile\n'
+            '0 19 * * * root /usr/local/bin/swift-background-profile\n',
+            perms=0o644)
+        self.assertTrue(install.called)
+
+    @patch.object(swift_utils, 'get_background_schedule')
+    @patch.object(swift_utils, 'get_background_profiles')
+    @patch.object(swift_utils.os, 'unlink')
+    @patch.object(swift_utils.os.path, 'exists')
+    def test_setup_background_profiles_disabled(self, exists, unlink,
+                                                get_background_profiles,
+                                                get_background_schedule):
+        get_background_profiles.return_value = {}
+        get_background_schedule.return_value = []
+        exists.return_value = True
+        swift_utils.setup_background_profiles()
+        unlink.assert_has_calls([call(swift_utils.BACKGROUND_PROFILE_CRON),
+                                 call(swift_utils.BACKGROUND_PROFILES)])
+
+    @patch.object(swift_utils, 'install_background_tools')
+    @patch.object(swift_utils, 'get_local_devices')
+    @patch.object(swift_utils, 'write_file')
+    def test_setup_background_controller(self, write_file, get_local_devices,
+                                         install):
+        self.test_config.set('adaptive-background-concurrency', True)
+        get_local_devices.return_value = ['sdb', 'sdc']
+        swift_utils.setup_background_controller()
+        self.assertEquals({'devices': ['sdb', 'sdc'],
+                           'async_pending_threshold': 1000,
+                           'updater_concurrency_max': 8,
+                           'throttled_concurrency_min': 1,
+                           'disk_util_target': 80,
+                           'disk_await_target': 50},
+                          json.loads(write_file.call_args_list[0][0][1]))
+        write_file.assert_called_with(
+            swift_utils.BACKGROUND_CONTROLLER_CRON,
+            '# Managed by juju: swift-storage adaptive-background-'
+            'concurrency\n* * * * * root '
+            '/usr/local/bin/swift-background-controller\n',
+            perms=0o644)
+        self.assertTrue(install.called)
+
+    @patch.object(swift_utils, 'remove_files')
+    def test_setup_background_controller_disabled(self, remove_files):
+        swift_utils.setup_background_controller()
+        remove_files.assert_called_with(
+            [swift_utils.BACKGROUND_CONTROLLER_CRON,
+             swift_utils.BACKGROUND_CONTROLLER])
+
+    @patch.object(swift_utils, 'symlink')
+    @patch.object(swift_utils, 'rsync')
+    def test_install_background_tools(self, rsync, symlink):
+        with patch.dict('os.environ', {'CHARM_DIR': '/charm'}):
+            swift_utils.install_background_tools()
+        rsync.assert_called_with('/charm/files/background/',
+                                 '/usr/local/lib/swift-background')
+        symlink.assert_has_calls([
+            call('/usr/local/lib/swift-background/swift-background-profile',
+                 '/usr/local/bin/swift-background-profile'),
+            call('/usr/local/lib/swift-background/'
+                 'swift-background-controller',
+                 '/usr/local/bin/swift-background-controller')])
+
+    def test_get_async_pending(self):
+        with patch_open() as (_open, _file):
+            _file.read.return_value = '{"async_pending": 42}'
+            self.assertEquals(42, swift_utils.get_async_pending())
+            _open.assert_called_with('/var/cache/swift/object.recon')
+            _file.read.return_value = '{}'
+            self.assertEquals(None, swift_utils.get_async_pending())
+
+    @patch.object(swift_utils, 'check_swift_services')
+    @patch.object(swift_utils, 'get_async_pending')
+    @patch.object(swift_utils, 'status_set')
+    @patch.object(swift_utils, '_determine_os_workload_status')
+    def test_set_workload_status(self, determine, status_set,
+                                 get_async_pending, check_swift_services):
+        self.is_paused.return_value = False
+        check_swift_services.return_value = (None, None)
+        determine.return_value = ('active', 'Unit is ready')
+        get_async_pending.return_value = 12
+        swift_utils.set_workload_status('configs')
+        determine.assert_called_with('configs',
+                                     swift_utils.REQUIRED_INTERFACES,
+                                     charm_func=swift_utils.assess_status)
+        check_swift_services.assert_called_with(running=True)
+        status_set.assert_called_with('active',
+                                      'Unit is ready (async pendings: 12)')
+        get_async_pending.return_value = None
+        swift_utils.set_workload_status('configs')
+        status_set.assert_called_with('active', 'Unit is ready')
+        check_swift_services.reset_mock()
+        determine.return_value = ('blocked', 'Missing relations: proxy')
+        swift_utils.set_workload_status('configs')
+        status_set.assert_called_with('blocked', 'Missing relations: proxy')
+        self.assertFalse(check_swift_services.called)
+        determine.return_value = ('active', 'Unit is ready')
+        check_swift_services.return_value = (
+            'blocked', 'Services not running that should be: swift-object')
+        self.assertEqual(swift_utils.set_workload_status('configs'),
+                         check_swift_services.return_value)
+
+    @patch.object(swift_utils, 'check_output')
+    @patch.object(swift_utils, 'init_is_systemd')
+    def test_get_running_services_systemd(self, init_is_systemd,
+                                          check_output):
+        init_is_systemd.return_value = True
+        check_output.return_value = (
+            b'ActiveState=active\nId=swift-account.service\n\n'
+            b'Id=swift-object.service\nActiveState=failed\n')
+        self.assertEqual(swift_utils.get_running_services(
+            ['swift-account', 'swift-object']),
+            {'swift-account': True, 'swift-object': False})
+        check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=Id', '--property=ActiveState',
+             'swift-account.service', 'swift-object.service'])
+
+    @patch.object(swift_utils, 'service_running')
+    @patch.object(swift_utils, 'check_output')
+    @patch.object(swift_utils, 'init_is_systemd')
+    def test_get_running_services_upstart(self, init_is_systemd,
+                                          check_output, service_running):
+        init_is_systemd.return_value = False
+        service_running.return_value = True
+        check_output.return_value = (
+            b'swift-account start/running, process 1234\n'
+            b'swift-object stop/waiting\n')
+        self.assertEqual(swift_utils.get_running_services(
+            ['swift-account', 'swift-object', 'rsync']),
+            {'swift-account': True, 'swift-object': False, 'rsync': True})
+        service_running.assert_called_once_with('rsync')
+
+    @patch.object(swift_utils, 'get_listening_ports')
+    @patch.object(swift_utils, 'get_running_services')
+    def test_check_swift_services(self, get_running_services,
+                                  get_listening_ports):
+        self.get_os_codename_package.return_value = 'mitaka'
+        get_running_services.side_effect = lambda services: {
+            service: service != 'swift-object-auditor'
+            for service in services}
+        get_listening_ports.return_value = [6000, 6001]
+        self.assertEqual(
+            swift_utils.check_swift_services(),
+            ('blocked', 'Services not running that should be: '
+             'swift-object-auditor; Ports which should be open, but are '
+             'not: 6002'))
+        running = sorted(set(swift_utils.SWIFT_SVCS).difference(
+            ['swift-object-auditor']))
+        self.assertEqual(
+            swift_utils.check_swift_services(running=False),
+            ('blocked', 'Services should be paused but these services '
+             'running: %s, these ports which should be closed, but are '
+             'open: 6001, 6000' % ', '.join(running)))
+        get_running_services.side_effect = None
+        get_running_services.return_value = {'swift-account': True}
+        get_listening_ports.return_value = [6000, 6001, 6002]
+        self.assertEqual(swift_utils.check_swift_services(), (None, None))
+
+    def test_get_swift_services(self):
+        self.get_os_codename_package.return_value = 'havana'
+        self.assertNotIn('swift-container-sync',
+                         swift_utils.get_swift_services())
+        self.get_os_codename_package.return_value = None
+        self.assertEqual(swift_utils.get_swift_services(),
+                         swift_utils.SWIFT_SVCS)
+
+    def test_get_swift_pids(self):
+        run_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, run_dir)
+        os_dir = os.path.join(run_dir, 'object-server')
+        os.mkdir(os_dir)
+        with open(os.path.join(run_dir, 'account-server.pid'), 'w') as f:
+            f.write('%d\n' % os.getpid())
+        with open(os.path.join(os_dir, '1.pid'), 'w') as f:
+            f.write('999999999\n')
+        self.assertEqual(swift_utils.get_swift_pids(run_dir),
+                         {'account-server.pid': os.getpid(),
+                          'object-server/1.pid': None})
+
+    def test_get_listening_ports(self):
+        tcp = [
+            '  sl  local_address rem_address   st tx_queue rx_queue\n',
+            '   0: 00000000:1770 00000000:0000 0A 00000000:00000000\n',
+            '   1: 0100007F:1771 0100007F:D3A2 01 00000000:00000000\n',
+            '   2: 00000000:0369 00000000:0000 0A 00000000:00000000\n',
+        ]
+        with patch_open() as (_open, _file):
+            _file.readlines.return_value = tcp
+            self.assertEqual(swift_utils.get_listening_ports(), [873, 6000])
+
+    @patch.object(swift_utils, 'get_status_inputs')
+    @patch.object(swift_utils, 'get_status_message')
+    @patch.object(swift_utils, 'os_application_version_set')
+    @patch.object(swift_utils, 'set_workload_status')
+    @patch.object(swift_utils, 'status_set')
+    @patch.object(swift_utils, 'kv')
+    def test_update_workload_status(self, kv, status_set,
+                                    set_workload_status,
+                                    os_application_version_set,
+                                    get_status_message, get_status_inputs):
+        store = {}
+        kv.return_value.get.side_effect = store.get
+        kv.return_value.set.side_effect = store.__setitem__
+        set_workload_status.return_value = ('active', 'Unit is ready')
+        get_status_message.return_value = 'Unit is ready'
+        get_status_inputs.return_value = {'pids': {'a.pid': 1}}
+
+        # no cache yet, so update-status evaluates fully
+        swift_utils.update_workload_status('configs', force=False)
+        set_workload_status.assert_called_once_with('configs')
+        os_application_version_set.assert_called_once_with(
+            swift_utils.VERSION_PACKAGE)
+        get_status_inputs.assert_called_with([6002, 6001, 6000])
+
+        # unchanged inputs only refresh the async pending backlog
+        set_workload_status.reset_mock()
+        swift_utils.update_workload_status('configs', force=False)
+        self.assertFalse(set_workload_status.called)
+        self.assertFalse(status_set.called)
+        get_status_message.return_value = 'Unit is ready (async pendings: 3)'
+        swift_utils.update_workload_status('configs', force=False)
+        self.assertFalse(set_workload_status.called)
+        status_set.assert_called_once_with(
+            'active', 'Unit is ready (async pendings: 3)')
+
+        # a daemon restarting triggers a full evaluation
+        get_status_inputs.return_value = {'pids': {'a.pid': 2}}
+        swift_utils.update_workload_status('configs', force=False)
+        set_workload_status.assert_called_once_with('configs')
+
+        # as does any other hook
+        set_workload_status.reset_mock()
+        swift_utils.update_workload_status('configs')
+        set_workload_status.assert_called_once_with('configs')
+
+    @patch('os.path.exists')
+    def test_get_storage_sysctl(self, exists):
+        exists.return_value = True
+        gib = 1024 * 1024 * 1024
+        self.assertEquals({'vm.vfs_cache_pressure': 10,
+                           'vm.dirty_ratio': 10,
+                           'vm.dirty_background_bytes': 64 * gib // 100,
+                           'vm.min_free_kbytes': 671088,
+                           'fs.xfs.xfssyncd_centisecs': 1000},
+                          swift_utils.get_storage_sysctl(64 * gib, 12))
+        exists.return_value = False
+        settings = swift_utils.get_storage_sysctl(4 * gib, 1)
+        self.assertEquals(20, settings['vm.dirty_ratio'])
+        self.assertEquals(64 * 1024 * 1024,
+                          settings['vm.dirty_background_bytes'])
+        self.assertEquals(65536, settings['vm.min_free_kbytes'])
+        self.assertFalse('fs.xfs.xfssyncd_centisecs' in settings)
+
+    def test_get_network_sysctl(self):
+        settings = swift_utils.get_network_sysctl(1024, 1)
+        self.assertEquals(8192, settings['net.core.somaxconn'])
+        self.assertEquals(8192, settings['net.ipv4.tcp_max_syn_backlog'])
+        self.assertEquals(1, settings['net.ipv4.tcp_tw_reuse'])
+        self.assertEquals('4096 87380 16777216', settings['net.ipv4.tcp_rmem'])
+
+    @patch.object(swift_utils, 'get_sysctl_overrides')
+    @patch.object(swift_utils, 'get_local_devices')
+    @patch.object(swift_utils, 'get_total_ram')
+    def test_get_sysctl_settings(self, get_total_ram, get_local_devices,
+                                 get_sysctl_overrides):
+        get_sysctl_overrides.return_value = {}
+        get_storage_sysctl = MagicMock()
+        patcher = patch.dict(swift_utils.SYSCTL_PROFILES,
+                             {'storage': get_storage_sysctl})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertEquals({}, swift_utils.get_sysctl_settings())
+        get_total_ram.return_value = 1024
+        get_local_devices.return_value = ['sdb', 'sdc']
+        get_storage_sysctl.return_value = {'vm.vfs_cache_pressure': 10,
+                                           'vm.dirty_ratio': 10}
+        self.test_config.set('sysctl-profile', 'storage bogus')
+        get_sysctl_overrides.return_value = {'vm.dirty_ratio': 5}
+        self.assertEquals({'vm.vfs_cache_pressure': 10,
+                           'vm.dirty_ratio': 5},
+                          swift_utils.get_sysctl_settings())
+        get_storage_sysctl.assert_called_with(1024, 2)
+
+    @patch.object(swift_utils, 'remove_files')
+    @patch.object(swift_utils, 'sysctl_create')
+    @patch.object(swift_utils, 'get_sysctl_settings')
+    @patch.object(swift_utils, 'is_container')
+    def test_setup_sysctl(self, is_container, get_sysctl_settings,
+                          sysctl_create, remove_files):
+        is_container.return_value = False
+        get_sysctl_settings.return_value = {'vm.vfs_cache_pressure': 10}
+        swift_utils.setup_sysctl()
+        sysctl_create.assert_called_with('vm.vfs_cache_pressure: 10\n',
+                                         swift_utils.SYSCTL_FILE)
+        get_sysctl_settings.return_value = {}
+        swift_utils.setup_sysctl()
+        remove_files.assert_called_with([swift_utils.SYSCTL_FILE])
+        is_container.return_value = True
+        sysctl_create.reset_mock()
+        swift_utils.setup_sysctl()
+        self.assertFalse(sysctl_create.called)
+
+    @patch.object(swift_utils, 'mounts')
+    def test_get_swift_block_devices(self, mounts):
+        mounts.return_value = [['/', '/dev/sda1'],
+                               ['/srv/node/sdc', '/dev/sdc'],
+                               ['/srv/node/sdb', '/dev/sdb']]
+        self.assertEquals(['/dev/sdb', '/dev/sdc'],
+                          swift_utils.get_swift_block_devices())
+
+    def test_get_service_isolation(self):
+        self.test_config.set('service-isolation', True)
+        self.test_config.set('background-read-bandwidth-max', '50M')
+        self.assertEquals(
+            '# Managed by juju: swift-storage service-isolation\n'
+            '[Service]\nCPUWeight=500\nIOWeight=500\n',
+            swift_utils.get_service_isolation('swift-object', 237,
+                                              ['/dev/sdb']))
+        self.assertEquals(
+            '# Managed by juju: swift-storage service-isolation\n'
+            '[Service]\nCPUShares=512\nBlockIOWeight=250\n'
+            'BlockIOReadBandwidth=/dev/sdb 50M\n',
+            swift_utils.get_service_isolation('swift-object-auditor', 229,
+                                              ['/dev/sdb']))
+        self.assertFalse('Bandwidth' in swift_utils.get_service_isolation(
+            'swift-object-updater', 237, ['/dev/sdb']))
+
+    def test_get_service_isolation_affinity(self):
+        affinity = {'foreground': [0, 1], 'background': [2, 3]}
+        self.assertEquals(
+            '# Managed by juju: swift-storage service-isolation\n'
+            '[Service]\nCPUAffinity=2 3\n',
+            swift_utils.get_service_isolation('swift-object-replicator', 237,
+                                              [], affinity))
+
+    def test_parse_cpulist(self):
+        self.assertEquals([0, 1, 2, 3, 8, 10, 11],
+                          swift_utils.parse_cpulist('0-3,8,10-11\n'))
+        self.assertEquals([], swift_utils.parse_cpulist(''))
+
+    @patch.object(swift_utils, 'get_local_numa_nodes')
+    @patch.object(swift_utils, 'get_numa_nodes')
+    def test_get_cpu_affinity(self, get_numa_nodes, get_local_numa_nodes):
+        self.assertEquals({}, swift_utils.get_cpu_affinity())
+        get_numa_nodes.return_value = {0: [0, 1], 1: [2, 3]}
+        get_local_numa_nodes.return_value = set([1])
+        self.test_config.set('foreground-cpu-affinity', 'local')
+        self.test_config.set('background-cpu-affinity', 'remote')
+        self.assertEquals({'foreground': [2, 3], 'background': [0, 1]},
+                          swift_utils.get_cpu_affinity())
+        get_local_numa_nodes.return_value = set()
+        self.assertEquals({'foreground': [0, 1, 2, 3],
+                           'background': [0, 1, 2, 3]},
+                          swift_utils.get_cpu_affinity())
+        self.test_config.set('background-cpu-affinity', '4-5')
+        self.assertEquals([4, 5],
+                          swift_utils.get_cpu_affinity()['background'])
+        for invalid in ('4-x', 'cpu0', '5-3'):
+            self.test_config.set('background-cpu-affinity', invalid)
+            self.assertNotIn('background', swift_utils.get_cpu_affinity())
+        self.log.assert_called_with(
+            "Ignoring invalid background-cpu-affinity '5-3'",
+            level=swift_utils.WARNING)
+
+    def test_get_irq_cpus(self):
+        interrupts = (
+            '           CPU0       CPU1\n'
+            ' 24:          0         10   PCI-MSI 1-edge      eth1\n'
+            ' 25:         10          0   PCI-MSI 2-edge      eth1-TxRx-0\n'
+            ' 26:          5          5   PCI-MSI 3-edge      eth10-TxRx-0\n'
+            ' 27:          5          5   IO-APIC 16-fasteoi  '
+            'ehci_hcd:usb1, eth11\n'
+            ' 28:          5          5   IO-APIC 17-fasteoi  '
+            'ehci_hcd:usb2, eth1\n')
+        affinity = {'24': '1\n', '25': '0\n', '28': '0-1\n'}
+
+        def fake_open(path):
+            if path == '/proc/interrupts':
+                return io.BytesIO(interrupts)
+            irq = path.split('/')[3]
+            if irq not in affinity:
+                raise IOError(2, 'No such file or directory')
+            return io.BytesIO(affinity[irq])
+
+        with patch('__builtin__.open', fake_open):
+            self.assertEquals([[1], [0], [0, 1]],
+                              swift_utils.get_irq_cpus('eth1'))
+
+    @patch.object(swift_utils, 'get_irq_cpus')
+    @patch.object(swift_utils, 'get_device_numa_node')
+    @patch.object(swift_utils, 'get_iface_from_addr')
+    @patch.object(swift_utils, 'get_swift_block_devices')
+    def test_get_local_numa_nodes(self, get_devices, get_iface_from_addr,
+                                  get_device_numa_node, get_irq_cpus):
+        nodes = {0: [0, 1], 1: [2, 3], 2: [4, 5]}
+        get_devices.return_value = ['/dev/sdb']
+        get_iface_from_addr.return_value = 'eth0'
+        get_device_numa_node.side_effect = lambda path: {
+            '/sys/class/block/sdb': 1}.get(path)
+        get_irq_cpus.return_value = [[4], [0, 1, 2, 3, 4, 5]]
+        self.assertEquals(set([1, 2]),
+                          swift_utils.get_local_numa_nodes(nodes))
+        get_irq_cpus.assert_called_with('eth0')
+
+    @patch.object(swift_utils, 'write_file')
+    @patch.object(swift_utils, 'get_swift_block_devices')
+    @patch.object(swift_utils, 'get_systemd_version')
+    @patch.object(swift_utils, 'init_is_systemd')
+    @patch('os.path.exists')
+    def test_setup_service_isolation(self, exists, init_is_systemd,
+                                     get_systemd_version, get_devices,
+                                     write_file):
+        exists.return_value = False
+        init_is_systemd.return_value = True
+        get_systemd_version.return_value = 237
+        get_devices.return_value = []
+        self.test_config.set('service-isolation', True)
+        swift_utils.setup_service_isolation()
+        self.assertEquals(len(swift_utils.SWIFT_SVCS), write_file.call_count)
+        write_file.assert_any_call(
+            '/etc/systemd/system/swift-object.service.d/'
+            '50-swift-storage-isolation.conf',
+            '# Managed by juju: swift-storage service-isolation\n'
+            '[Service]\nCPUWeight=500\nIOWeight=500\n', perms=0o644)
+        self.check_call.assert_called_with(['systemctl', 'daemon-reload'])
+
+    @patch.object(swift_utils, 'remove_files')
+    @patch.object(swift_utils, 'init_is_systemd')
+    @patch('os.path.exists')
+    def test_setup_service_isolation_disabled(self, exists, init_is_systemd,
+                                              remove_files):
+        init_is_systemd.return_value = True
+        exists.return_value = False
+        swift_utils.setup_service_isolation()
+        self.assertFalse(remove_files.called)
+        self.assertFalse(self.check_call.called)
+        exists.return_value = True
+        swift_utils.setup_service_isolation()
+        self.assertEquals(len(swift_utils.SWIFT_SVCS),
+                          remove_files.call_count)
+        self.check_call.assert_called_with(['systemctl', 'daemon-reload'])
+
+    @patch.object(swift_utils, 'kv')
+    @patch.object(swift_utils, 'close_port')
+    @patch.object(swift_utils, 'open_port')
+    @patch.object(swift_utils, 'service_start')
+    @patch.object(swift_utils, 'service_restart')
+    @patch.object(swift_utils, 'write_file')
+    @patch.object(swift_utils, 'file_hash')
+    @patch.object(swift_utils, 'rsync')
+    @patch.object(swift_utils, 'init_is_systemd')
+    @patch('os.path.exists')
+    def test_setup_exporter(self, exists, init_is_systemd, rsync, file_hash,
+                            write_file, service_restart,
+                            service_start, open_port, close_port, kv):
+        store = {}
+        kv.return_value.get.side_effect = store.get
+        kv.return_value.set.side_effect = store.__setitem__
+        self.is_paused.return_value = False
+        self.test_config.set('prometheus-exporter', True)
+        init_is_systemd.return_value = True
+        exists.return_value = False
+        file_hash.return_value = 'abc'
+        with patch.dict('os.environ', {'CHARM_DIR': '/charm'}):
+            swift_utils.setup_exporter()
+        rsync.assert_called_with('/charm/files/exporter/',
+                                 '/usr/local/lib/swift-storage-exporter')
+        unit = write_file.call_args[0][1]
+        self.assertTrue('ExecStart=/usr/bin/python /usr/local/lib/'
+                        'swift-storage-exporter/swift-storage-exporter '
+                        '--address 127.0.0.1 --port 9620\n' in unit)
+        self.check_call.assert_has_calls([
+            call(['systemctl', 'daemon-reload']),
+            call(['systemctl', 'enable', 'swift-storage-exporter'])])
+        service_restart.assert_called_with('swift-storage-exporter')
+        self.assertFalse(open_port.called)
+        self.assertFalse(close_port.called)
+
+        exists.return_value = True
+        service_restart.reset_mock()
+        self.test_config.set('prometheus-exporter-open-port', True)
+        with patch_open() as (_open, _file):
+            _file.read.return_value = unit
+            with patch.dict('os.environ', {'CHARM_DIR': '/charm'}):
+                swift_utils.setup_exporter()
+        self.assertFalse(service_restart.called)
+        service_start.assert_called_with('swift-storage-exporter')
+        open_port.assert_called_with(9620)
+        self.assertFalse(close_port.called)
+        self.assertEqual(store[swift_utils.EXPORTER_PORT_KEY], 9620)
+
+        # a new port closes the one opened before
+        self.test_config.set('prometheus-exporter-port', 9621)
+        with patch_open() as (_open, _file):
+            _file.read.return_value = unit
+            with patch.dict('os.environ', {'CHARM_DIR': '/charm'}):
+                swift_utils.setup_exporter()
+        close_port.assert_called_once_with(9620)
+        open_port.assert_called_with(9621)
+        self.assertEqual(store[swift_utils.EXPORTER_PORT_KEY], 9621)
+
+    @patch.object(swift_utils, 'kv')
+    @patch.object(swift_utils, 'open_port')
+    @patch.object(swift_utils, 'service_start')
+    @patch.object(swift_utils, 'service_restart')
+    @patch.object(swift_utils, 'write_file')
+    @patch.object(swift_utils, 'file_hash')
+    @patch.object(swift_utils, 'rsync')
+    @patch.object(swift_utils, 'init_is_systemd')
+    @patch('os.path.exists')
+    def test_setup_exporter_paused(self, exists, init_is_systemd, rsync,
+                                   file_hash, write_file, service_restart,
+                                   service_start, open_port, kv):
+        kv.return_value.get.return_value = None
+        self.is_paused.return_value = True
+        self.test_config.set('prometheus-exporter', True)
+        init_is_systemd.return_value = True
+        exists.return_value = False
+        with patch.dict('os.environ', {'CHARM_DIR': '/charm'}):
+            swift_utils.setup_exporter()
+        self.assertTrue(write_file.called)
+        self.assertFalse(service_restart.called)
+        self.assertFalse(service_start.called)
+
+    @patch.object(swift_utils, 'kv')
+    @patch.object(swift_utils, 'close_port')
+    @patch.object(swift_utils, 'remove_files')
+    @patch.object(swift_utils, 'service_stop')
+    @patch.object(swift_utils, 'init_is_systemd')
+    @patch('os.path.exists')
+    def test_setup_exporter_disabled(self, exists, init_is_systemd,
+                                     service_stop, remove_files, close_port,
+                                     kv):
+        store = {swift_utils.EXPORTER_PORT_KEY: 9621}
+        kv.return_value.get.side_effect = store.get
+        kv.return_value.set.side_effect = store.__setitem__
+        init_is_systemd.return_value = False
+        exists.return_value = True
+        swift_utils.setup_exporter()
+        service_stop.assert_called_with('swift-storage-exporter')
+        remove_files.assert_called_with([swift_utils.EXPORTER_UPSTART_JOB])
+        close_port.assert_called_once_with(9621)
+        self.assertEqual(store[swift_utils.EXPORTER_PORT_KEY], None)
+
+        close_port.reset_mock()
+        swift_utils.setup_exporter()
+        self.assertFalse(close_port.called)
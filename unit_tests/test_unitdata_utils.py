@@ -0,0 +1,149 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from test_utils import CharmTestCase
+
+import lib.unitdata_utils as unitdata_utils
+
+TO_PATCH = [
+    'config',
+    'log',
+]
+
+
+class UnitdataUtilsTests(CharmTestCase):
+
+    def setUp(self):
+        super(UnitdataUtilsTests, self).setUp(unitdata_utils, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.db = unitdata_utils.CompactStorage(
+            os.path.join(self.tmpdir, 'unit-state.db'))
+        self.addCleanup(self.db.close)
+
+    def run_hooks(self, count, key='env', scopes=1):
+        """Simulate count runs, each entering scopes hook scopes."""
+        for i in range(count):
+            self.db.start_run()
+            for j in range(scopes):
+                with self.db.hook_scope('hook-%d' % i):
+                    self.db.set(key, i * scopes + j)
+
+    def test_journal_mode(self):
+        self.db.cursor.execute('pragma journal_mode')
+        self.assertEqual(self.db.cursor.fetchone()[0], 'wal')
+
+    def test_busy_timeout(self):
+        self.db.cursor.execute('pragma busy_timeout')
+        self.assertEqual(self.db.cursor.fetchone()[0],
+                         unitdata_utils.BUSY_TIMEOUT)
+
+    def test_set_and_update(self):
+        self.db.set('a', {'x': 1})
+        self.db.update({'b': 2, 'c': [3]}, prefix='p.')
+        self.db.flush()
+        self.assertEqual(self.db.get('a'), {'x': 1})
+        self.assertEqual(self.db.getrange('p.', strip=True),
+                         {'b': 2, 'c': [3]})
+        self.db.update({'b': 4}, prefix='p.')
+        self.assertEqual(self.db.get('p.b'), 4)
+
+    def test_revisions_only_for_changes(self):
+        with self.db.hook_scope('one'):
+            self.db.update({'a': 1, 'b': 1})
+        with self.db.hook_scope('two'):
+            self.db.update({'a': 1, 'b': 2})
+            self.db.set('b', 3)
+        history = self.db.gethistory('b', deserialize=True)
+        self.assertEqual([(h[2], h[3]) for h in history],
+                         [(1, 'one'), (3, 'two')])
+        self.assertEqual(len(self.db.gethistory('a')), 1)
+
+    def test_prune(self):
+        self.run_hooks(5)
+        self.assertEqual(self.db.prune(2), 3)
+        self.assertEqual([h[2] for h in self.db.gethistory(
+            'env', deserialize=True)], [3, 4])
+        self.db.cursor.execute('select count(*) from hooks')
+        self.assertEqual(self.db.cursor.fetchone()[0], 2)
+        self.assertEqual(self.db.prune(2), 0)
+        self.assertEqual(self.db.prune(0), 0)
+
+    def test_prune_counts_runs(self):
+        # A run enters a hook scope for every HookData it uses.
+        self.run_hooks(3, scopes=3)
+        self.db.start_run()
+        self.assertEqual(self.db.prune(2), 6)
+        self.assertEqual([h[2] for h in self.db.gethistory(
+            'env', deserialize=True)], [6, 7, 8])
+        self.assertEqual(len(self.db.get(unitdata_utils.RUNS_KEY)), 2)
+
+    @patch.object(unitdata_utils.unitdata, 'kv')
+    def test_prune_unit_state(self, kv):
+        kv.return_value = self.db
+        self.run_hooks(3)
+        self.test_config.set('unit-state-retention', 1)
+        unitdata_utils.prune_unit_state()
+        self.assertEqual(len(self.db.gethistory('env')), 1)
+
+    @patch.object(unitdata_utils.unitdata, 'kv')
+    def test_prune_unit_state_disabled(self, kv):
+        kv.return_value = self.db
+        self.run_hooks(3)
+        self.test_config.set('unit-state-retention', 0)
+        unitdata_utils.prune_unit_state()
+        self.assertEqual(len(self.db.gethistory('env')), 3)
+        self.assertIsNone(self.db.get(unitdata_utils.RUNS_KEY))
+
+    @patch.object(unitdata_utils.CompactStorage, 'vacuum_in_background')
+    @patch.object(unitdata_utils.unitdata, 'kv')
+    def test_vacuum_unit_state(self, kv, vacuum_in_background):
+        kv.return_value = self.db
+        unitdata_utils.vacuum_unit_state()
+        self.assertFalse(vacuum_in_background.called)
+        with patch.object(unitdata_utils, 'VACUUM_FREE_RATIO', 0):
+            unitdata_utils.vacuum_unit_state()
+        self.assertTrue(vacuum_in_background.called)
+
+    @patch.object(unitdata_utils.hookenv, 'atexit')
+    @patch.object(unitdata_utils.unitdata, '_KV', None)
+    @patch.dict('os.environ', {})
+    def test_install(self, atexit):
+        os.environ['UNIT_STATE_DB'] = os.path.join(self.tmpdir, 'kv.db')
+        unitdata_utils.install()
+        db = unitdata_utils.unitdata.kv()
+        self.addCleanup(db.close)
+        self.assertIsInstance(db, unitdata_utils.CompactStorage)
+        unitdata_utils.install()
+        self.assertIs(unitdata_utils.unitdata.kv(), db)
+        atexit.assert_called_with(unitdata_utils.prune_unit_state)
+        self.assertEqual(db.get(unitdata_utils.RUNS_KEY), [1])
+
+    @patch.object(unitdata_utils.hookenv, 'atexit')
+    @patch.object(unitdata_utils.unitdata, '_KV', None)
+    @patch.dict('os.environ', {})
+    def test_install_retention_disabled(self, atexit):
+        """Runs are not recorded while unit-state-retention is 0."""
+        os.environ['UNIT_STATE_DB'] = os.path.join(self.tmpdir, 'kv.db')
+        self.test_config.set('unit-state-retention', 0)
+        unitdata_utils.install()
+        db = unitdata_utils.unitdata.kv()
+        self.addCleanup(db.close)
+        self.assertIsNone(db.get(unitdata_utils.RUNS_KEY))